@@ -1,20 +1,31 @@
 import logging
 import os
+import threading
 
 import valkey
 from flask import Flask
 from flask_compress import Compress
-from pymongo import MongoClient
+from pymongo.errors import PyMongoError
 
 from application.constants.app_constants import (
     DATABASE_CONFIG_KEY,
     BEERS_DATABASE_CONFIG_KEY,
     DISKS_DATABASE_CONFIG_KEY,
+    SCHEDULER_CONFIG_KEY,
 )
 from application.data.beer.dao import BeerDao
+from application.data.cache_cleanup import delete_legacy_keys
+from application.data.cache_warming import DEFAULT_WARM_DAYS_BACK, get_cache_warming_jobs
 from application.data.custom_json_encoder import CustomJsonEncoder
-from application.data.temperature.dao import ApplicationDao
+from application.data.indexes import IndexManager
+from application.data.mongo import create_mongo_client
+from application.data.scheduler import Scheduler
+from application.data.temperature.dao import DECIMATION_ENGINE_ROLLUP, ApplicationDao
+from application.data.temperature.latest_readings import LatestReadingsWatcher
+from application.data.temperature.view_snapshots import ViewSnapshotRefresher
 from application.data.disks.dao import DisksDao
+from application.routes.api_routes import API_BLUEPRINT
+from application.routes.metrics_routes import METRICS_BLUEPRINT
 from application.routes.html_routes import HTML_BLUEPRINT
 
 logging.basicConfig(level=logging.INFO)
@@ -25,6 +36,13 @@ LOG = logging.getLogger(__name__)
 
 COMPRESS = Compress()
 
+DEFAULT_ROLLUP_UPDATE_INTERVAL_SECONDS = 60
+DEFAULT_LATEST_READINGS_POLL_SECONDS = 5
+# Shorter than the beer cache TTL, so the lists are replaced before they expire
+DEFAULT_CACHE_WARM_INTERVAL_SECONDS = 30 * 60
+DEFAULT_CACHE_WARM_JITTER_SECONDS = 60
+DEFAULT_SCHEDULER_MAX_CONCURRENCY = 2
+
 
 def bytes_to_display(value: int) -> str:
     unit = 1024**4  # Start with terabytes
@@ -52,20 +70,58 @@ def create_flask_app() -> Flask:
     else:
         cache = None
 
-    username = os.environ.get("MONGO_USER")
-    password = os.environ.get("MONGO_PASSWORD")
-    host = os.environ.get("MONGO_HOST")
-    client = MongoClient(f"mongodb+srv://{username}:{password}@{host}/?retryWrites=true&w=majority")
+    if cache is not None:
+        # Entries written by older versions never expire on their own
+        threading.Thread(target=delete_legacy_keys, args=(cache,), name="cache-cleanup", daemon=True).start()
+
+    client = create_mongo_client()
+
+    # Report missing indexes and any query plan that scans or sorts in memory. Building an index on a large collection
+    # loads the cluster, so they are only created here when asked for.
+    create_indexes = os.environ.get("CREATE_INDEXES", "false") == "true"
+    threading.Thread(target=IndexManager(client).bootstrap, args=(create_indexes,), daemon=True).start()
 
     dao = ApplicationDao(client=client, cache=cache)
     app.config[DATABASE_CONFIG_KEY] = dao
 
+    # The rollups catch up with the readings before anything is warmed or served from them
+    if dao.decimation_engine == DECIMATION_ENGINE_ROLLUP:
+        try:
+            dao.rollups.update_all()
+        except PyMongoError:
+            LOG.exception("Failed to update the rollups. Days past them are calculated from raw readings until then.")
+
+    # Keep the snapshots of the temperature pages that are being viewed fresh
+    ViewSnapshotRefresher(dao.view_snapshots).start()
+
+    # One watcher follows the newest reading of every sensor for all requests and event streams
+    poll_interval = int(os.environ.get("LATEST_READINGS_POLL_SECONDS", DEFAULT_LATEST_READINGS_POLL_SECONDS))
+    LatestReadingsWatcher(dao.latest_readings, poll_interval_seconds=poll_interval).start()
+
     beer_dao = BeerDao(client=client, cache=cache)
     app.config[BEERS_DATABASE_CONFIG_KEY] = beer_dao
 
     disks_dao = DisksDao(client=client, cache=cache)
     app.config[DISKS_DATABASE_CONFIG_KEY] = disks_dao
 
+    # Build the common views at startup and keep rebuilding them, so no visitor waits for a cold cache
+    warm_days_back = os.environ.get("WARM_DAYS_BACK")
+    jobs = get_cache_warming_jobs(
+        dao,
+        beer_dao,
+        disks_dao,
+        interval_seconds=int(os.environ.get("CACHE_WARM_INTERVAL_SECONDS", DEFAULT_CACHE_WARM_INTERVAL_SECONDS)),
+        jitter_seconds=int(os.environ.get("CACHE_WARM_JITTER_SECONDS", DEFAULT_CACHE_WARM_JITTER_SECONDS)),
+        days_back_list=[int(d) for d in warm_days_back.split(",")] if warm_days_back else DEFAULT_WARM_DAYS_BACK,
+        rollup_interval_seconds=int(
+            os.environ.get("ROLLUP_UPDATE_INTERVAL_SECONDS", DEFAULT_ROLLUP_UPDATE_INTERVAL_SECONDS)
+        ),
+    )
+    max_concurrency = int(os.environ.get("SCHEDULER_MAX_CONCURRENCY", DEFAULT_SCHEDULER_MAX_CONCURRENCY))
+    scheduler = Scheduler(jobs, max_concurrency=max_concurrency)
+    scheduler.start()
+    app.config[SCHEDULER_CONFIG_KEY] = scheduler
+
     # This must be set in the environment as a secret
     app.secret_key = os.environ["SECRET_KEY"]
 
@@ -74,5 +130,7 @@ def create_flask_app() -> Flask:
 
     # Register blueprints to add routes to the app
     app.register_blueprint(HTML_BLUEPRINT)
+    app.register_blueprint(API_BLUEPRINT)
+    app.register_blueprint(METRICS_BLUEPRINT)
 
     return app
@@ -4,12 +4,16 @@ import waitress
 
 from application import create_flask_app
 
+# Every open temperature event stream holds a thread, so allow more than the waitress default
+DEFAULT_THREADS = 32
+
 
 def main():
     host = os.environ.get("WAITRESS_HOST", "127.0.0.1")
     port = os.environ.get("PORT", 10000)
+    threads = int(os.environ.get("WAITRESS_THREADS", DEFAULT_THREADS))
 
-    waitress.serve(create_flask_app(), listen=f"{host}:{port}")
+    waitress.serve(create_flask_app(), listen=f"{host}:{port}", threads=threads)
 
 
 if __name__ == "__main__":
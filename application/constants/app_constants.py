@@ -1,10 +1,13 @@
 # Logic
 DEFAULT_TIMEZONE = "America/Chicago"
+# The most days of temperature history served at once
+MAX_RANGE_DAYS = 3 * 366
 
 # Key to use when accessing flask app config
 DATABASE_CONFIG_KEY = "DB"
 BEERS_DATABASE_CONFIG_KEY = "BEER_DB"
 DISKS_DATABASE_CONFIG_KEY = "DISKS_DB"
+SCHEDULER_CONFIG_KEY = "SCHEDULER"
 
 # Cache
 DATE_FORMAT_STRING = "%Y-%m-%d"
@@ -1,6 +1,5 @@
 import logging
 import os
-import pickle
 from collections import defaultdict
 from statistics import median
 from typing import Optional
@@ -25,12 +24,31 @@ from application.data.beer.brewery import Brewery
 from application.data.beer.country import Country
 from application.data.beer.missing_style import MissingStyle
 from application.data.beer.style import Style
+from application.data.circuit_breaker import CircuitBreaker
+from application.data.local_cache import get_local_cache
+from application.data.metrics import time_stage, timed_iter
+from application.data.mongo import BATCH_SIZE
+from application.data.value_cache import ValueCache
 
 LOG = logging.getLogger(__name__)
 
+# Only the fields that end up in the data classes are read
+BEER_PROJECTION = {
+    "_id": 0,
+    "name": 1,
+    "id": 1,
+    "brewery": 1,
+    "brewery_id": 1,
+    "rating": 1,
+    "style": 1,
+    "abv": 1,
+    "first_checkin": 1,
+}
+BREWERY_PROJECTION = {"_id": 0, "id": 1, "name": 1, "type": 1, "full_location": 1}
+
 
 class BeerDao:
-    def __init__(self, client, database: Database = None, cache: valkey.Valkey = None):
+    def __init__(self, client, database: Database = None, cache: valkey.Valkey = None, breaker: CircuitBreaker = None):
         # If no cache is given, spin up a fake one
         if cache is None:
             self.cache = fakeredis.FakeValkey()
@@ -42,6 +60,10 @@ class BeerDao:
             LOG.info("Flushing cache")
             self.cache.flushall()
 
+        # While the database is failing or slow, stale values are served instead. Hot lists are also kept unpickled
+        # in the process.
+        self.values = ValueCache(self.cache, BEER_CACHE_TTL, breaker=breaker, local_cache=get_local_cache())
+
         self.client = client
         # If no database provided, connect to one
         if database is None:
@@ -55,20 +77,18 @@ class BeerDao:
 
         LOG.info(f"Database collections: {self.database.list_collection_names()}")
 
-    def get_beers(self, username: Optional[str] = None) -> list[Beer]:
+    def get_beers(self, username: Optional[str] = None, refresh: bool = False) -> list[Beer]:
         if username:
             cache_key = f"beer_list_{username}"
         else:
             cache_key = "beer_list"
 
-        serialized_beer_list = self.cache.get(cache_key)
-        if serialized_beer_list:
-            # noinspection PyTypeChecker
-            return pickle.loads(serialized_beer_list)
+        return self.values.get_or_build(cache_key, lambda: self._load_beers(username), refresh)
 
+    def _load_beers(self, username: Optional[str]) -> list[Beer]:
         brewery_id_to_country = dict()
-        breweries_documents = self.breweries_collection.find()
-        for brewery_document in breweries_documents:
+        breweries_documents = self.breweries_collection.find(projection={"_id": 0, "id": 1, "full_location": 1})
+        for brewery_document in timed_iter(breweries_documents, "mongo_query", "breweries"):
             brewery_id = brewery_document["id"]
             brewery_id_to_country[brewery_id] = self._get_country(brewery_document["full_location"])
 
@@ -79,9 +99,9 @@ class BeerDao:
         else:
             raise ValueError("Unknown username")
 
-        beer_documents = collection.find()
+        beer_documents = collection.find(projection=BEER_PROJECTION, batch_size=BATCH_SIZE)
         beers = []
-        for beer_document in beer_documents:
+        for beer_document in timed_iter(beer_documents, "mongo_query", collection.name):
             brewery_id = beer_document["brewery_id"]
             beer = Beer(
                 name=beer_document["name"],
@@ -96,22 +116,17 @@ class BeerDao:
             )
             beers.append(beer)
 
-        serialized_data = pickle.dumps(beers)
-        self.cache.set(cache_key, serialized_data, ex=BEER_CACHE_TTL)
-
         return beers
 
-    def get_breweries(self) -> list[Brewery]:
-        serialized_breweries_list = self.cache.get("breweries_list")
-        if serialized_breweries_list:
-            # noinspection PyTypeChecker
-            return pickle.loads(serialized_breweries_list)
+    def get_breweries(self, refresh: bool = False) -> list[Brewery]:
+        return self.values.get_or_build("breweries_list", self._load_breweries, refresh)
 
-        documents = self.breweries_collection.find()
+    def _load_breweries(self) -> list[Brewery]:
+        documents = self.breweries_collection.find(projection=BREWERY_PROJECTION)
         brewery_id_to_beers = self._get_brewery_to_beers()
 
         breweries = []
-        for document in documents:
+        for document in timed_iter(documents, "mongo_query", "breweries"):
             full_location = document["full_location"]
             brewery_id = document["id"]
 
@@ -137,9 +152,6 @@ class BeerDao:
             )
             breweries.append(brewery)
 
-        serialized_data = pickle.dumps(breweries)
-        self.cache.set("breweries_list", serialized_data, ex=BEER_CACHE_TTL)
-
         return breweries
 
     @staticmethod
@@ -151,12 +163,10 @@ class BeerDao:
 
         return "?"
 
-    def get_countries(self) -> list[Country]:
-        serialized_countries_list = self.cache.get("countries_list")
-        if serialized_countries_list:
-            # noinspection PyTypeChecker
-            return pickle.loads(serialized_countries_list)
+    def get_countries(self, refresh: bool = False) -> list[Country]:
+        return self.values.get_or_build("countries_list", self._load_countries, refresh)
 
+    def _load_countries(self) -> list[Country]:
         breweries = self.get_breweries()
         country_to_breweries = defaultdict(list)
         for brewery in breweries:
@@ -189,9 +199,6 @@ class BeerDao:
                 )
             )
 
-        serialized_data = pickle.dumps(countries)
-        self.cache.set("countries_list", serialized_data, ex=BEER_CACHE_TTL)
-
         return countries
 
     def _get_brewery_to_beers(self) -> dict[str, list[Beer]]:
@@ -204,12 +211,10 @@ class BeerDao:
 
         return brewery_id_to_beers
 
-    def get_styles(self) -> list[Style]:
-        serialized_styles_list = self.cache.get("styles_list")
-        if serialized_styles_list:
-            # noinspection PyTypeChecker
-            return pickle.loads(serialized_styles_list)
+    def get_styles(self, refresh: bool = False) -> list[Style]:
+        return self.values.get_or_build("styles_list", self._load_styles, refresh)
 
+    def _load_styles(self) -> list[Style]:
         beers = self.get_beers()
         style_to_beers = defaultdict(list)
         for beer in beers:
@@ -237,20 +242,15 @@ class BeerDao:
             )
             styles.append(style)
 
-        serialized_data = pickle.dumps(styles)
-        self.cache.set("styles_list", serialized_data, ex=BEER_CACHE_TTL)
-
         return styles
 
-    def get_missing_styles(self) -> list[MissingStyle]:
-        cache_key = "missing_styles"
-        serialized_styles_list = self.cache.get(cache_key)
-        if serialized_styles_list:
-            # noinspection PyTypeChecker
-            return pickle.loads(serialized_styles_list)
+    def get_missing_styles(self, refresh: bool = False) -> list[MissingStyle]:
+        return self.values.get_or_build("missing_styles", self._load_missing_styles, refresh)
 
-        had_styles_main = set(self.beers_collection.distinct("style"))
-        had_styles_rowdy = set(self.beers_rowdy_collection.distinct("style"))
+    def _load_missing_styles(self) -> list[MissingStyle]:
+        with time_stage("mongo_query", "styles"):
+            had_styles_main = set(self.beers_collection.distinct("style"))
+            had_styles_rowdy = set(self.beers_rowdy_collection.distinct("style"))
 
         missing_styles = []
         for style_name in STYLES:
@@ -266,7 +266,4 @@ class BeerDao:
                     )
                 )
 
-        serialized_data = pickle.dumps(missing_styles)
-        self.cache.set(cache_key, serialized_data, ex=BEER_CACHE_TTL)
-
         return missing_styles
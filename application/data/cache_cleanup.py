@@ -0,0 +1,65 @@
+"""
+Deletes the cache entries that older versions of the app wrote without an expiry and no longer read.
+Run from the root of the repo with:
+
+    python -m application.data.cache_cleanup [--dry-run]
+"""
+
+import argparse
+import logging
+import os
+import re
+from typing import Iterator
+
+import valkey
+
+LOG = logging.getLogger(__name__)
+
+# Days used to be cached once per decimation level as <sensor>_<date>_<periods per day>
+LEGACY_DAY_KEY_PATTERN = re.compile(r"^.+_\d{4}-\d{2}-\d{2}_\d+$")
+SCAN_MATCH = "*_????-??-??_*"
+SCAN_COUNT = 1000
+DELETE_BATCH_SIZE = 500
+
+
+def find_legacy_keys(cache: valkey.Valkey) -> Iterator[bytes]:
+    for key in cache.scan_iter(match=SCAN_MATCH, count=SCAN_COUNT):
+        if LEGACY_DAY_KEY_PATTERN.match(key.decode()):
+            yield key
+
+
+def delete_legacy_keys(cache: valkey.Valkey, dry_run: bool = False) -> int:
+    """Deletes the legacy entries a batch at a time and returns how many there were"""
+    deleted = 0
+    batch = []
+    for key in find_legacy_keys(cache):
+        batch.append(key)
+        if len(batch) >= DELETE_BATCH_SIZE:
+            deleted += _delete(cache, batch, dry_run)
+            batch = []
+    if batch:
+        deleted += _delete(cache, batch, dry_run)
+
+    if deleted:
+        LOG.info(f"{'Found' if dry_run else 'Deleted'} {deleted} legacy cache entries")
+    return deleted
+
+
+def _delete(cache: valkey.Valkey, keys: list, dry_run: bool) -> int:
+    if not dry_run:
+        cache.unlink(*keys)
+    return len(keys)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete the cache entries older versions of the app left behind")
+    parser.add_argument("--dry-run", action="store_true", help="only count the entries")
+    args = parser.parse_args()
+
+    cache = valkey.Valkey.from_url(os.environ["REDIS_DATA_URL"])
+    count = delete_legacy_keys(cache, dry_run=args.dry_run)
+    print(f"{'Found' if args.dry_run else 'Deleted'} {count} legacy cache entries")
+
+
+if __name__ == "__main__":
+    main()
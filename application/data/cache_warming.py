@@ -0,0 +1,62 @@
+import logging
+from typing import List
+
+from application.constants.beer_constants import ROWDY_USERNAME
+from application.data.beer.dao import BeerDao
+from application.data.disks.dao import DisksDao
+from application.data.scheduler import Job
+from application.data.temperature.dao import ApplicationDao, DECIMATION_ENGINE_ROLLUP
+from application.data.temperature.view_snapshots import SNAPSHOT_DAYS_BACK
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_WARM_DAYS_BACK = list(SNAPSHOT_DAYS_BACK)
+
+
+def warm_temperatures(dao: ApplicationDao, days_back_list: List[int]):
+    # Rebuilding the snapshot of a view also fills the day entries it is made of, so a longer range only adds the
+    # days that a shorter one did not already compute. Ranges without snapshots would never be read back from one,
+    # so only their days are filled.
+    for sensor_id in dao.sensors.get_sensor_ids(refresh=True):
+        for days_back in sorted(days_back_list):
+            if days_back in SNAPSHOT_DAYS_BACK:
+                dao.view_snapshots.refresh(((sensor_id,), days_back, None))
+            else:
+                dao.get_temperature_histories([sensor_id], days_back)
+            LOG.debug(f"Warmed {days_back} days of {sensor_id}")
+
+
+def warm_beers(beer_dao: BeerDao):
+    beer_dao.get_beers(refresh=True)
+    beer_dao.get_beers(username=ROWDY_USERNAME, refresh=True)
+    beer_dao.get_breweries(refresh=True)
+    beer_dao.get_countries(refresh=True)
+    beer_dao.get_styles(refresh=True)
+    beer_dao.get_missing_styles(refresh=True)
+
+
+def warm_disks(disks_dao: DisksDao):
+    disks_dao.get_drive_letter_to_data(refresh=True)
+
+
+def get_cache_warming_jobs(
+    dao: ApplicationDao,
+    beer_dao: BeerDao,
+    disks_dao: DisksDao,
+    interval_seconds: float,
+    jitter_seconds: float,
+    days_back_list: List[int],
+    rollup_interval_seconds: float,
+) -> List[Job]:
+    jobs = []
+    # Rollups are only read by the rollup engine, so only keep them up to date when it is in use. The first update
+    # runs when the app is created, before any of the other jobs.
+    if dao.decimation_engine == DECIMATION_ENGINE_ROLLUP:
+        jobs.append(Job("rollups", dao.rollups.update_all, rollup_interval_seconds, run_at_start=False))
+
+    jobs += [
+        Job("temperatures", lambda: warm_temperatures(dao, days_back_list), interval_seconds, jitter_seconds),
+        Job("beers", lambda: warm_beers(beer_dao), interval_seconds, jitter_seconds),
+        Job("disks", lambda: warm_disks(disks_dao), interval_seconds, jitter_seconds),
+    ]
+    return jobs
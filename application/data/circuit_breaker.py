@@ -0,0 +1,152 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+LOG = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+# Out of the last WINDOW_SIZE calls, this many failing or being slow opens the circuit
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_WINDOW_SIZE = 20
+# Slower than any query of a page, so only a struggling database counts as slow
+DEFAULT_SLOW_CALL_SECONDS = 2.0
+# How long to serve from the cache alone before letting a call through to try the database again
+DEFAULT_OPEN_SECONDS = 30.0
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the database while the circuit is open"""
+
+    def __init__(self, retry_after_seconds: float):
+        super().__init__(f"The database is unavailable. Try again in {retry_after_seconds:.0f} s.")
+        self.retry_after_seconds = retry_after_seconds
+
+
+@dataclass
+class BreakerStats:
+    state: str
+    recent_failures: int
+    times_opened: int
+    rejected_calls: int
+
+
+class CircuitBreaker:
+    """
+    Tracks how the database is doing and stops calling it when it is failing or slow, so requests are served from
+    the cache alone instead of each waiting for a timeout. After a while one call is let through, and the circuit
+    closes again if it goes well.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        window_size: int = DEFAULT_WINDOW_SIZE,
+        slow_call_seconds: float = DEFAULT_SLOW_CALL_SECONDS,
+        open_seconds: float = DEFAULT_OPEN_SECONDS,
+    ):
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.state = STATE_CLOSED
+        self._outcomes = deque(maxlen=window_size)
+        self._opened_at = 0.0
+        self._probe_started_at: Optional[float] = None
+        self._times_opened = 0
+        self._rejected_calls = 0
+        self._lock = threading.Lock()
+
+    @property
+    def is_closed(self) -> bool:
+        return self.state == STATE_CLOSED
+
+    def allow_request(self) -> bool:
+        """
+        Whether the database may be called now. Once the circuit has been open long enough, one caller is let through
+        to probe it.
+        """
+        with self._lock:
+            if self.state == STATE_CLOSED:
+                return True
+
+            now = time.monotonic()
+            if self.state == STATE_OPEN and now - self._opened_at >= self.open_seconds:
+                self.state = STATE_HALF_OPEN
+                self._probe_started_at = None
+            # A probe that never reported back, such as one that failed before reaching the database, is replaced
+            if self.state == STATE_HALF_OPEN and (
+                self._probe_started_at is None or now - self._probe_started_at >= self.open_seconds
+            ):
+                self._probe_started_at = now
+                return True
+
+            self._rejected_calls += 1
+            return False
+
+    def check(self):
+        """Raises CircuitOpenError unless the database may be called now"""
+        if not self.allow_request():
+            raise CircuitOpenError(self.get_retry_after_seconds())
+
+    def get_retry_after_seconds(self) -> float:
+        with self._lock:
+            return max(self.open_seconds - (time.monotonic() - self._opened_at), 1.0)
+
+    def record(self, seconds: float, failed: bool = False):
+        """Records how a call to the database went"""
+        bad = failed or seconds >= self.slow_call_seconds
+        with self._lock:
+            if self.state == STATE_HALF_OPEN:
+                if bad:
+                    self._open(f"the probe {'failed' if failed else f'took {seconds:.1f} s'}")
+                else:
+                    LOG.info("Database calls are going through again, closing the circuit")
+                    self.state = STATE_CLOSED
+                    self._outcomes.clear()
+                return
+
+            self._outcomes.append(bad)
+            if self.state == STATE_CLOSED and sum(self._outcomes) >= self.failure_threshold:
+                self._open(f"{sum(self._outcomes)} of the last {len(self._outcomes)} calls failed or were slow")
+
+    def stats(self) -> BreakerStats:
+        with self._lock:
+            return BreakerStats(
+                state=self.state,
+                recent_failures=sum(self._outcomes),
+                times_opened=self._times_opened,
+                rejected_calls=self._rejected_calls,
+            )
+
+    def _open(self, reason: str):
+        LOG.warning(f"Opening the database circuit for {self.open_seconds:.0f} s because {reason}")
+        self.state = STATE_OPEN
+        self._opened_at = time.monotonic()
+        self._times_opened += 1
+        self._outcomes.clear()
+
+
+_MONGO_CIRCUIT_BREAKER: Optional[CircuitBreaker] = None
+_MONGO_CIRCUIT_BREAKER_LOCK = threading.Lock()
+
+
+def get_mongo_circuit_breaker() -> CircuitBreaker:
+    global _MONGO_CIRCUIT_BREAKER
+
+    with _MONGO_CIRCUIT_BREAKER_LOCK:
+        if _MONGO_CIRCUIT_BREAKER is None:
+            _MONGO_CIRCUIT_BREAKER = CircuitBreaker(
+                failure_threshold=int(os.environ.get("MONGO_BREAKER_FAILURES", DEFAULT_FAILURE_THRESHOLD)),
+                window_size=int(os.environ.get("MONGO_BREAKER_WINDOW", DEFAULT_WINDOW_SIZE)),
+                slow_call_seconds=float(os.environ.get("MONGO_BREAKER_SLOW_MS", DEFAULT_SLOW_CALL_SECONDS * 1000))
+                / 1000,
+                open_seconds=float(os.environ.get("MONGO_BREAKER_OPEN_SECONDS", DEFAULT_OPEN_SECONDS)),
+            )
+
+        return _MONGO_CIRCUIT_BREAKER
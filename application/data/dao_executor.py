@@ -0,0 +1,100 @@
+import contextvars
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from application.data.profiler import working_for_request
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 10
+DEFAULT_MAX_QUEUE_SIZE = 1000
+
+
+@dataclass
+class ExecutorStats:
+    max_workers: int
+    max_queue_size: int
+    queue_depth: int
+    active_workers: int
+    completed_tasks: int
+
+
+class DaoExecutor:
+    """
+    A bounded thread pool shared by the whole process for database and cache work.
+    Submitting blocks once max_queue_size tasks are waiting, so a burst of requests cannot queue work without limit.
+    Tasks must not wait on other tasks from the same executor, or a full pool could deadlock.
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS, max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE):
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dao")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue_size)
+        self._lock = threading.Lock()
+        self._queue_depth = 0
+        self._active_workers = 0
+        self._completed_tasks = 0
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        self._slots.acquire()
+        with self._lock:
+            self._queue_depth += 1
+
+        try:
+            # Tasks run in a copy of the submitter's context, so they are timed as part of its request
+            return self._executor.submit(contextvars.copy_context().run, self._run, fn, *args, **kwargs)
+        except Exception:
+            with self._lock:
+                self._queue_depth -= 1
+            self._slots.release()
+            raise
+
+    def stats(self) -> ExecutorStats:
+        with self._lock:
+            return ExecutorStats(
+                max_workers=self.max_workers,
+                max_queue_size=self.max_queue_size,
+                queue_depth=self._queue_depth,
+                active_workers=self._active_workers,
+                completed_tasks=self._completed_tasks,
+            )
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, fn: Callable, *args, **kwargs):
+        with self._lock:
+            self._queue_depth -= 1
+            self._active_workers += 1
+
+        try:
+            with working_for_request():
+                return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._active_workers -= 1
+                self._completed_tasks += 1
+            self._slots.release()
+
+
+_DAO_EXECUTOR: Optional[DaoExecutor] = None
+_DAO_EXECUTOR_LOCK = threading.Lock()
+
+
+def get_dao_executor() -> DaoExecutor:
+    global _DAO_EXECUTOR
+
+    with _DAO_EXECUTOR_LOCK:
+        if _DAO_EXECUTOR is None:
+            max_workers = int(os.environ.get("DAO_EXECUTOR_WORKERS", DEFAULT_MAX_WORKERS))
+            max_queue_size = int(os.environ.get("DAO_EXECUTOR_QUEUE_SIZE", DEFAULT_MAX_QUEUE_SIZE))
+            LOG.info(f"Starting DAO executor with {max_workers} workers and a queue of {max_queue_size}")
+            _DAO_EXECUTOR = DaoExecutor(max_workers=max_workers, max_queue_size=max_queue_size)
+
+        return _DAO_EXECUTOR
@@ -1,6 +1,5 @@
 import logging
 import os
-import pickle
 from collections import defaultdict
 from datetime import timedelta
 
@@ -10,6 +9,11 @@ from pymongo.synchronous.collection import Collection
 from pymongo.synchronous.database import Database
 
 from application.data.disks.drive import Drive
+from application.data.circuit_breaker import CircuitBreaker
+from application.data.local_cache import get_local_cache
+from application.data.metrics import timed_iter
+from application.data.mongo import BATCH_SIZE
+from application.data.value_cache import ValueCache
 
 LOG = logging.getLogger(__name__)
 
@@ -17,10 +21,11 @@ DB_NAME = "disks"
 COLLECTION_NAME = "space"
 DISKS_CACHE_TTL = timedelta(days=1)
 DRIVES_LIST_CACHE_KEY = "drives_list"
+DRIVE_PROJECTION = {"_id": 0, "timestamp": 1, "drive_letter": 1, "free_bytes": 1, "capacity_bytes": 1}
 
 
 class DisksDao:
-    def __init__(self, client, database: Database = None, cache: valkey.Valkey = None):
+    def __init__(self, client, database: Database = None, cache: valkey.Valkey = None, breaker: CircuitBreaker = None):
         # If no cache is given, spin up a fake one
         if cache is None:
             self.cache = fakeredis.FakeValkey()
@@ -32,6 +37,10 @@ class DisksDao:
             LOG.info("Flushing cache")
             self.cache.flushall()
 
+        # While the database is failing or slow, stale values are served instead. Hot lists are also kept unpickled
+        # in the process.
+        self.values = ValueCache(self.cache, DISKS_CACHE_TTL, breaker=breaker, local_cache=get_local_cache())
+
         self.client = client
         # If no database provided, connect to one
         if database is None:
@@ -43,17 +52,15 @@ class DisksDao:
 
         LOG.info(f"Database collections: {self.database.list_collection_names()}")
 
-    def get_drive_letter_to_data(self) -> dict[str, list[Drive]]:
-        serialized_drives_list = self.cache.get(DRIVES_LIST_CACHE_KEY)
-        if serialized_drives_list:
-            # noinspection PyTypeChecker
-            return pickle.loads(serialized_drives_list)
+    def get_drive_letter_to_data(self, refresh: bool = False) -> dict[str, list[Drive]]:
+        return self.values.get_or_build(DRIVES_LIST_CACHE_KEY, self._load_drive_letter_to_data, refresh)
 
+    def _load_drive_letter_to_data(self) -> dict[str, list[Drive]]:
         # Get documents from oldest to newest
-        documents = self.collection.find().sort("timestamp", 1)
+        documents = self.collection.find(projection=DRIVE_PROJECTION, batch_size=BATCH_SIZE).sort("timestamp", 1)
 
         drive_letter_to_data = defaultdict(list)
-        for document in documents:
+        for document in timed_iter(documents, "mongo_query", COLLECTION_NAME):
             free_bytes = document["free_bytes"]
             capacity_bytes = document["capacity_bytes"]
             drive = Drive(
@@ -65,7 +72,4 @@ class DisksDao:
             )
             drive_letter_to_data[drive.drive_letter].append(drive)
 
-        serialized_data = pickle.dumps(drive_letter_to_data)
-        self.cache.set(DRIVES_LIST_CACHE_KEY, serialized_data, ex=DISKS_CACHE_TTL)
-
         return drive_letter_to_data
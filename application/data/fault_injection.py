@@ -0,0 +1,124 @@
+import logging
+import random
+import threading
+import time
+from typing import Tuple
+
+from pymongo.errors import AutoReconnect
+
+from application.data.circuit_breaker import CircuitBreaker, get_mongo_circuit_breaker
+
+LOG = logging.getLogger(__name__)
+
+# The collection methods that go to the database. Anything else is passed straight through.
+DATABASE_OPERATIONS = {
+    "aggregate",
+    "aggregate_raw_batches",
+    "bulk_write",
+    "count_documents",
+    "delete_many",
+    "delete_one",
+    "distinct",
+    "estimated_document_count",
+    "find",
+    "find_one",
+    "find_one_and_update",
+    "find_raw_batches",
+    "insert_many",
+    "insert_one",
+    "replace_one",
+    "update_many",
+    "update_one",
+}
+
+
+# The delay injected before the operation each thread is about to send
+_INJECTED_DELAY = threading.local()
+
+
+def pop_injected_delay() -> float:
+    """The delay injected before the command this thread is sending, which the driver does not time"""
+    delay = getattr(_INJECTED_DELAY, "seconds", 0.0)
+    _INJECTED_DELAY.seconds = 0.0
+    return delay
+
+
+def parse_delay_range(value: str) -> Tuple[float, float]:
+    # Either a fixed delay such as "500" or a range such as "200-3000", in milliseconds
+    low, _, high = value.partition("-")
+    return float(low) / 1000, float(high or low) / 1000
+
+
+class FaultInjector:
+    def __init__(self, delay_seconds: Tuple[float, float], error_rate: float, breaker: CircuitBreaker):
+        self.delay_seconds = delay_seconds
+        self.error_rate = error_rate
+        self.breaker = breaker
+
+    def before_operation(self, name: str):
+        delay = random.uniform(*self.delay_seconds)
+        time.sleep(delay)
+        # An injected failure never sends a command, so it is reported to the breaker here. An injected delay is added
+        # to the duration of the command that follows it, so each operation is still only reported once.
+        if random.random() < self.error_rate:
+            self.breaker.record(delay, failed=True)
+            raise AutoReconnect(f"Injected failure of {name}")
+        _INJECTED_DELAY.seconds = delay
+
+
+class FaultInjectingCollection:
+    def __init__(self, collection, injector: FaultInjector):
+        self._collection = collection
+        self._injector = injector
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._collection, name)
+        if name not in DATABASE_OPERATIONS:
+            return attribute
+
+        def operation(*args, **kwargs):
+            self._injector.before_operation(name)
+            return attribute(*args, **kwargs)
+
+        return operation
+
+
+class FaultInjectingDatabase:
+    def __init__(self, database, injector: FaultInjector):
+        self._database = database
+        self._injector = injector
+
+    def __getitem__(self, name: str) -> FaultInjectingCollection:
+        return FaultInjectingCollection(self._database[name], self._injector)
+
+    def __getattr__(self, name: str):
+        return getattr(self._database, name)
+
+
+class FaultInjectingClient:
+    """
+    Wraps a client, such as one connected to a local server, and slows down or fails its operations, so timeouts,
+    the circuit breaker and stale cache entries can be tried out without breaking a real cluster.
+    """
+
+    def __init__(
+        self,
+        client,
+        delay_seconds: Tuple[float, float] = (0.0, 0.0),
+        error_rate: float = 0.0,
+        breaker: CircuitBreaker = None,
+    ):
+        if breaker is None:
+            breaker = get_mongo_circuit_breaker()
+        self._client = client
+        self.injector = FaultInjector(delay_seconds, error_rate, breaker)
+        LOG.warning(
+            f"Injecting delays of {delay_seconds[0] * 1000:.0f} to {delay_seconds[1] * 1000:.0f} ms and failing "
+            f"{error_rate:.0%} of database operations"
+        )
+
+    def __getitem__(self, name: str) -> FaultInjectingDatabase:
+        return FaultInjectingDatabase(self._client[name], self.injector)
+
+    def __getattr__(self, name: str):
+        return getattr(self._client, name)
@@ -0,0 +1,40 @@
+"""
+Reports missing indexes and hot queries that scan a collection or sort in memory.
+Run from the root of the repo with:
+
+    python -m application.data.index_report [--create]
+"""
+
+import argparse
+
+from application.data.indexes import IndexManager
+from application.data.mongo import create_mongo_client
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the indexes and query plans of the hot queries")
+    parser.add_argument("--create", action="store_true", help="create the missing indexes first")
+    args = parser.parse_args()
+
+    index_manager = IndexManager(create_mongo_client())
+    if args.create:
+        print(f"Ensured {index_manager.ensure_indexes()} indexes")
+
+    missing = index_manager.get_missing_indexes()
+    print(f"{len(missing)} missing indexes")
+    for spec in missing:
+        print(f"  {spec.database}.{spec.collection} {spec.keys}{' unique' if spec.unique else ''}")
+
+    print("Query plans")
+    for report in index_manager.check_query_plans():
+        if report.error:
+            status = f"ERROR {report.error}"
+        elif report.problems:
+            status = f"PROBLEM {', '.join(report.problems)}"
+        else:
+            status = "OK"
+        print(f"  {report.name:<30} {status:<20} {' <- '.join(report.stages)}")
+
+
+if __name__ == "__main__":
+    main()
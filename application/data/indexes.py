@@ -0,0 +1,229 @@
+import datetime
+import logging
+from dataclasses import dataclass, field
+from typing import Iterator, List, Tuple
+
+import pytz
+from pymongo import ASCENDING, DESCENDING, MongoClient
+from pymongo.errors import PyMongoError
+
+from application.constants.app_constants import DEFAULT_TIMEZONE
+
+from application.constants.beer_constants import (
+    BEERS_COLLECTION_NAME,
+    BEERS_ROWDY_COLLECTION_NAME,
+    BREWERIES_COLLECTION_NAME,
+    DB_NAME as BEERS_DATABASE_NAME,
+)
+from application.data.disks.dao import COLLECTION_NAME as DISKS_COLLECTION_NAME, DB_NAME as DISKS_DATABASE_NAME
+from application.data.temperature.dao import (
+    BASE_PERIODS_PER_DAY,
+    DATABASE_NAME as TEMPERATURE_DATABASE_NAME,
+    ROLLUP_BUCKET_PROJECTION,
+)
+from application.data.temperature.decimation import (
+    READING_PROJECTION,
+    get_contiguous_ranges,
+    get_day_bounds,
+    get_days_pipeline,
+    get_range_filter,
+    to_epoch_ms,
+)
+from application.data.temperature.latest_readings import LATEST_READINGS_PIPELINE
+from application.data.temperature.rollups import ROLLUP_COLLECTION_NAME
+from application.data.temperature.tiles import MAX_ZOOM, get_tile_bounds, get_tile_filter, get_tile_span_in_ms
+
+LOG = logging.getLogger(__name__)
+
+PITEMP_COLLECTION_NAME = "pitemp"
+# Stages that mean a query reads the whole collection or sorts in memory
+PROBLEM_STAGES = {"COLLSCAN", "SORT"}
+
+
+@dataclass
+class IndexSpec:
+    database: str
+    collection: str
+    keys: List[Tuple[str, int]]
+    unique: bool = False
+
+
+@dataclass
+class HotQuery:
+    name: str
+    database: str
+    # An explainable command such as find or distinct
+    command: dict
+
+
+@dataclass
+class PlanReport:
+    name: str
+    stages: List[str]
+    problems: List[str] = field(default_factory=list)
+    error: str = None
+
+
+def get_required_indexes() -> List[IndexSpec]:
+    return [
+        # Serves day ranges sorted either way, the newest reading of a sensor and the newest reading of every sensor
+        IndexSpec(
+            TEMPERATURE_DATABASE_NAME, PITEMP_COLLECTION_NAME, [("sensorId", ASCENDING), ("timestamp", DESCENDING)]
+        ),
+        IndexSpec(
+            TEMPERATURE_DATABASE_NAME, ROLLUP_COLLECTION_NAME, [("sensorId", ASCENDING), ("start", ASCENDING)], True
+        ),
+        IndexSpec(DISKS_DATABASE_NAME, DISKS_COLLECTION_NAME, [("timestamp", ASCENDING)]),
+        IndexSpec(BEERS_DATABASE_NAME, BEERS_COLLECTION_NAME, [("style", ASCENDING)]),
+        IndexSpec(BEERS_DATABASE_NAME, BEERS_ROWDY_COLLECTION_NAME, [("style", ASCENDING)]),
+        IndexSpec(BEERS_DATABASE_NAME, BREWERIES_COLLECTION_NAME, [("id", ASCENDING)]),
+    ]
+
+
+def get_hot_queries() -> List[HotQuery]:
+    # The plan only depends on the shape of a query, so any sensor and days will do. Every filter and pipeline comes
+    # from the code that runs the query, so the check follows any change to it.
+    now = datetime.datetime.now(pytz.timezone(DEFAULT_TIMEZONE))
+    one_day = get_contiguous_ranges([get_day_bounds(now - datetime.timedelta(days=1))])
+    # Days that are not next to each other are read with one $or clause per run of days
+    separate_days = get_contiguous_ranges(
+        [get_day_bounds(now - datetime.timedelta(days=days_back)) for days_back in (3, 1)]
+    )
+    tile_start, tile_end = get_tile_bounds(MAX_ZOOM, to_epoch_ms(now) // get_tile_span_in_ms(MAX_ZOOM) - 1)
+
+    def find_days(ranges: list) -> dict:
+        return {
+            "find": PITEMP_COLLECTION_NAME,
+            "filter": get_range_filter("pi", ranges),
+            "sort": {"timestamp": ASCENDING},
+            "projection": READING_PROJECTION,
+        }
+
+    return [
+        HotQuery("Temperature day", TEMPERATURE_DATABASE_NAME, find_days(one_day)),
+        HotQuery("Temperature days with gaps", TEMPERATURE_DATABASE_NAME, find_days(separate_days)),
+        # find_raw_batches sends the same find command and only leaves the batches undecoded
+        HotQuery("Temperature days raw batches", TEMPERATURE_DATABASE_NAME, find_days(one_day)),
+        HotQuery(
+            "Temperature days aggregation",
+            TEMPERATURE_DATABASE_NAME,
+            {
+                "aggregate": PITEMP_COLLECTION_NAME,
+                "pipeline": get_days_pipeline("pi", separate_days, BASE_PERIODS_PER_DAY),
+                "cursor": {},
+            },
+        ),
+        HotQuery(
+            "Latest readings",
+            TEMPERATURE_DATABASE_NAME,
+            {"aggregate": PITEMP_COLLECTION_NAME, "pipeline": LATEST_READINGS_PIPELINE, "cursor": {}},
+        ),
+        HotQuery("Sensors", TEMPERATURE_DATABASE_NAME, {"distinct": PITEMP_COLLECTION_NAME, "key": "sensorId"}),
+        HotQuery(
+            "Most recent temperature",
+            TEMPERATURE_DATABASE_NAME,
+            {
+                "find": PITEMP_COLLECTION_NAME,
+                "filter": {"sensorId": "pi"},
+                "sort": {"timestamp": DESCENDING},
+                "limit": 1,
+            },
+        ),
+        HotQuery(
+            "Temperature tile",
+            TEMPERATURE_DATABASE_NAME,
+            {
+                "find": PITEMP_COLLECTION_NAME,
+                "filter": get_tile_filter("pi", tile_start, tile_end),
+                "sort": {"timestamp": ASCENDING},
+                "projection": READING_PROJECTION,
+            },
+        ),
+        HotQuery(
+            "Temperature rollup",
+            TEMPERATURE_DATABASE_NAME,
+            {
+                "find": ROLLUP_COLLECTION_NAME,
+                "filter": get_range_filter("pi", separate_days, field="start"),
+                "sort": {"start": ASCENDING},
+                "projection": ROLLUP_BUCKET_PROJECTION,
+            },
+        ),
+        HotQuery("Disk space", DISKS_DATABASE_NAME, {"find": DISKS_COLLECTION_NAME, "sort": {"timestamp": ASCENDING}}),
+        HotQuery("Beer styles", BEERS_DATABASE_NAME, {"distinct": BEERS_COLLECTION_NAME, "key": "style"}),
+        HotQuery("Rowdy beer styles", BEERS_DATABASE_NAME, {"distinct": BEERS_ROWDY_COLLECTION_NAME, "key": "style"}),
+    ]
+
+
+def get_winning_plan(explanation: dict) -> dict:
+    # Finds and distincts, and pipelines run entirely by the query engine, have the plan at the top. Other pipelines
+    # have it in their first stage, which reads from the collection.
+    if "queryPlanner" in explanation:
+        return explanation["queryPlanner"]["winningPlan"]
+    for stage in explanation.get("stages", []):
+        if "$cursor" in stage:
+            return stage["$cursor"]["queryPlanner"]["winningPlan"]
+    raise KeyError("The explanation has no query plan")
+
+
+def get_plan_stages(plan: dict) -> Iterator[str]:
+    # Classic plans nest through inputStage and inputStages. Slot based plans wrap the classic one in queryPlan.
+    if "queryPlan" in plan:
+        yield from get_plan_stages(plan["queryPlan"])
+        return
+
+    if "stage" in plan:
+        yield plan["stage"]
+    if "inputStage" in plan:
+        yield from get_plan_stages(plan["inputStage"])
+    for input_stage in plan.get("inputStages", []):
+        yield from get_plan_stages(input_stage)
+
+
+class IndexManager:
+    def __init__(self, client: MongoClient):
+        self.client = client
+
+    def ensure_indexes(self) -> int:
+        for spec in get_required_indexes():
+            name = self.client[spec.database][spec.collection].create_index(spec.keys, unique=spec.unique)
+            LOG.info(f"Index {name} on {spec.database}.{spec.collection} is in place")
+        return len(get_required_indexes())
+
+    def get_missing_indexes(self) -> List[IndexSpec]:
+        missing = []
+        for spec in get_required_indexes():
+            index_information = self.client[spec.database][spec.collection].index_information()
+            existing_keys = [[tuple(key) for key in index["key"]] for index in index_information.values()]
+            if list(spec.keys) not in existing_keys:
+                missing.append(spec)
+        return missing
+
+    def check_query_plans(self) -> List[PlanReport]:
+        reports = []
+        for query in get_hot_queries():
+            try:
+                explanation = self.client[query.database].command("explain", query.command, verbosity="queryPlanner")
+            except PyMongoError as e:
+                reports.append(PlanReport(name=query.name, stages=[], error=str(e)))
+                continue
+
+            stages = list(get_plan_stages(get_winning_plan(explanation)))
+            problems = [stage for stage in stages if stage in PROBLEM_STAGES]
+            reports.append(PlanReport(name=query.name, stages=stages, problems=problems))
+        return reports
+
+    def bootstrap(self, create: bool):
+        # Runs at startup, so problems are logged rather than raised
+        try:
+            if create:
+                self.ensure_indexes()
+            for spec in self.get_missing_indexes():
+                LOG.warning(f"Missing index {spec.keys} on {spec.database}.{spec.collection}")
+            for report in self.check_query_plans():
+                if report.error:
+                    LOG.warning(f"Could not explain {report.name}: {report.error}")
+                elif report.problems:
+                    LOG.warning(f"{report.name} uses {', '.join(report.problems)}: {' <- '.join(report.stages)}")
+        except PyMongoError:
+            LOG.exception("Failed to check the database indexes")
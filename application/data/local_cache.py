@@ -0,0 +1,98 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+LOG = logging.getLogger(__name__)
+
+# Measured by the size of the pickled values, which is smaller than the objects they unpickle to
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+# The version check catches every change. Expiring entries as well frees the memory of values nobody asks for.
+DEFAULT_TTL_SECONDS = 5 * 60
+
+
+@dataclass
+class LocalEntry:
+    value: object
+    version: str
+    size: int
+    expires_at: float
+
+
+@dataclass
+class LocalCacheStats:
+    entries: int
+    size: int
+    max_size: int
+
+
+class LocalCache:
+    """
+    Unpickled values held in the process, least recently used first out once they add up to more than max_bytes.
+    The values are shared by every caller, so they must not be changed.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._key_to_entry: OrderedDict[str, LocalEntry] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[LocalEntry]:
+        with self._lock:
+            entry = self._key_to_entry.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._key_to_entry.move_to_end(key)
+            return entry
+
+    def put(self, key: str, value: object, version: str, size: int):
+        # A value that would push out everything else is left to the shared cache
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._key_to_entry:
+                self._remove(key)
+            self._key_to_entry[key] = LocalEntry(
+                value=value, version=version, size=size, expires_at=time.monotonic() + self.ttl_seconds
+            )
+            self._size += size
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._key_to_entry)))
+
+    def invalidate(self, key: str):
+        with self._lock:
+            if key in self._key_to_entry:
+                self._remove(key)
+
+    def stats(self) -> LocalCacheStats:
+        with self._lock:
+            return LocalCacheStats(entries=len(self._key_to_entry), size=self._size, max_size=self.max_bytes)
+
+    def _remove(self, key: str):
+        self._size -= self._key_to_entry.pop(key).size
+
+
+_LOCAL_CACHE: Optional[LocalCache] = None
+_LOCAL_CACHE_LOCK = threading.Lock()
+
+
+def get_local_cache() -> LocalCache:
+    global _LOCAL_CACHE
+
+    with _LOCAL_CACHE_LOCK:
+        if _LOCAL_CACHE is None:
+            max_bytes = int(os.environ.get("LOCAL_CACHE_MAX_MB", DEFAULT_MAX_BYTES // (1024 * 1024))) * 1024 * 1024
+            ttl_seconds = float(os.environ.get("LOCAL_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS))
+            LOG.info(f"Keeping up to {max_bytes // (1024 * 1024)} MB of cached values in the process")
+            _LOCAL_CACHE = LocalCache(max_bytes=max_bytes, ttl_seconds=ttl_seconds)
+
+        return _LOCAL_CACHE
@@ -0,0 +1,383 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from application.data.circuit_breaker import STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, BreakerStats
+from application.data.dao_executor import ExecutorStats
+from application.data.local_cache import LocalCacheStats
+from application.data.scheduler import JobStats
+
+# Upper bounds in seconds, from a fast cache read to a cold year of readings
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+@dataclass
+class Sample:
+    labels: Dict[str, str]
+    value: float
+    # Appended to the metric name, such as _bucket for a histogram
+    suffix: str = ""
+
+
+@dataclass
+class MetricFamily:
+    name: str
+    help: str
+    type: str
+    samples: List[Sample] = field(default_factory=list)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def render_families(families: Iterable[MetricFamily]) -> str:
+    """Writes metrics in the Prometheus text exposition format"""
+    lines = []
+    for family in families:
+        lines.append(f"# HELP {family.name} {_escape(family.help)}")
+        lines.append(f"# TYPE {family.name} {family.type}")
+        for sample in family.samples:
+            labels = ",".join(f'{name}="{_escape(value)}"' for name, value in sample.labels.items())
+            name = family.name + sample.suffix
+            lines.append(
+                f"{name}{{{labels}}} {_format_value(sample.value)}"
+                if labels
+                else f"{name} {_format_value(sample.value)}"
+            )
+    return "\n".join(lines) + "\n"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, label_names: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, *label_values: str) -> float:
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def collect(self) -> MetricFamily:
+        with self._lock:
+            values = dict(self._values)
+        return MetricFamily(
+            self.name,
+            self.help,
+            "counter",
+            [
+                Sample(dict(zip(self.label_names, label_values)), value)
+                for label_values, value in sorted(values.items())
+            ],
+        )
+
+
+class Histogram:
+    def __init__(
+        self, name: str, help: str, label_names: Iterable[str] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # Per set of label values, the count in each bucket followed by the overflow, then the sum
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(label_values)
+            if counts is None:
+                counts = self._counts[label_values] = [0] * (len(self.buckets) + 1)
+                self._sums[label_values] = 0.0
+            counts[index] += 1
+            self._sums[label_values] += value
+
+    def collect(self) -> MetricFamily:
+        with self._lock:
+            counts = {label_values: list(values) for label_values, values in self._counts.items()}
+            sums = dict(self._sums)
+
+        samples = []
+        for label_values in sorted(counts):
+            labels = dict(zip(self.label_names, label_values))
+            # Prometheus buckets are cumulative
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets + (float("inf"),), counts[label_values]):
+                cumulative += count
+                samples.append(Sample({**labels, "le": _format_value(upper_bound)}, cumulative, "_bucket"))
+            samples.append(Sample(labels, sums[label_values], "_sum"))
+            samples.append(Sample(labels, cumulative, "_count"))
+        return MetricFamily(self.name, self.help, "histogram", samples)
+
+
+class MetricsRegistry:
+    """The counters and histograms of the process, which are updated as things happen"""
+
+    def __init__(self):
+        self._metrics: List = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def collect(self) -> List[MetricFamily]:
+        with self._lock:
+            metrics = list(self._metrics)
+        return [metric.collect() for metric in metrics]
+
+
+METRICS = MetricsRegistry()
+STAGE_DURATION = METRICS.register(
+    Histogram(
+        "pitemp_stage_duration_seconds",
+        "Time spent in each stage of serving data, by the cache key family or template it was for",
+        ["stage", "family"],
+    )
+)
+CACHE_LOOKUPS = METRICS.register(
+    Counter("pitemp_cache_lookups_total", "Cache lookups by key family and whether they hit", ["family", "result"])
+)
+LOCAL_CACHE_LOOKUPS = METRICS.register(
+    Counter(
+        "pitemp_local_cache_lookups_total",
+        "In-process cache lookups by key family and whether the value was there, missing or out of date",
+        ["family", "result"],
+    )
+)
+REQUEST_DURATION = METRICS.register(
+    Histogram("pitemp_request_duration_seconds", "Time to build each response, by endpoint", ["endpoint"])
+)
+
+
+class RequestTimings:
+    """The stages of one request, summed by stage and family, from every thread that did work for it"""
+
+    def __init__(self):
+        self._stage_to_timing: Dict[Tuple[str, str], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, family: str, seconds: float):
+        with self._lock:
+            timing = self._stage_to_timing.setdefault((stage, family), [0.0, 0])
+            timing[0] += seconds
+            timing[1] += 1
+
+    def get_breakdown(self) -> List[Tuple[str, str, float, int]]:
+        # Stage, family, seconds and count, slowest first
+        with self._lock:
+            timings = [
+                (stage, family, seconds, count) for (stage, family), (seconds, count) in self._stage_to_timing.items()
+            ]
+        return sorted(timings, key=lambda timing: timing[2], reverse=True)
+
+    def get_stage_seconds(self) -> Dict[str, float]:
+        stage_to_seconds = {}
+        for stage, _, seconds, _ in self.get_breakdown():
+            stage_to_seconds[stage] = stage_to_seconds.get(stage, 0.0) + seconds
+        return stage_to_seconds
+
+
+# Set for the length of a request. Executors copy the context into their tasks, so work done on other threads for
+# the request is added to it too.
+_REQUEST_TIMINGS: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def start_request_timings() -> RequestTimings:
+    request_timings = RequestTimings()
+    _REQUEST_TIMINGS.set(request_timings)
+    return request_timings
+
+
+def observe_stage(stage: str, family: str, seconds: float):
+    STAGE_DURATION.observe(seconds, stage, family)
+    request_timings = _REQUEST_TIMINGS.get()
+    if request_timings is not None:
+        request_timings.add(stage, family, seconds)
+
+
+# The time taken by the stages nested in each stage that is open on this thread
+_OPEN_STAGES = threading.local()
+
+
+def _get_open_stages() -> List[float]:
+    open_stages = getattr(_OPEN_STAGES, "nested_seconds", None)
+    if open_stages is None:
+        open_stages = _OPEN_STAGES.nested_seconds = []
+    return open_stages
+
+
+def _record_stage(stage: str, family: str, seconds: float, nested_seconds: float):
+    # A stage only records its own time. Time spent in the stages inside it is left to them.
+    observe_stage(stage, family, seconds - nested_seconds)
+    open_stages = _get_open_stages()
+    if open_stages:
+        open_stages[-1] += seconds
+
+
+@contextmanager
+def time_stage(stage: str, family: str = ""):
+    open_stages = _get_open_stages()
+    open_stages.append(0.0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        _record_stage(stage, family, seconds, open_stages.pop())
+
+
+def timed_iter(iterable: Iterable, stage: str, family: str = "") -> Iterator:
+    """
+    Yields from an iterable and records only the time spent waiting on it. Wrapping a cursor this way separates the
+    time spent in the database from the work done on each document.
+    """
+    iterator = iter(iterable)
+    elapsed = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                waited = time.perf_counter() - start
+                elapsed += waited
+                # Waiting counts as a stage nested in whichever stage is consuming the items
+                open_stages = _get_open_stages()
+                if open_stages:
+                    open_stages[-1] += waited
+            yield item
+    finally:
+        observe_stage(stage, family, elapsed)
+
+
+def record_cache_lookups(family: str, hits: int, misses: int = 0):
+    if hits:
+        CACHE_LOOKUPS.inc(family, "hit", amount=hits)
+    if misses:
+        CACHE_LOOKUPS.inc(family, "miss", amount=misses)
+
+
+def record_cache_lookup(family: str, hit: bool):
+    CACHE_LOOKUPS.inc(family, "hit" if hit else "miss")
+
+
+def get_job_families(job_stats: Iterable[JobStats]) -> List[MetricFamily]:
+    job_stats = list(job_stats)
+    return [
+        MetricFamily(
+            f"pitemp_job_{name}",
+            help,
+            type,
+            [Sample({"job": stats.name}, get_value(stats)) for stats in job_stats if get_value(stats) is not None],
+        )
+        for name, help, type, get_value in (
+            ("runs_total", "Runs of each background job", "counter", lambda stats: stats.runs),
+            ("failures_total", "Runs of each background job that raised", "counter", lambda stats: stats.failures),
+            (
+                "skipped_total",
+                "Runs of each background job skipped because the previous one was still going",
+                "counter",
+                lambda stats: stats.skipped,
+            ),
+            (
+                "duration_seconds_total",
+                "Time spent running each background job",
+                "counter",
+                lambda stats: stats.total_duration_ms / 1000,
+            ),
+            (
+                "last_duration_seconds",
+                "How long the last run of each background job took",
+                "gauge",
+                lambda stats: None if stats.last_duration_ms is None else stats.last_duration_ms / 1000,
+            ),
+            (
+                "max_duration_seconds",
+                "The longest run of each background job",
+                "gauge",
+                lambda stats: None if stats.max_duration_ms is None else stats.max_duration_ms / 1000,
+            ),
+            (
+                "last_finished_timestamp_seconds",
+                "When the last run of each background job finished",
+                "gauge",
+                lambda stats: stats.last_finished,
+            ),
+        )
+    ]
+
+
+def get_executor_families(stats: ExecutorStats) -> List[MetricFamily]:
+    return [
+        MetricFamily(f"pitemp_dao_executor_{name}", help, type, [Sample({}, value)])
+        for name, help, type, value in (
+            ("workers", "Threads of the DAO executor", "gauge", stats.max_workers),
+            ("active_workers", "Threads of the DAO executor running a task", "gauge", stats.active_workers),
+            ("queue_depth", "Tasks waiting for a thread of the DAO executor", "gauge", stats.queue_depth),
+            ("completed_tasks_total", "Tasks run by the DAO executor", "counter", stats.completed_tasks),
+        )
+    ]
+
+
+def get_breaker_families(stats: BreakerStats) -> List[MetricFamily]:
+    return [
+        MetricFamily(
+            "pitemp_mongo_circuit_state",
+            "Whether the database circuit is in each state. While it is open, data is only served from the cache.",
+            "gauge",
+            [
+                Sample({"state": state}, 1 if stats.state == state else 0)
+                for state in (STATE_CLOSED, STATE_OPEN, STATE_HALF_OPEN)
+            ],
+        ),
+        MetricFamily(
+            "pitemp_mongo_circuit_opened_total",
+            "Times the database circuit opened",
+            "counter",
+            [Sample({}, stats.times_opened)],
+        ),
+        MetricFamily(
+            "pitemp_mongo_circuit_rejected_total",
+            "Database calls skipped because the circuit was open",
+            "counter",
+            [Sample({}, stats.rejected_calls)],
+        ),
+    ]
+
+
+def get_local_cache_families(stats: LocalCacheStats) -> List[MetricFamily]:
+    return [
+        MetricFamily(f"pitemp_local_cache_{name}", help, "gauge", [Sample({}, value)])
+        for name, help, value in (
+            ("entries", "Values held in the in-process cache", stats.entries),
+            ("bytes", "Pickled size of the values held in the in-process cache", stats.size),
+            ("max_bytes", "Pickled size the in-process cache is bounded to", stats.max_size),
+        )
+    ]
@@ -0,0 +1,79 @@
+import os
+import time
+from contextlib import contextmanager
+
+from pymongo import MongoClient, monitoring
+from pymongo.errors import ServerSelectionTimeoutError
+
+from application.data.circuit_breaker import CircuitBreaker, get_mongo_circuit_breaker
+from application.data.fault_injection import FaultInjectingClient, parse_delay_range, pop_injected_delay
+
+# Documents fetched per round trip by the cursors that read whole collections or long ranges. The server default is
+# only 101 documents in the first batch.
+BATCH_SIZE = int(os.environ.get("MONGO_BATCH_SIZE", 10000))
+# The driver defaults wait 30 s to find a server and forever on a socket, so a struggling cluster holds every
+# request. These fail fast enough for the circuit breaker to take over.
+SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+CONNECT_TIMEOUT_MS = int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", 5000))
+SOCKET_TIMEOUT_MS = int(os.environ.get("MONGO_SOCKET_TIMEOUT_MS", 30000))
+
+
+class BreakerCommandListener(monitoring.CommandListener):
+    """Reports how long every command takes and whether it reached the server to the circuit breaker"""
+
+    def __init__(self, breaker: CircuitBreaker):
+        self.breaker = breaker
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self.breaker.record(event.duration_micros / 1000000 + pop_injected_delay())
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        # Errors returned by the server, such as a duplicate key, have a code. Network errors and timeouts do not.
+        self.breaker.record(event.duration_micros / 1000000 + pop_injected_delay(), failed="code" not in event.failure)
+
+
+@contextmanager
+def report_server_selection_failures(breaker: CircuitBreaker):
+    """
+    Reports an operation that found no server to send its command to, which the command listener never sees, to the
+    circuit breaker. Heartbeats are not counted, since a secondary can be down while every operation goes through.
+    Operations nested in each other report the same failure once.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except ServerSelectionTimeoutError as e:
+        if not getattr(e, "reported_to_breaker", False):
+            e.reported_to_breaker = True
+            breaker.record(time.perf_counter() - start, failed=True)
+        raise
+
+
+def create_mongo_client() -> MongoClient:
+    # A local server can be used instead of the cluster, for example to try out injected faults
+    url = os.environ.get("MONGO_URL")
+    if not url:
+        username = os.environ.get("MONGO_USER")
+        password = os.environ.get("MONGO_PASSWORD")
+        host = os.environ.get("MONGO_HOST")
+        url = f"mongodb+srv://{username}:{password}@{host}/?retryWrites=true&w=majority"
+
+    breaker = get_mongo_circuit_breaker()
+    client = MongoClient(
+        url,
+        serverSelectionTimeoutMS=SERVER_SELECTION_TIMEOUT_MS,
+        connectTimeoutMS=CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=SOCKET_TIMEOUT_MS,
+        event_listeners=[BreakerCommandListener(breaker)],
+    )
+
+    fault_delay = os.environ.get("MONGO_FAULT_DELAY_MS")
+    fault_error_rate = float(os.environ.get("MONGO_FAULT_ERROR_RATE", 0))
+    if fault_delay or fault_error_rate:
+        return FaultInjectingClient(
+            client, parse_delay_range(fault_delay or "0"), error_rate=fault_error_rate, breaker=breaker
+        )
+    return client
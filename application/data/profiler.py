@@ -0,0 +1,129 @@
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+# Often enough to see a 100 ms stage, rarely enough that sampling does not slow the request down much
+DEFAULT_SAMPLE_INTERVAL_SECONDS = 0.005
+TOP_FUNCTIONS = 40
+APPLICATION_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPOSITORY_DIRECTORY = os.path.dirname(APPLICATION_DIRECTORY)
+
+Stack = Tuple[str, ...]
+
+# Set for the length of a profiled request. Executors copy the context into their tasks, so a task knows which request
+# it is working for and tags its thread with it while it runs.
+_REQUEST_ID: ContextVar[Optional[int]] = ContextVar("profiled_request_id", default=None)
+_THREAD_TO_REQUEST_ID: Dict[int, int] = {}
+_REQUEST_IDS = itertools.count(1)
+
+
+def start_profiled_request() -> int:
+    """Gives the request of the current context an id, which the executor tasks it starts are tagged with"""
+    request_id = next(_REQUEST_IDS)
+    _REQUEST_ID.set(request_id)
+    return request_id
+
+
+@contextmanager
+def working_for_request():
+    """Tags this thread with the profiled request of the current context, if there is one, while the block runs"""
+    request_id = _REQUEST_ID.get()
+    if request_id is None:
+        yield
+        return
+
+    thread_id = threading.get_ident()
+    previous_request_id = _THREAD_TO_REQUEST_ID.get(thread_id)
+    _THREAD_TO_REQUEST_ID[thread_id] = request_id
+    try:
+        yield
+    finally:
+        if previous_request_id is None:
+            _THREAD_TO_REQUEST_ID.pop(thread_id, None)
+        else:
+            _THREAD_TO_REQUEST_ID[thread_id] = previous_request_id
+
+
+def _get_frame_label(frame) -> str:
+    filename = frame.f_code.co_filename
+    if filename.startswith(REPOSITORY_DIRECTORY):
+        filename = os.path.relpath(filename, REPOSITORY_DIRECTORY)
+    else:
+        filename = os.path.basename(filename)
+    return f"{frame.f_code.co_name} ({filename}:{frame.f_code.co_firstlineno})"
+
+
+class SamplingProfiler(threading.Thread):
+    """
+    Samples the stacks of a request's thread until it is stopped. Unlike cProfile, it also sees the work the request
+    hands to the executors: worker threads are sampled while they run a task tagged with the request, and not while
+    they are idle or working for other requests.
+    """
+
+    def __init__(
+        self,
+        request_thread_id: int,
+        request_id: int,
+        interval_seconds: float = DEFAULT_SAMPLE_INTERVAL_SECONDS,
+    ):
+        super().__init__(name="sampling-profiler", daemon=True)
+        self.request_thread_id = request_thread_id
+        self.request_id = request_id
+        self.interval_seconds = interval_seconds
+        self.stacks: Counter = Counter()
+        self.num_samples = 0
+        self.duration_seconds = 0.0
+        self._stopped = threading.Event()
+
+    def run(self):
+        start = time.perf_counter()
+        while not self._stopped.wait(self.interval_seconds):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.request_thread_id or _THREAD_TO_REQUEST_ID.get(thread_id) == self.request_id:
+                    self.stacks[self._get_stack(frame)] += 1
+            self.num_samples += 1
+        self.duration_seconds = time.perf_counter() - start
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    @staticmethod
+    def _get_stack(frame) -> Stack:
+        labels = []
+        while frame is not None:
+            labels.append(_get_frame_label(frame))
+            frame = frame.f_back
+        return tuple(reversed(labels))
+
+    def get_collapsed(self) -> str:
+        # The folded format read by flamegraph.pl and speedscope
+        return "\n".join(f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+    def get_report(self) -> str:
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        for stack, count in self.stacks.items():
+            self_counts[stack[-1]] += count
+            # A recursive function is only counted once per sample
+            for label in set(stack):
+                total_counts[label] += count
+
+        num_stacks = sum(self.stacks.values()) or 1
+        lines = [
+            f"{self.num_samples} samples every {self.interval_seconds * 1000:.0f} ms over "
+            f"{self.duration_seconds * 1000:.0f} ms, {num_stacks} stacks from the request thread and its workers",
+            "",
+        ]
+        for title, counts in (("Self", self_counts), ("Total", total_counts)):
+            lines.append(f"{title} samples:")
+            for label, count in counts.most_common(TOP_FUNCTIONS):
+                lines.append(f"  {count / num_stacks * 100:6.1f}% {count:6d}  {label}")
+            lines.append("")
+        return "\n".join(lines)
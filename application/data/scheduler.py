@@ -0,0 +1,103 @@
+import heapq
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Tuple
+
+LOG = logging.getLogger(__name__)
+
+
+@dataclass
+class JobStats:
+    name: str
+    runs: int = 0
+    failures: int = 0
+    skipped: int = 0
+    last_duration_ms: Optional[float] = None
+    max_duration_ms: Optional[float] = None
+    total_duration_ms: float = 0.0
+    last_finished: Optional[float] = None
+
+
+@dataclass
+class Job:
+    name: str
+    function: Callable[[], object]
+    interval_seconds: float
+    # Every run is delayed by up to this much so jobs started together do not keep hitting the database together
+    jitter_seconds: float = 0.0
+    run_at_start: bool = True
+    stats: JobStats = field(init=False)
+
+    def __post_init__(self):
+        self.stats = JobStats(name=self.name)
+
+
+class Scheduler(threading.Thread):
+    """
+    Runs jobs in the background at a fixed interval plus jitter. At most max_concurrency jobs run at once and a job
+    never overlaps with itself: a run that comes due while the previous one is still going is skipped.
+    """
+
+    def __init__(self, jobs: List[Job], max_concurrency: int = 2):
+        super().__init__(name="scheduler", daemon=True)
+        self.jobs = jobs
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="scheduler-job")
+        self._running = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+        now = time.monotonic()
+        self._queue: List[Tuple[float, int, Job]] = []
+        for i, job in enumerate(jobs):
+            first_run = now if job.run_at_start else now + job.interval_seconds
+            heapq.heappush(self._queue, (first_run + self._get_jitter(job), i, job))
+
+    def run(self):
+        while self._queue and not self._stopped.is_set():
+            run_at, i, job = self._queue[0]
+            if self._stopped.wait(max(0.0, run_at - time.monotonic())):
+                break
+
+            heapq.heapreplace(self._queue, (time.monotonic() + job.interval_seconds + self._get_jitter(job), i, job))
+            with self._lock:
+                if job.name in self._running:
+                    job.stats.skipped += 1
+                    LOG.warning(f"Job {job.name} is still running. Skipping this run.")
+                    continue
+                self._running.add(job.name)
+            self._executor.submit(self._run_job, job)
+
+    def stop(self):
+        self._stopped.set()
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> List[JobStats]:
+        return [job.stats for job in self.jobs]
+
+    def _run_job(self, job: Job):
+        start = time.perf_counter_ns()
+        try:
+            job.function()
+        except Exception:
+            job.stats.failures += 1
+            LOG.exception(f"Job {job.name} failed")
+        finally:
+            duration_ms = (time.perf_counter_ns() - start) / 1000000
+            stats = job.stats
+            stats.runs += 1
+            stats.last_duration_ms = duration_ms
+            stats.max_duration_ms = max(stats.max_duration_ms or 0.0, duration_ms)
+            stats.total_duration_ms += duration_ms
+            stats.last_finished = time.time()
+            with self._lock:
+                self._running.discard(job.name)
+            LOG.info(f"Job {job.name} took {duration_ms:.0f} ms")
+
+    @staticmethod
+    def _get_jitter(job: Job) -> float:
+        return random.uniform(0, job.jitter_seconds) if job.jitter_seconds else 0.0
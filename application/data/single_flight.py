@@ -0,0 +1,168 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, TypeVar
+
+import valkey
+from valkey.exceptions import WatchError
+
+from application.data.metrics import CACHE_LOOKUPS
+
+LOG = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Long enough for a cold year of readings. A lock left by a crashed process expires after this.
+DEFAULT_LOCK_TTL_MS = 60 * 1000
+# How long to wait for another process to finish before building anyway
+DEFAULT_WAIT_SECONDS = 30.0
+POLL_INTERVAL_SECONDS = 0.05
+
+
+class SingleFlight:
+    """
+    Makes sure only one worker builds a cache entry at a time.
+
+    Within the process, callers asking for a key that is already being built wait for that build and share its
+    result. Across processes, the builder holds a short lock in the cache. Callers that do not get the lock poll the
+    cache with read until the entry shows up, or take over the build if the lock is released or expires without it.
+    """
+
+    def __init__(
+        self,
+        cache: valkey.Valkey,
+        lock_ttl_ms: int = DEFAULT_LOCK_TTL_MS,
+        wait_seconds: float = DEFAULT_WAIT_SECONDS,
+    ):
+        self.cache = cache
+        self.lock_ttl_ms = lock_ttl_ms
+        self.wait_seconds = wait_seconds
+        self._key_to_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def run(self, key: str, build: Callable[[], T], read: Callable[[], Optional[T]], family: str = "") -> T:
+        """
+        Returns what build returns for the key, running it at most once across every worker at a time.
+        Build must write the entry to the cache, which read returns or None while it is not there.
+        """
+        return self.run_many([key], lambda keys: [build()], lambda keys: [read()], family)[0]
+
+    def run_many(
+        self,
+        keys: List[str],
+        build: Callable[[List[str]], List[T]],
+        read: Callable[[List[str]], List[Optional[T]]],
+        family: str = "",
+    ) -> List[T]:
+        """
+        Like run for entries that are cheaper to build together, such as days read with one query. Each key is its own
+        flight, so callers asking for overlapping keys only build each entry once. The keys that no other worker is
+        building are built together, then the others are waited for. Flights are taken in sorted order.
+        Build gets keys in sorted order and returns their values in the same order. Read returns the cached value of
+        each key it gets, or None for those that are not there.
+        """
+        led: Dict[str, Future] = {}
+        followed: Dict[str, Future] = {}
+        with self._lock:
+            for key in sorted(set(keys)):
+                flight = self._key_to_flight.get(key)
+                if flight is None:
+                    led[key] = self._key_to_flight[key] = Future()
+                else:
+                    followed[key] = flight
+
+        key_to_value: Dict[str, T] = {}
+        try:
+            if led:
+                key_to_value.update(self._run_with_locks(list(led), build, read, family))
+            for key, flight in led.items():
+                flight.set_result(key_to_value[key])
+        except BaseException as e:
+            for flight in led.values():
+                if not flight.done():
+                    flight.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                for key in led:
+                    del self._key_to_flight[key]
+
+        # Only waited on once this caller's own builds are done, so two callers never wait on each other
+        for key, flight in followed.items():
+            CACHE_LOOKUPS.inc(family or key, "coalesced")
+            key_to_value[key] = flight.result()
+        return [key_to_value[key] for key in keys]
+
+    def _run_with_locks(
+        self,
+        keys: List[str],
+        build: Callable[[List[str]], List[T]],
+        read: Callable[[List[str]], List[Optional[T]]],
+        family: str,
+    ) -> Dict[str, T]:
+        key_to_value: Dict[str, T] = {}
+        key_to_token: Dict[str, str] = {}
+        pending = keys
+        deadline = time.monotonic() + self.wait_seconds
+
+        try:
+            while pending:
+                # Build every entry whose lock no other process holds
+                owned = [key for key in pending if self._acquire(key, key_to_token)]
+                if owned:
+                    # The entries may have been written between the caller's miss and taking the locks
+                    self._add_found(owned, read(owned), key_to_value)
+                    missing = [key for key in owned if key not in key_to_value]
+                    if missing:
+                        key_to_value.update(zip(missing, build(missing)))
+                    for key in owned:
+                        self._release(f"lock_{key}", key_to_token.pop(key))
+                    pending = [key for key in pending if key not in key_to_value]
+                    continue
+
+                # Other processes are building the rest
+                if time.monotonic() >= deadline:
+                    LOG.warning(f"Gave up waiting for another worker to build {', '.join(pending)}. Building it here.")
+                    key_to_value.update(zip(pending, build(pending)))
+                    break
+
+                time.sleep(POLL_INTERVAL_SECONDS)
+                coalesced = self._add_found(pending, read(pending), key_to_value)
+                for key in coalesced:
+                    CACHE_LOOKUPS.inc(family or key, "coalesced")
+                pending = [key for key in pending if key not in key_to_value]
+        finally:
+            for key, token in key_to_token.items():
+                self._release(f"lock_{key}", token)
+
+        return key_to_value
+
+    def _acquire(self, key: str, key_to_token: Dict[str, str]) -> bool:
+        token = uuid.uuid4().hex
+        if not self.cache.set(f"lock_{key}", token, nx=True, px=self.lock_ttl_ms):
+            return False
+        key_to_token[key] = token
+        return True
+
+    @staticmethod
+    def _add_found(keys: List[str], values: List[Optional[T]], key_to_value: Dict[str, T]) -> List[str]:
+        found = [key for key, value in zip(keys, values) if value is not None]
+        key_to_value.update((key, value) for key, value in zip(keys, values) if value is not None)
+        return found
+
+    def _release(self, lock_key: str, token: str):
+        # Only the holder deletes the lock, in case it expired and another worker took it
+        with self.cache.pipeline() as pipeline:
+            try:
+                pipeline.watch(lock_key)
+                holder = pipeline.get(lock_key)
+                if holder is not None and holder.decode() == token:
+                    pipeline.multi()
+                    pipeline.delete(lock_key)
+                    pipeline.execute()
+                else:
+                    pipeline.unwatch()
+            except WatchError:
+                pass
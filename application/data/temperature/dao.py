@@ -1,41 +1,114 @@
 import datetime
-import json
 import logging
+import os
 import time
-from asyncio import Future
-from concurrent.futures import ThreadPoolExecutor
-from typing import List, Optional
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
 
 import fakeredis
 import pytz
 import valkey
 from pymongo import DESCENDING, ASCENDING
 from pymongo.collection import Collection
+from pymongo.cursor import Cursor, RawBatchCursor
 from pymongo.database import Database
 
-from application import CustomJsonEncoder
 from application.constants.app_constants import (
-    DATETIME_FORMAT_STRING,
     DATE_FORMAT_STRING,
-    ONE_DAY_IN_SECONDS,
     DEFAULT_TIMEZONE,
+    ONE_DAY_IN_SECONDS,
+)
+from application.data.circuit_breaker import CircuitBreaker, get_mongo_circuit_breaker
+from application.data.dao_executor import DaoExecutor, get_dao_executor
+from application.data.metrics import record_cache_lookup, record_cache_lookups, time_stage, timed_iter
+from application.data.mongo import BATCH_SIZE, report_server_selection_failures
+from application.data.single_flight import SingleFlight
+from application.data.temperature.day_codec import (
+    PartialDay,
+    decode_day,
+    decode_partial_day,
+    encode_day,
+    encode_partial_day,
+    round_day,
+)
+from application.data.temperature.decimation import (
+    READING_PROJECTION,
+    DayDecimator,
+    decimate_documents,
+    from_epoch_ms,
+    get_contiguous_ranges,
+    get_day_bounds,
+    get_days_pipeline,
+    get_range_filter,
+    reduce_temperatures,
+    to_epoch_ms,
 )
+from application.data.temperature.downsampling import downsample_temperatures
+from application.data.temperature.latest_readings import LatestReadings
+from application.data.temperature.numpy_decimation import decimate_raw_batches
+from application.data.temperature.rollups import ROLLUP_COLLECTION_NAME, TemperatureRollups
+from application.data.temperature.sensor_registry import SENSORS_COLLECTION_NAME, SensorRegistry
 from application.data.temperature.temperature_data_set import TemperatureDataSet
 from application.data.temperature.temperatures import Temperatures
+from application.data.temperature.tiles import TemperatureTiles
+from application.data.temperature.view_snapshots import ViewSnapshots
 
 DATABASE_NAME = "sensors"
+DECIMATION_ENGINE_PYTHON = "python"
+DECIMATION_ENGINE_AGGREGATION = "aggregation"
+DECIMATION_ENGINE_ROLLUP = "rollup"
+DECIMATION_ENGINE_NUMPY = "numpy"
+DECIMATION_ENGINES = (
+    DECIMATION_ENGINE_PYTHON,
+    DECIMATION_ENGINE_AGGREGATION,
+    DECIMATION_ENGINE_ROLLUP,
+    DECIMATION_ENGINE_NUMPY,
+)
+# Days are only ever decimated from the database at the finest level. Every coarser level is reduced from it.
+BASE_PERIODS_PER_DAY = 96
+# Reducing rollup buckets only needs their extremes
+ROLLUP_BUCKET_PROJECTION = {
+    "_id": 0,
+    "day": 1,
+    "min_temp": 1,
+    "min_timestamp": 1,
+    "max_temp": 1,
+    "max_timestamp": 1,
+}
+# The current day is only cached while it is being recorded
+PARTIAL_DAY_CACHE_TTL = 2 * ONE_DAY_IN_SECONDS
 
 LOG = logging.getLogger(__name__)
 
 
 class ApplicationDao:
-    def __init__(self, client, database: Database = None, cache: valkey.Valkey = None):
+    def __init__(
+        self,
+        client,
+        database: Database = None,
+        cache: valkey.Valkey = None,
+        decimation_engine: str = None,
+        executor: DaoExecutor = None,
+        breaker: CircuitBreaker = None,
+    ):
         # If no cache is given, spin up a fake one
         if cache is None:
             self.cache = fakeredis.FakeValkey()
         else:
             self.cache = cache
 
+        # Share one bounded pool across the process unless a dedicated one is given
+        if executor is None:
+            self.executor = get_dao_executor()
+        else:
+            self.executor = executor
+
+        # While the database is failing or slow, histories are built from the cache alone
+        if breaker is None:
+            self.breaker = get_mongo_circuit_breaker()
+        else:
+            self.breaker = breaker
+
         self.client = client
         # If no database provided, connect to one
         if database is None:
@@ -45,180 +118,484 @@ class ApplicationDao:
         self.database = database
         self.pitemp_collection: Collection = self.database["pitemp"]
 
+        # Allow choosing where decimation happens so the engines can be compared
+        if decimation_engine is None:
+            decimation_engine = os.environ.get("DECIMATION_ENGINE", DECIMATION_ENGINE_PYTHON)
+        if decimation_engine not in DECIMATION_ENGINES:
+            raise ValueError(f"Unknown decimation engine {decimation_engine}")
+        self.decimation_engine = decimation_engine
+        self.single_flight = SingleFlight(self.cache)
+        self.rollups = TemperatureRollups(self.pitemp_collection, self.database)
+        self.sensors = SensorRegistry(
+            self.pitemp_collection, self.database[SENSORS_COLLECTION_NAME], self.cache, self.breaker
+        )
+        self.view_snapshots = ViewSnapshots(
+            self.cache, self.get_temperature_histories, self.sensors.get_sensor_ids, self.breaker
+        )
+        self.tiles = TemperatureTiles(self.pitemp_collection, self.cache, self.breaker)
+        self.latest_readings = LatestReadings(self.pitemp_collection)
+
         LOG.info(f"Database collections: {self.database.list_collection_names()}")
 
-    @staticmethod
-    def _fix_timestamps(temperature_data_set: TemperatureDataSet):
-        for entry in temperature_data_set.data:
-            timestamp = entry["x"]
-            date_time = datetime.datetime.strptime(timestamp, DATETIME_FORMAT_STRING)
-            date_time = date_time.replace(tzinfo=pytz.UTC)
-            local_datetime = date_time.astimezone(pytz.timezone(DEFAULT_TIMEZONE))
-            entry["x"] = datetime.datetime.strftime(local_datetime, DATETIME_FORMAT_STRING)
-
-    def get_temperature_history(self, sensor_id: str, days_back: int) -> TemperatureDataSet:
+    def get_temperature_history(
+        self, sensor_id: str, days_back: int, points: Optional[int] = None
+    ) -> TemperatureDataSet:
+        return self.get_temperature_histories([sensor_id], days_back, points)[sensor_id]
+
+    def get_temperature_histories(
+        self, sensor_ids: List[str], days_back: int, points: Optional[int] = None
+    ) -> Dict[str, TemperatureDataSet]:
+        """
+        Gets the decimated temperature history of every sensor.
+        By default, the number of periods per day depends on how many days are shown. When points is given, the
+        finest decimation is downsampled to that many points instead, whatever the number of days.
+        """
         start = time.perf_counter_ns()
 
-        temp_history = self._get_decimated_data(sensor_id, days_back)
-        self._fix_timestamps(temp_history)
+        now_datetime = datetime.datetime.now(pytz.timezone(DEFAULT_TIMEZONE))
+        first_date = now_datetime - datetime.timedelta(days=days_back)
+        days = [first_date + datetime.timedelta(days=i) for i in range(days_back + 1)]
+        periods_per_day = BASE_PERIODS_PER_DAY if points else self._get_periods_per_day(days_back)
+
+        # Every sensor is fetched at once on the shared executor. No task waits on another task, so a sensor never
+        # holds a worker while the work it depends on is still queued behind it.
+        most_recent_futures = {
+            sensor_id: self.executor.submit(self._get_most_recent_document, sensor_id) for sensor_id in sensor_ids
+        }
+        sensor_to_days_futures = self._submit_days_temperatures(sensor_ids, days, now_datetime, periods_per_day)
+
+        histories = {}
+        for sensor_id in sensor_ids:
+            histories[sensor_id] = self._get_decimated_data(
+                sensor_id, sensor_to_days_futures[sensor_id].result(), most_recent_futures[sensor_id].result(), points
+            )
 
         duration_ms = (time.perf_counter_ns() - start) // 1000000
-        print(f"Temperature history for {days_back} days back took {duration_ms} ms")
-
-        return temp_history
-
-    @staticmethod
-    def _get_data_to_add(
-        min_temp: float, min_date: datetime.datetime, max_temp: float, max_date: datetime.datetime
-    ) -> (List[datetime.datetime], List[float]):
-        if min_temp == max_temp:
-            return [min_date], [min_temp]
-        elif min_date <= max_date:
-            return [min_date, max_date], [min_temp, max_temp]
-        else:
-            return [max_date, min_date], [max_temp, min_temp]
-
-    def _calculate_day_temperatures(
-        self, sensor_id: str, date: datetime.datetime, periods_per_day: int
-    ) -> Optional[Temperatures]:
-        # We cannot show every data point for every view. Showing 90 days worth of data would be incredibly slow.
-        # This algorithm works by diving a single day into periods and will only return the lowest and highest
-        # temperature recorded for each period. This preserves the peaks and valleys for the most useful information.
-        # This is a process called 'decimation'.
+        LOG.info(f"Temperature history for {len(sensor_ids)} sensors {days_back} days back took {duration_ms} ms")
+        LOG.info(f"DAO executor stats: {self.executor.stats()}")
+
+        return histories
+
+    def get_temperature_range(
+        self,
+        sensor_id: str,
+        from_datetime: datetime.datetime,
+        to_datetime: datetime.datetime,
+        points: Optional[int] = None,
+    ) -> TemperatureDataSet:
+        """
+        Gets the decimated temperature history of a sensor between two instants.
+        The days that overlap the range come from the same cache as the full day views and are then trimmed.
+        """
+        now_datetime = datetime.datetime.now(pytz.timezone(DEFAULT_TIMEZONE))
+        from_datetime = from_datetime.astimezone(now_datetime.tzinfo)
+        to_datetime = min(to_datetime.astimezone(now_datetime.tzinfo), now_datetime)
+
+        # Same time of day as now, like the day views, so the cache keys and completeness checks line up
+        first_days_back = (now_datetime.date() - from_datetime.date()).days
+        last_days_back = (now_datetime.date() - to_datetime.date()).days
+        days = [now_datetime - datetime.timedelta(days=i) for i in range(first_days_back, last_days_back - 1, -1)]
+        periods_per_day = BASE_PERIODS_PER_DAY if points else self._get_periods_per_day(len(days) - 1)
+
+        most_recent_future = self.executor.submit(self._get_most_recent_document, sensor_id)
+        days_future = self._submit_days_temperatures([sensor_id], days, now_datetime, periods_per_day)[sensor_id]
+        day_temperatures = days_future.result()
+
+        from_timestamp = to_epoch_ms(from_datetime)
+        to_timestamp = to_epoch_ms(to_datetime)
+        trimmed = Temperatures(dates=[], temperatures=[])
+        for temperatures in day_temperatures:
+            for date, temperature in zip(temperatures.dates, temperatures.temperatures):
+                if from_timestamp <= date <= to_timestamp:
+                    trimmed.dates.append(date)
+                    trimmed.temperatures.append(temperature)
+
+        most_recent_document = most_recent_future.result()
+        if most_recent_document and not (
+            from_timestamp <= to_epoch_ms(most_recent_document["timestamp"]) <= to_timestamp
+        ):
+            most_recent_document = None
+
+        return self._get_decimated_data(sensor_id, [trimmed], most_recent_document, points)
+
+    def find_readings(self, sensor_id: str, from_datetime: datetime.datetime, to_datetime: datetime.datetime) -> Cursor:
+        """Every raw reading of a sensor between two instants, oldest first, fetched a batch at a time"""
+        self.breaker.check()
+        return self.pitemp_collection.find(
+            filter=get_range_filter(
+                sensor_id, [(from_epoch_ms(to_epoch_ms(from_datetime)), from_epoch_ms(to_epoch_ms(to_datetime)))]
+            ),
+            projection=READING_PROJECTION,
+            sort=[("timestamp", ASCENDING)],
+            batch_size=BATCH_SIZE,
+        )
 
-        # The first instant and last instant of the calendar date
-        min_date = datetime.datetime.combine(date, datetime.time.min).replace(tzinfo=pytz.timezone(DEFAULT_TIMEZONE))
-        max_date = datetime.datetime.combine(date, datetime.time.max).replace(tzinfo=pytz.timezone(DEFAULT_TIMEZONE))
-        LOG.info(f"Calculating decimated values for date {min_date} from sensor {sensor_id}")
+    def _submit_days_temperatures(
+        self,
+        sensor_ids: List[str],
+        days: List[datetime.datetime],
+        now_datetime: datetime.datetime,
+        periods_per_day: int,
+    ) -> Dict[str, Future]:
+        sensor_to_day_cache_keys = {
+            sensor_id: self._get_day_cache_keys(sensor_id, days, now_datetime) for sensor_id in sensor_ids
+        }
+
+        # One round trip fetches the cached days of every sensor, so only the misses go to the database
+        all_day_cache_keys = [key for sensor_id in sensor_ids for key in sensor_to_day_cache_keys[sensor_id]]
+        all_day_temperatures = iter(self._get_cached_days_temperatures(all_day_cache_keys))
+
+        # Each sensor calculates its missing days on its own worker
+        return {
+            sensor_id: self.executor.submit(
+                self._fill_missing_days,
+                sensor_id,
+                days,
+                sensor_to_day_cache_keys[sensor_id],
+                [next(all_day_temperatures) for _ in days],
+                periods_per_day,
+            )
+            for sensor_id in sensor_ids
+        }
+
+    def _calculate_days_temperatures(
+        self, sensor_id: str, dates: List[datetime.datetime], periods_per_day: int
+    ) -> List[Temperatures]:
+        if not dates:
+            return []
+
+        day_bounds = [get_day_bounds(date) for date in dates]
+        LOG.info(
+            f"Calculating decimated values for {len(dates)} days from {day_bounds[0][0]} to {day_bounds[-1][1]} "
+            f"from sensor {sensor_id} with the {self.decimation_engine} engine"
+        )
 
+        # Each day is reduced separately, but all of them are fetched with a single query
+        with time_stage("decimation", self.decimation_engine):
+            if self.decimation_engine == DECIMATION_ENGINE_AGGREGATION:
+                return self._decimate_days_aggregation(sensor_id, day_bounds, periods_per_day)
+            if self.decimation_engine == DECIMATION_ENGINE_ROLLUP:
+                return self._decimate_days_rollup(sensor_id, day_bounds, periods_per_day)
+            if self.decimation_engine == DECIMATION_ENGINE_NUMPY:
+                batches = timed_iter(self._find_days_raw_batches(sensor_id, day_bounds), "mongo_query", "pitemp")
+                return decimate_raw_batches(batches, day_bounds, periods_per_day)
+            documents = timed_iter(self._find_days_documents(sensor_id, day_bounds), "mongo_query", "pitemp")
+            return decimate_documents(documents, day_bounds, periods_per_day)
+
+    def _find_days_documents(
+        self, sensor_id: str, day_bounds: List[Tuple[datetime.datetime, datetime.datetime]]
+    ) -> Cursor:
         documents = self.pitemp_collection.find(
-            filter={"timestamp": {"$gte": min_date, "$lte": max_date}, "sensorId": sensor_id}
+            filter=get_range_filter(sensor_id, get_contiguous_ranges(day_bounds)),
+            projection=READING_PROJECTION,
+            batch_size=BATCH_SIZE,
         )
         # We need the dates in order from oldest to newest for the algorithm to work
         documents.sort({"timestamp": ASCENDING})
+        return documents
+
+    def _find_days_raw_batches(
+        self, sensor_id: str, day_bounds: List[Tuple[datetime.datetime, datetime.datetime]]
+    ) -> RawBatchCursor:
+        # Batches of undecoded BSON, for readers that pull the fields out themselves
+        return self.pitemp_collection.find_raw_batches(
+            filter=get_range_filter(sensor_id, get_contiguous_ranges(day_bounds)),
+            projection=READING_PROJECTION,
+            sort=[("timestamp", ASCENDING)],
+            batch_size=BATCH_SIZE,
+        )
 
-        dates: List[datetime] = []
-        temperatures: List[float] = []
+    def _decimate_days_aggregation(
+        self,
+        sensor_id: str,
+        day_bounds: List[Tuple[datetime.datetime, datetime.datetime]],
+        periods_per_day: int,
+    ) -> List[Temperatures]:
+        decimators = [DayDecimator(min_date, periods_per_day) for min_date, _ in day_bounds]
+        # The server truncates timestamps to the start of their day
+        day_start_to_decimator = {
+            to_epoch_ms(min_date): decimator for (min_date, _), decimator in zip(day_bounds, decimators)
+        }
+
+        # Only the min and max reading of each period come back from the server
+        periods = self.pitemp_collection.aggregate(
+            get_days_pipeline(sensor_id, get_contiguous_ranges(day_bounds), periods_per_day)
+        )
+        for period in timed_iter(periods, "mongo_query", "pitemp"):
+            decimator = day_start_to_decimator[to_epoch_ms(period["_id"]["day"])]
+            decimator.add_period(
+                min_timestamp=to_epoch_ms(period["min"]["timestamp"]),
+                min_temp=period["min"]["temp_f"],
+                max_timestamp=to_epoch_ms(period["max"]["timestamp"]),
+                max_temp=period["max"]["temp_f"],
+            )
+
+        return [decimator.get_temperatures() for decimator in decimators]
+
+    def _decimate_days_rollup(
+        self,
+        sensor_id: str,
+        day_bounds: List[Tuple[datetime.datetime, datetime.datetime]],
+        periods_per_day: int,
+    ) -> List[Temperatures]:
+        decimators = [DayDecimator(min_date, periods_per_day) for min_date, _ in day_bounds]
+
+        # Rollup buckets are stored with the start of their day
+        day_start_to_decimator = {
+            to_epoch_ms(min_date): decimator for (min_date, _), decimator in zip(day_bounds, decimators)
+        }
+
+        # Each bucket covers a whole period, so the rollup only holds a handful of buckets per day
+        buckets = self.rollups.collection.find(
+            filter=get_range_filter(sensor_id, get_contiguous_ranges(day_bounds), field="start"),
+            projection=ROLLUP_BUCKET_PROJECTION,
+            batch_size=BATCH_SIZE,
+        )
+        buckets.sort({"start": ASCENDING})
+        for bucket in timed_iter(buckets, "mongo_query", ROLLUP_COLLECTION_NAME):
+            decimator = day_start_to_decimator[to_epoch_ms(bucket["day"])]
+            decimator.add_period(
+                min_timestamp=to_epoch_ms(bucket["min_timestamp"]),
+                min_temp=bucket["min_temp"],
+                max_timestamp=to_epoch_ms(bucket["max_timestamp"]),
+                max_temp=bucket["max_temp"],
+            )
+
+        return [decimator.get_temperatures() for decimator in decimators]
+
+    def _get_cached_days_temperatures(self, day_cache_keys: List[Optional[str]]) -> List[Optional[Temperatures]]:
+        keys = [key for key in day_cache_keys if key]
+        if not keys:
+            return [None] * len(day_cache_keys)
+
+        with time_stage("cache_get", "temperature_day"):
+            cached_values = dict(zip(keys, self.cache.mget(keys)))
+        hits = sum(1 for value in cached_values.values() if value)
+        record_cache_lookups("temperature_day", hits, len(keys) - hits)
+        LOG.info(f"Got {hits} of {len(keys)} days from cache")
+
+        with time_stage("deserialize", "temperature_day"):
+            return [decode_day(cached_values[key]) if key and cached_values[key] else None for key in day_cache_keys]
+
+    def _get_day_cache_keys(
+        self, sensor_id: str, dates: List[datetime.datetime], now_datetime: datetime.datetime
+    ) -> List[Optional[str]]:
+        # We don't want to use the cache for the current day because it is not complete yet
+        return [
+            self._get_day_cache_key(sensor_id, date) if self._is_day_complete(date, now_datetime) else None
+            for date in dates
+        ]
+
+    def _fill_missing_days(
+        self,
+        sensor_id: str,
+        dates: List[datetime.datetime],
+        day_cache_keys: List[Optional[str]],
+        day_temperatures: List[Optional[Temperatures]],
+        periods_per_day: int,
+    ) -> List[Temperatures]:
+        # Every query of the sensor counts as one operation if no server can be found for them
+        with report_server_selection_failures(self.breaker):
+            self._fetch_missing_days(sensor_id, dates, day_cache_keys, day_temperatures)
+
+        if periods_per_day == BASE_PERIODS_PER_DAY:
+            return day_temperatures
+
+        # Coarser views are reduced in memory from the base level instead of going back to the database
+        return [
+            reduce_temperatures(temperatures, get_day_bounds(date)[0], periods_per_day)
+            for date, temperatures in zip(dates, day_temperatures)
+        ]
+
+    def _fetch_missing_days(
+        self,
+        sensor_id: str,
+        dates: List[datetime.datetime],
+        day_cache_keys: List[Optional[str]],
+        day_temperatures: List[Optional[Temperatures]],
+    ):
+        # The current day is picked up from where the last request left it
+        for i, day_cache_key in enumerate(day_cache_keys):
+            if day_cache_key is None:
+                day_temperatures[i] = round_day(self._get_partial_day_temperatures(sensor_id, dates[i]))
+
+        # Every other day that is not cached is calculated at the base level from one pass over the database.
+        # Requests missing the same days wait for one of them to calculate them instead of all scanning the readings.
+        missing_indexes = [i for i, temperatures in enumerate(day_temperatures) if temperatures is None]
+        if missing_indexes and not self.breaker.allow_request():
+            LOG.warning(
+                f"Leaving out {len(missing_indexes)} days of sensor {sensor_id} while the database circuit is open"
+            )
+            for i in missing_indexes:
+                day_temperatures[i] = Temperatures(dates=[], temperatures=[])
+            missing_indexes = []
+        elif missing_indexes and self.decimation_engine == DECIMATION_ENGINE_ROLLUP:
+            missing_indexes = self._fill_days_past_rollups(sensor_id, dates, day_temperatures, missing_indexes)
+
+        if missing_indexes:
+            # Each day is its own flight, so views that overlap share the days they both miss. Day cache keys sort in
+            # date order, which is the order the days are calculated in.
+            cache_key_to_date = {day_cache_keys[i]: dates[i] for i in missing_indexes}
+            calculated = self.single_flight.run_many(
+                [day_cache_keys[i] for i in missing_indexes],
+                lambda keys: self._calculate_and_cache_days(sensor_id, [cache_key_to_date[key] for key in keys], keys),
+                self._read_cached_days_temperatures,
+                "temperature_day",
+            )
+            for i, temperatures in zip(missing_indexes, calculated):
+                day_temperatures[i] = temperatures
+
+    def _fill_days_past_rollups(
+        self,
+        sensor_id: str,
+        dates: List[datetime.datetime],
+        day_temperatures: List[Optional[Temperatures]],
+        missing_indexes: List[int],
+    ) -> List[int]:
+        """
+        The rollups only stand in for the raw readings up to their watermark. Days that end after it, including every
+        day before the first update, are calculated from the raw readings and not cached, so no day is cached before
+        all of its buckets are written. Returns the missing days the rollups do cover.
+        """
+        with time_stage("mongo_query", ROLLUP_COLLECTION_NAME):
+            watermark = self.rollups.get_watermark(sensor_id)
+        past_indexes = [
+            i for i in missing_indexes if watermark is None or to_epoch_ms(get_day_bounds(dates[i])[1]) > watermark
+        ]
+        if not past_indexes:
+            return missing_indexes
+
+        LOG.info(f"Calculating {len(past_indexes)} days of sensor {sensor_id} past the rollups from raw readings")
+        day_bounds = [get_day_bounds(dates[i]) for i in past_indexes]
+        documents = timed_iter(self._find_days_documents(sensor_id, day_bounds), "mongo_query", "pitemp")
+        for i, temperatures in zip(past_indexes, decimate_documents(documents, day_bounds, BASE_PERIODS_PER_DAY)):
+            day_temperatures[i] = round_day(temperatures)
+        return [i for i in missing_indexes if day_temperatures[i] is None]
+
+    def _calculate_and_cache_days(
+        self, sensor_id: str, dates: List[datetime.datetime], day_cache_keys: List[str]
+    ) -> List[Temperatures]:
+        calculated = [
+            round_day(temperatures)
+            for temperatures in self._calculate_days_temperatures(sensor_id, dates, BASE_PERIODS_PER_DAY)
+        ]
+
+        # If the day is not already cached, do so since the data should be immutable. All writes go in one round trip.
+        pipeline = self.cache.pipeline(transaction=False)
+        with time_stage("serialize", "temperature_day"):
+            for date, day_cache_key, temperatures in zip(dates, day_cache_keys, calculated):
+                pipeline.set(day_cache_key, encode_day(temperatures, to_epoch_ms(get_day_bounds(date)[0])))
+        with time_stage("cache_set", "temperature_day"):
+            pipeline.execute()
+
+        return calculated
+
+    def _read_cached_days_temperatures(self, day_cache_keys: List[str]) -> List[Optional[Temperatures]]:
+        # Polled while another worker calculates the days, so it is not counted as cache lookups
+        cached_values = self.cache.mget(day_cache_keys)
+        with time_stage("deserialize", "temperature_day"):
+            return [decode_day(cached_value) if cached_value else None for cached_value in cached_values]
+
+    def _get_partial_day_temperatures(self, sensor_id: str, date: datetime.datetime) -> Temperatures:
+        """
+        Decimates the current day incrementally. The closed periods, the extremes of the open period and the timestamp
+        of the last reading are cached, so each request only reads the readings recorded since the one before it.
+        Like the rollups, readings inserted with a timestamp older than the watermark are not picked up.
+        The partial day always comes from raw readings, whatever the decimation engine.
+        """
+        min_date, max_date = get_day_bounds(date)
+        partial_day_cache_key = self._get_partial_day_cache_key(sensor_id, date)
+
+        with time_stage("cache_get", "temperature_partial_day"):
+            cached_value = self.cache.get(partial_day_cache_key)
+        record_cache_lookup("temperature_partial_day", cached_value is not None)
+        with time_stage("deserialize", "temperature_partial_day"):
+            partial_day = decode_partial_day(cached_value) if cached_value else None
+        if partial_day:
+            decimator = DayDecimator.from_state(min_date, BASE_PERIODS_PER_DAY, partial_day.state)
+            watermark = partial_day.watermark
+        else:
+            decimator = DayDecimator(min_date, BASE_PERIODS_PER_DAY)
+            watermark = None
 
-        period_in_seconds = int(ONE_DAY_IN_SECONDS / periods_per_day)
-        next_boundary = min_date + datetime.timedelta(seconds=period_in_seconds)
-        period_min_temp = None
-        period_min_datetime = None
-        period_max_temp = None
-        period_max_datetime = None
+        # Without the database, the day stops where the last request left it
+        if not self.breaker.allow_request():
+            return decimator.get_temperatures()
 
-        for document in documents:
-            # Timestamps in the database are in UTC
-            timestamp = document["timestamp"].replace(tzinfo=pytz.UTC)
-            temperature = document["temp_f"]
+        if watermark is None:
+            timestamp_filter = {"$gte": min_date, "$lte": max_date}
+        else:
+            timestamp_filter = {"$gt": from_epoch_ms(watermark), "$lte": max_date}
+        documents = self.pitemp_collection.find(
+            filter={"sensorId": sensor_id, "timestamp": timestamp_filter}, projection=READING_PROJECTION
+        )
+        documents.sort({"timestamp": ASCENDING})
 
+        num_readings = 0
+        for document in timed_iter(documents, "mongo_query", "pitemp"):
+            timestamp = document.get("timestamp")
+            temperature = document.get("temp_f")
             if timestamp is None or temperature is None:
-                LOG.warning(f"Invalid document {document}. Skipping.")
                 continue
 
-            # If we are past the boundary of the period, it's time to start a new period by adding the min and max
-            # values then resetting them to give this new period a clean start.
-            if timestamp > next_boundary:
-                # We may not have enough data for the period granularity.
-                # In this case, skip the periods before the current timestamp.
-                if period_min_temp is None or period_max_temp is None:
-                    next_boundary = timestamp
-                    period_min_temp = temperature
-                    period_min_datetime = timestamp
-                    period_max_temp = temperature
-                    period_max_datetime = timestamp
-
-                dates_to_add, temps_to_add = self._get_data_to_add(
-                    min_temp=period_min_temp,
-                    min_date=period_min_datetime,
-                    max_temp=period_max_temp,
-                    max_date=period_max_datetime,
-                )
-                dates.extend([x.strftime(DATETIME_FORMAT_STRING) for x in dates_to_add])
-                temperatures.extend(temps_to_add)
-
-                # Reset values for the next period
-                next_boundary = next_boundary + datetime.timedelta(seconds=period_in_seconds)
-                period_min_temp = None
-                period_min_datetime = None
-                period_max_temp = None
-                period_max_datetime = None
-
-            if (period_min_temp is None) or (temperature < period_min_temp):
-                period_min_temp = temperature
-                period_min_datetime = timestamp
-
-            if (period_max_temp is None) or (temperature > period_max_temp):
-                period_max_temp = temperature
-                period_max_datetime = timestamp
-
-        return Temperatures(dates=dates, temperatures=temperatures)
-
-    def _get_temperatures(
-        self, sensor_id: str, date: datetime.datetime, now_datetime: datetime.datetime, periods_per_day: int
-    ) -> Optional[Temperatures]:
-        hours_diff = abs((date - now_datetime).total_seconds() // 60 // 60)
-
-        if hours_diff >= 24:
-            # Check the cache first to save computation cost
-            day_cache_key = self._get_day_cache_key(sensor_id, date, periods_per_day)
-            cached_day_value: bytes = self.cache.get(day_cache_key)
-
-            if cached_day_value:
-                LOG.info(f"Getting day value from cache for key {day_cache_key}: {cached_day_value}")
-                day_temperatures = Temperatures(**json.loads(cached_day_value.decode()))
-            else:
-                # If the day is not already cached, do so since the data should be immutable
-                day_temperatures = self._calculate_day_temperatures(sensor_id, date, periods_per_day)
-                if day_temperatures:
-                    self.cache.set(day_cache_key, json.dumps(day_temperatures, cls=CustomJsonEncoder))
-        else:
-            # We don't want to set the cache for the current day because it is not complete yet
-            day_temperatures = self._calculate_day_temperatures(sensor_id, date, periods_per_day)
-
-        return day_temperatures
-
-    def _get_decimated_data(self, sensor_id: str, days_back: int) -> TemperatureDataSet:
-        now_datetime = datetime.datetime.now(pytz.timezone(DEFAULT_TIMEZONE))
-
+            watermark = to_epoch_ms(timestamp)
+            decimator.add(watermark, temperature)
+            num_readings += 1
+
+        LOG.info(f"Added {num_readings} new readings to the current day of sensor {sensor_id}")
+        if num_readings or not partial_day:
+            partial_day = PartialDay(state=decimator.get_state(), watermark=watermark)
+            with time_stage("serialize", "temperature_partial_day"):
+                encoded = encode_partial_day(partial_day)
+            with time_stage("cache_set", "temperature_partial_day"):
+                self.cache.set(partial_day_cache_key, encoded, ex=PARTIAL_DAY_CACHE_TTL)
+
+        return decimator.get_temperatures()
+
+    def _get_most_recent_document(self, sensor_id: str) -> Optional[dict]:
+        # Once the watcher has loaded them, the latest readings are served from memory
+        if self.latest_readings.loaded:
+            return self.latest_readings.get(sensor_id)
+        if not self.breaker.allow_request():
+            return None
+        with time_stage("mongo_query", "pitemp"), report_server_selection_failures(self.breaker):
+            return self.pitemp_collection.find_one(filter={"sensorId": sensor_id}, sort=[("timestamp", DESCENDING)])
+
+    def _get_decimated_data(
+        self,
+        sensor_id: str,
+        day_temperatures: List[Temperatures],
+        most_recent_document: Optional[dict],
+        points: Optional[int] = None,
+    ) -> TemperatureDataSet:
         dates: List[str] = []
         temperatures: List[float] = []
 
-        current_date = now_datetime - datetime.timedelta(days=days_back)
-        futures: List[Optional[Future]] = [None] * (days_back + 1)
-        periods_per_day = self._get_periods_per_day(days_back)
+        for result in day_temperatures:
+            dates.extend(result.dates)
+            temperatures.extend(result.temperatures)
 
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            for i in range(days_back + 1):
-                futures[i] = executor.submit(
-                    self._get_temperatures, sensor_id, current_date, now_datetime, periods_per_day
-                )
-                current_date = current_date + datetime.timedelta(days=1)
+        # Defaults in case we got no data
+        current_temp = temperatures[-1] if temperatures else -1
+        min_temp = min(temperatures) if temperatures else -1
+        max_temp = max(temperatures) if temperatures else -1
 
-            for i in range(len(futures)):
-                result = futures[i].result()
-                if result:
-                    dates.extend(result.dates)
-                    temperatures.extend(result.temperatures)
+        # The extremes above come from every period, even if downsampling drops some of them
+        if points:
+            downsampled = downsample_temperatures(day_temperatures, points)
+            dates = downsampled.dates
+            temperatures = downsampled.temperatures
 
         data = []
         for i in range(len(dates)):
             data.append({"x": dates[i], "y": temperatures[i]})
 
         # Make sure we get the most recent data point regardless of decimation
-        most_recent_document = self.pitemp_collection.find_one(
-            filter={"sensorId": sensor_id}, sort=[("timestamp", DESCENDING)]
-        )
         if most_recent_document and data:
-            most_recent_timestamp = most_recent_document["timestamp"].replace(tzinfo=pytz.UTC)
+            most_recent_timestamp = to_epoch_ms(most_recent_document["timestamp"])
             most_recent_temperature = most_recent_document["temp_f"]
             if data[-1]["x"] != most_recent_timestamp:
-                data.append({"x": most_recent_timestamp.strftime(DATETIME_FORMAT_STRING), "y": most_recent_temperature})
-
-        # Defaults in case we got no data
-        current_temp = temperatures[-1] if temperatures else -1
-        min_temp = min(temperatures) if temperatures else -1
-        max_temp = max(temperatures) if temperatures else -1
+                data.append({"x": most_recent_timestamp, "y": most_recent_temperature})
 
         return TemperatureDataSet(
             label=f"{sensor_id} - Temperature (°F)",
@@ -229,13 +606,22 @@ class ApplicationDao:
         )
 
     @staticmethod
-    def _get_day_cache_key(sensor_id: str, date: datetime.datetime, periods_per_day: int) -> str:
-        return f"{sensor_id}_{date.strftime(DATE_FORMAT_STRING)}_{periods_per_day}"
+    def _is_day_complete(date: datetime.datetime, now_datetime: datetime.datetime) -> bool:
+        hours_diff = abs((date - now_datetime).total_seconds() // 60 // 60)
+        return hours_diff >= 24
+
+    @staticmethod
+    def _get_day_cache_key(sensor_id: str, date: datetime.datetime) -> str:
+        return f"{sensor_id}_{date.strftime(DATE_FORMAT_STRING)}"
+
+    @staticmethod
+    def _get_partial_day_cache_key(sensor_id: str, date: datetime.datetime) -> str:
+        return f"{sensor_id}_{date.strftime(DATE_FORMAT_STRING)}_partial"
 
     @staticmethod
     def _get_periods_per_day(num_days: int) -> int:
         if num_days < 4:
-            return 96
+            return BASE_PERIODS_PER_DAY
         if num_days < 7:
             return 48
         if num_days < 31:
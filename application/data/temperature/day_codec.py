@@ -0,0 +1,134 @@
+import json
+import logging
+import struct
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+
+from application.data.custom_json_encoder import CustomJsonEncoder
+from application.data.temperature.decimation import DecimatorState, legacy_date_to_epoch_ms
+from application.data.temperature.temperatures import Temperatures
+
+LOG = logging.getLogger(__name__)
+
+# Magic byte, version, day start in epoch milliseconds and number of points
+HEADER = struct.Struct("<cBqI")
+MAGIC = b"T"
+BINARY_VERSION = 1
+PARTIAL_DAY_VERSION = 1
+
+# float32 keeps about seven significant digits, so four decimals give back the stored temperature
+TEMPERATURE_DECIMALS = 4
+
+
+class DayCodec(ABC):
+    """Turns the decimated points of one day into a cache value and back"""
+
+    @abstractmethod
+    def encode(self, temperatures: Temperatures, day_start: int) -> bytes:
+        pass
+
+    @abstractmethod
+    def decode(self, value: bytes) -> Temperatures:
+        pass
+
+
+class JsonDayCodec(DayCodec):
+    """The original format. Still read so entries cached before the binary format keep working."""
+
+    def encode(self, temperatures: Temperatures, day_start: int) -> bytes:
+        return json.dumps(temperatures, cls=CustomJsonEncoder).encode()
+
+    def decode(self, value: bytes) -> Temperatures:
+        temperatures = Temperatures(**json.loads(value.decode()))
+
+        # Entries written before timestamps were kept as epoch milliseconds hold formatted dates
+        if temperatures.dates and isinstance(temperatures.dates[0], str):
+            temperatures.dates = [legacy_date_to_epoch_ms(date) for date in temperatures.dates]
+
+        return temperatures
+
+
+class BinaryDayCodec(DayCodec):
+    """
+    Packs a day as a small header, then int32 millisecond offsets from the start of the day, then float32
+    temperatures. A day is less than 2^31 milliseconds long, so the offsets keep full precision.
+    Decoding reads the columns straight out of the buffer. Temperatures are stored as float32, so they come back
+    rounded to TEMPERATURE_DECIMALS (4) decimals. Days are rounded the same way when they are calculated.
+    """
+
+    def encode(self, temperatures: Temperatures, day_start: int) -> bytes:
+        count = len(temperatures.dates)
+        offsets = np.asarray(temperatures.dates, dtype=np.int64) - day_start
+        return b"".join(
+            (
+                HEADER.pack(MAGIC, BINARY_VERSION, day_start, count),
+                offsets.astype("<i4").tobytes(),
+                np.asarray(temperatures.temperatures, dtype="<f4").tobytes(),
+            )
+        )
+
+    def decode(self, value: bytes) -> Temperatures:
+        _, _, day_start, count = HEADER.unpack_from(value)
+        offsets = np.frombuffer(value, dtype="<i4", count=count, offset=HEADER.size)
+        values = np.frombuffer(value, dtype="<f4", count=count, offset=HEADER.size + 4 * count)
+
+        return Temperatures(
+            dates=(offsets.astype(np.int64) + day_start).tolist(),
+            temperatures=_round_temperatures(values),
+        )
+
+
+def _round_temperatures(values: np.ndarray) -> List[float]:
+    return np.round(values.astype(np.float64), TEMPERATURE_DECIMALS).tolist()
+
+
+def round_day(temperatures: Temperatures) -> Temperatures:
+    # Gives a freshly calculated day the same temperatures it will have once it is decoded from the cache
+    return Temperatures(
+        dates=temperatures.dates, temperatures=_round_temperatures(np.asarray(temperatures.temperatures, dtype="<f4"))
+    )
+
+
+JSON_DAY_CODEC = JsonDayCodec()
+BINARY_DAY_CODEC = BinaryDayCodec()
+
+
+def encode_day(temperatures: Temperatures, day_start: int) -> bytes:
+    return BINARY_DAY_CODEC.encode(temperatures, day_start)
+
+
+def decode_day(value: bytes) -> Optional[Temperatures]:
+    # The first byte tells the formats apart: binary entries start with the magic byte and JSON with a brace
+    if value[:1] == MAGIC:
+        version = value[1]
+        if version != BINARY_VERSION:
+            LOG.warning(f"Unknown day cache version {version}. Ignoring the entry.")
+            return None
+        return BINARY_DAY_CODEC.decode(value)
+
+    return JSON_DAY_CODEC.decode(value)
+
+
+@dataclass
+class PartialDay:
+    """A day that is still being recorded, along with the timestamp of the last reading added to it"""
+
+    state: DecimatorState
+    watermark: Optional[int]
+
+
+def encode_partial_day(partial_day: PartialDay) -> bytes:
+    # Partial days are small and rewritten often, so plain JSON is good enough
+    value = {"version": PARTIAL_DAY_VERSION, "state": partial_day.state, "watermark": partial_day.watermark}
+    return json.dumps(value, cls=CustomJsonEncoder).encode()
+
+
+def decode_partial_day(value: bytes) -> Optional[PartialDay]:
+    partial_day = json.loads(value.decode())
+    if partial_day.get("version") != PARTIAL_DAY_VERSION:
+        LOG.warning(f"Unknown partial day cache version {partial_day.get('version')}. Ignoring the entry.")
+        return None
+    return PartialDay(state=DecimatorState(**partial_day["state"]), watermark=partial_day["watermark"])
@@ -0,0 +1,318 @@
+import datetime
+import logging
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Tuple
+
+import pytz
+
+from application.constants.app_constants import DATETIME_FORMAT_STRING, DEFAULT_TIMEZONE, ONE_DAY_IN_SECONDS
+from application.data.temperature.temperatures import Temperatures
+
+LOG = logging.getLogger(__name__)
+
+EPOCH = datetime.datetime(1970, 1, 1)
+EPOCH_UTC = EPOCH.replace(tzinfo=pytz.UTC)
+ONE_MILLISECOND = datetime.timedelta(milliseconds=1)
+# Decimation only ever reads these two fields of a reading
+READING_PROJECTION = {"_id": 0, "timestamp": 1, "temp_f": 1}
+
+# We cannot show every data point for every view. Showing 90 days worth of data would be incredibly slow.
+# The algorithms in this module divide a single day into periods and only keep the lowest and highest
+# temperature recorded for each period. This preserves the peaks and valleys for the most useful information.
+# This is a process called 'decimation'.
+#
+# Periods are closed on the right: a reading that lands exactly on a boundary belongs to the period ending there.
+# A reading at the very first instant of the day belongs to the first period. Every engine must bucket readings
+# this way so that they all produce the same points.
+
+
+def get_day_bounds(date: datetime.datetime) -> Tuple[datetime.datetime, datetime.datetime]:
+    # The first instant and last instant of the calendar date
+    min_date = datetime.datetime.combine(date, datetime.time.min).replace(tzinfo=pytz.timezone(DEFAULT_TIMEZONE))
+    max_date = datetime.datetime.combine(date, datetime.time.max).replace(tzinfo=pytz.timezone(DEFAULT_TIMEZONE))
+    return min_date, max_date
+
+
+def get_day_start(timestamp: datetime.datetime) -> datetime.datetime:
+    # The start of the day that contains the timestamp, using the same fixed offset as get_day_bounds
+    utc_offset = get_day_bounds(timestamp)[0].utcoffset()
+    return get_day_bounds(timestamp.astimezone(datetime.timezone(utc_offset)))[0]
+
+
+def to_epoch_ms(date_time: datetime.datetime) -> int:
+    # Timestamps in the database are naive UTC datetimes
+    if date_time.tzinfo is None:
+        return (date_time - EPOCH) // ONE_MILLISECOND
+    return (date_time - EPOCH_UTC) // ONE_MILLISECOND
+
+
+def legacy_date_to_epoch_ms(date: str) -> int:
+    # Older cache entries hold UTC dates truncated to whole seconds. Placing each one at the end of its second keeps
+    # a reading taken just after a period boundary in the period it came from.
+    return to_epoch_ms(datetime.datetime.strptime(date, DATETIME_FORMAT_STRING)) + 999
+
+
+def from_epoch_ms(timestamp: int) -> datetime.datetime:
+    # The naive UTC datetime the database uses
+    return EPOCH + datetime.timedelta(milliseconds=timestamp)
+
+
+def get_period_in_seconds(periods_per_day: int) -> int:
+    return int(ONE_DAY_IN_SECONDS / periods_per_day)
+
+
+def get_period_index(timestamp: int, min_timestamp: int, period_in_ms: int) -> int:
+    # Ceiling division minus one gives right-closed periods
+    return max(0, -((min_timestamp - timestamp) // period_in_ms) - 1)
+
+
+def get_data_to_add(min_temp: float, min_date: int, max_temp: float, max_date: int) -> (List[int], List[float]):
+    if min_temp == max_temp:
+        return [min_date], [min_temp]
+    elif min_date <= max_date:
+        return [min_date, max_date], [min_temp, max_temp]
+    else:
+        return [max_date, min_date], [max_temp, min_temp]
+
+
+@dataclass
+class DecimatorState:
+    """The closed periods of a DayDecimator and the extremes of its open period"""
+
+    dates: List[int]
+    temperatures: List[float]
+    period_index: Optional[int]
+    period_min_temp: Optional[float]
+    period_min_timestamp: Optional[int]
+    period_max_temp: Optional[float]
+    period_max_timestamp: Optional[int]
+
+
+class Decimator:
+    """
+    Reduces readings to the min and max points of each period, counting periods from min_timestamp.
+    Timestamps are epoch milliseconds and readings must be added from oldest to newest.
+    """
+
+    def __init__(self, min_timestamp: int, period_in_ms: int):
+        self.min_timestamp = min_timestamp
+        self.period_in_ms = period_in_ms
+
+        self.dates: List[int] = []
+        self.temperatures: List[float] = []
+
+        self._period_index: Optional[int] = None
+        self._period_min_temp = None
+        self._period_min_timestamp = None
+        self._period_max_temp = None
+        self._period_max_timestamp = None
+
+    def set_state(self, state: DecimatorState):
+        self.dates = list(state.dates)
+        self.temperatures = list(state.temperatures)
+        self._period_index = state.period_index
+        self._period_min_temp = state.period_min_temp
+        self._period_min_timestamp = state.period_min_timestamp
+        self._period_max_temp = state.period_max_temp
+        self._period_max_timestamp = state.period_max_timestamp
+
+    def get_state(self) -> DecimatorState:
+        # Taken before get_temperatures closes the open period, so more readings can be added to it later
+        return DecimatorState(
+            dates=list(self.dates),
+            temperatures=list(self.temperatures),
+            period_index=self._period_index,
+            period_min_temp=self._period_min_temp,
+            period_min_timestamp=self._period_min_timestamp,
+            period_max_temp=self._period_max_temp,
+            period_max_timestamp=self._period_max_timestamp,
+        )
+
+    def add(self, timestamp: int, temperature: float):
+        period_index = get_period_index(timestamp, self.min_timestamp, self.period_in_ms)
+
+        # If we are past the boundary of the period, it's time to start a new period by adding the min and max
+        # values then resetting them to give this new period a clean start. Periods without any readings are skipped.
+        if period_index != self._period_index:
+            self._close_period()
+            self._period_index = period_index
+
+        if (self._period_min_temp is None) or (temperature < self._period_min_temp):
+            self._period_min_temp = temperature
+            self._period_min_timestamp = timestamp
+
+        if (self._period_max_temp is None) or (temperature > self._period_max_temp):
+            self._period_max_temp = temperature
+            self._period_max_timestamp = timestamp
+
+    def add_period(self, min_timestamp: int, min_temp: float, max_timestamp: int, max_temp: float):
+        # Adding the two extremes of an already reduced period in time order gives the same result as adding
+        # every reading of that period
+        if min_timestamp <= max_timestamp:
+            self.add(min_timestamp, min_temp)
+            self.add(max_timestamp, max_temp)
+        else:
+            self.add(max_timestamp, max_temp)
+            self.add(min_timestamp, min_temp)
+
+    def get_temperatures(self) -> Temperatures:
+        self._close_period()
+        return Temperatures(dates=self.dates, temperatures=self.temperatures)
+
+    def _close_period(self):
+        if self._period_min_temp is None or self._period_max_temp is None:
+            return
+
+        dates_to_add, temps_to_add = get_data_to_add(
+            min_temp=self._period_min_temp,
+            min_date=self._period_min_timestamp,
+            max_temp=self._period_max_temp,
+            max_date=self._period_max_timestamp,
+        )
+        self.dates.extend(dates_to_add)
+        self.temperatures.extend(temps_to_add)
+
+        # Reset values for the next period
+        self._period_min_temp = None
+        self._period_min_timestamp = None
+        self._period_max_temp = None
+        self._period_max_timestamp = None
+
+
+class DayDecimator(Decimator):
+    """Decimates a single day into a fixed number of periods"""
+
+    def __init__(self, min_date: datetime.datetime, periods_per_day: int):
+        super().__init__(to_epoch_ms(min_date), get_period_in_seconds(periods_per_day) * 1000)
+
+    @classmethod
+    def from_state(cls, min_date: datetime.datetime, periods_per_day: int, state: DecimatorState) -> "DayDecimator":
+        decimator = cls(min_date, periods_per_day)
+        decimator.set_state(state)
+        return decimator
+
+
+def decimate_documents(
+    documents: Iterable[dict],
+    day_bounds: List[Tuple[datetime.datetime, datetime.datetime]],
+    periods_per_day: int,
+) -> List[Temperatures]:
+    """
+    Decimates readings from many days in a single pass.
+    The documents must be ordered from oldest to newest and fall within the given day bounds.
+    """
+    decimators = [DayDecimator(min_date, periods_per_day) for min_date, _ in day_bounds]
+    day_ends = [to_epoch_ms(max_date) for _, max_date in day_bounds]
+
+    # Walk the documents once, moving on to the next day whenever a reading passes the end of the current one
+    day_index = 0
+    for document in documents:
+        timestamp = document.get("timestamp")
+        temperature = document.get("temp_f")
+
+        if timestamp is None or temperature is None:
+            LOG.warning(f"Invalid document {document}. Skipping.")
+            continue
+
+        timestamp = to_epoch_ms(timestamp)
+        while timestamp > day_ends[day_index]:
+            day_index += 1
+
+        decimators[day_index].add(timestamp, temperature)
+
+    return [decimator.get_temperatures() for decimator in decimators]
+
+
+def reduce_temperatures(temperatures: Temperatures, min_date: datetime.datetime, periods_per_day: int) -> Temperatures:
+    """
+    Reduces an already decimated day to fewer periods. The min and max of a coarse period are always among the
+    points of the finer periods inside it, so this gives the same result as decimating the raw readings again.
+    """
+    decimator = DayDecimator(min_date, periods_per_day)
+    for timestamp, temperature in zip(temperatures.dates, temperatures.temperatures):
+        decimator.add(timestamp, temperature)
+    return decimator.get_temperatures()
+
+
+def get_contiguous_ranges(
+    day_bounds: List[Tuple[datetime.datetime, datetime.datetime]],
+) -> List[Tuple[datetime.datetime, datetime.datetime]]:
+    """
+    Merges the bounds of consecutive days so a range query only needs one clause per run of days.
+    The day bounds must be ordered from oldest to newest.
+    """
+    ranges = []
+    for min_date, max_date in day_bounds:
+        if ranges and min_date - ranges[-1][1] <= datetime.timedelta(microseconds=1):
+            ranges[-1] = (ranges[-1][0], max_date)
+        else:
+            ranges.append((min_date, max_date))
+    return ranges
+
+
+def get_range_filter(
+    sensor_id: str, ranges: List[Tuple[datetime.datetime, datetime.datetime]], field: str = "timestamp"
+) -> dict:
+    timestamp_filters = [{field: {"$gte": min_date, "$lte": max_date}} for min_date, max_date in ranges]
+    if len(timestamp_filters) == 1:
+        return {"sensorId": sensor_id, **timestamp_filters[0]}
+    return {"sensorId": sensor_id, "$or": timestamp_filters}
+
+
+def get_days_pipeline(
+    sensor_id: str, ranges: List[Tuple[datetime.datetime, datetime.datetime]], periods_per_day: int
+) -> List[dict]:
+    """
+    Builds an aggregation pipeline that decimates many days on the database server.
+    The result is one document per day and period that has readings, ordered by day then period, holding the first
+    reading with the lowest temperature and the first reading with the highest temperature.
+    Requires MongoDB 5.2 or newer.
+    """
+    period_in_ms = get_period_in_seconds(periods_per_day) * 1000
+    # Every day starts at midnight in the same fixed offset used by get_day_bounds
+    utc_offset = ranges[0][0].strftime("%z")
+
+    return [
+        {"$match": {**get_range_filter(sensor_id, ranges), "temp_f": {"$ne": None}}},
+        {
+            "$project": {
+                "_id": 0,
+                "timestamp": 1,
+                "temp_f": 1,
+                "day": {"$dateTrunc": {"date": "$timestamp", "unit": "day", "timezone": utc_offset}},
+            }
+        },
+        {
+            "$set": {
+                "period": {
+                    "$max": [
+                        0,
+                        {
+                            "$subtract": [
+                                {"$ceil": {"$divide": [{"$subtract": ["$timestamp", "$day"]}, period_in_ms]}},
+                                1,
+                            ]
+                        },
+                    ]
+                },
+            }
+        },
+        {
+            "$group": {
+                "_id": {"day": "$day", "period": "$period"},
+                "min": {
+                    "$top": {
+                        "sortBy": {"temp_f": 1, "timestamp": 1},
+                        "output": {"timestamp": "$timestamp", "temp_f": "$temp_f"},
+                    }
+                },
+                "max": {
+                    "$top": {
+                        "sortBy": {"temp_f": -1, "timestamp": 1},
+                        "output": {"timestamp": "$timestamp", "temp_f": "$temp_f"},
+                    }
+                },
+            }
+        },
+        {"$sort": {"_id.day": 1, "_id.period": 1}},
+    ]
@@ -0,0 +1,66 @@
+from typing import List, Optional
+
+import numpy as np
+
+from application.data.temperature.temperatures import Temperatures
+
+MIN_POINTS = 3
+MAX_POINTS = 10000
+
+
+def clamp_points(points: Optional[int]) -> Optional[int]:
+    if points is None:
+        return None
+    return min(max(points, MIN_POINTS), MAX_POINTS)
+
+
+def largest_triangle_three_buckets(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Picks the indexes of threshold points that keep the visual shape of the series.
+    The first and last points are always kept. Every other bucket keeps the point that forms the largest triangle
+    with the point kept from the previous bucket and the average of the next bucket.
+    """
+    num_points = len(x)
+    if threshold >= num_points or threshold < MIN_POINTS:
+        return np.arange(num_points)
+
+    # threshold - 2 buckets over the points between the first and the last, followed by the last point on its own
+    edges = np.append(np.linspace(1, num_points - 1, threshold - 1).astype(np.int64), num_points)
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = num_points - 1
+
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = edges[i + 1], edges[i + 2]
+
+        average_x = x[next_start:next_end].mean()
+        average_y = y[next_start:next_end].mean()
+        areas = np.abs(
+            (x[previous] - average_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (average_y - y[previous])
+        )
+
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+
+    return selected
+
+
+def downsample_temperatures(day_temperatures: List[Temperatures], points: int) -> Temperatures:
+    """
+    Joins decimated days and reduces them to a fixed number of points.
+    The decimated days already hold the min and max of every period, so this is MinMax-LTTB.
+    """
+    dates = [date for temperatures in day_temperatures for date in temperatures.dates]
+    values = [value for temperatures in day_temperatures for value in temperatures.temperatures]
+    if len(dates) <= points:
+        return Temperatures(dates=dates, temperatures=values)
+
+    x = np.array(dates, dtype=np.float64)
+    y = np.array(values, dtype=np.float64)
+    indexes = largest_triangle_three_buckets(x, y, points)
+
+    return Temperatures(dates=[dates[i] for i in indexes], temperatures=[values[i] for i in indexes])
@@ -0,0 +1,55 @@
+import json
+import zlib
+from typing import Iterable, Iterator
+
+from application.data.temperature.decimation import to_epoch_ms
+
+EXPORT_FORMAT_CSV = "csv"
+EXPORT_FORMAT_NDJSON = "ndjson"
+EXPORT_FORMAT_TO_MIMETYPE = {
+    EXPORT_FORMAT_CSV: "text/csv",
+    EXPORT_FORMAT_NDJSON: "application/x-ndjson",
+}
+# Rows are encoded and handed to the server this many at a time, which bounds the memory of an export
+ROWS_PER_CHUNK = 5000
+COMPRESSION_LEVEL = 6
+# Window bits that make zlib write a gzip header and trailer
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def _format_csv_row(timestamp: int, temperature) -> str:
+    return f"{timestamp},{'' if temperature is None else temperature}\n"
+
+
+def _format_ndjson_row(timestamp: int, temperature) -> str:
+    return json.dumps({"timestamp": timestamp, "temp_f": temperature}) + "\n"
+
+
+def encode_readings(readings: Iterable[dict], export_format: str) -> Iterator[bytes]:
+    """Encodes readings as rows of epoch milliseconds and temperature, in chunks of ROWS_PER_CHUNK rows"""
+    if export_format == EXPORT_FORMAT_CSV:
+        format_row = _format_csv_row
+        yield b"timestamp,temp_f\n"
+    elif export_format == EXPORT_FORMAT_NDJSON:
+        format_row = _format_ndjson_row
+    else:
+        raise ValueError(f"Unknown export format {export_format}")
+
+    rows = []
+    for reading in readings:
+        rows.append(format_row(to_epoch_ms(reading["timestamp"]), reading.get("temp_f")))
+        if len(rows) == ROWS_PER_CHUNK:
+            yield "".join(rows).encode()
+            rows = []
+    if rows:
+        yield "".join(rows).encode()
+
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    # One gzip stream across every chunk. Chunks that only fill the compressor's buffer yield nothing.
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
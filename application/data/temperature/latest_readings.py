@@ -0,0 +1,129 @@
+import logging
+import threading
+from typing import Dict, Optional
+
+from pymongo.collection import Collection
+from pymongo.errors import PyMongoError
+
+LOG = logging.getLogger(__name__)
+
+# Matches nothing before the sort, so the server can read just the newest entry of each sensor off the
+# {sensorId: 1, timestamp: -1} index. Readings without a temperature are skipped afterwards.
+LATEST_READINGS_PIPELINE = [
+    {"$sort": {"sensorId": 1, "timestamp": -1}},
+    {"$group": {"_id": "$sensorId", "timestamp": {"$first": "$timestamp"}, "temp_f": {"$first": "$temp_f"}}},
+]
+
+
+class LatestReadings:
+    """
+    The newest reading of every sensor, kept in memory for the whole process.
+    Every change bumps a version so any number of listeners can wait for the next one.
+    """
+
+    def __init__(self, pitemp_collection: Collection):
+        self.pitemp_collection = pitemp_collection
+        self.loaded = False
+        self.version = 0
+        self._sensor_to_reading: Dict[str, dict] = {}
+        self._changed = threading.Condition()
+
+    def refresh(self):
+        # One query for every sensor, however many pages are open
+        documents = list(self.pitemp_collection.aggregate(LATEST_READINGS_PIPELINE))
+        with self._changed:
+            readings = {}
+            for document in documents:
+                sensor_id = document["_id"]
+                if sensor_id is None:
+                    continue
+                if document.get("timestamp") is None or document.get("temp_f") is None:
+                    # A sensor whose newest reading has no temperature keeps the reading it had
+                    if sensor_id in self._sensor_to_reading:
+                        readings[sensor_id] = self._sensor_to_reading[sensor_id]
+                    continue
+                readings[sensor_id] = {
+                    "sensorId": sensor_id,
+                    "timestamp": document["timestamp"],
+                    "temp_f": document["temp_f"],
+                }
+
+            if readings != self._sensor_to_reading:
+                self._sensor_to_reading = readings
+                self._notify()
+            self.loaded = True
+
+    def add(self, document: dict):
+        sensor_id = document.get("sensorId")
+        if sensor_id is None or document.get("timestamp") is None or document.get("temp_f") is None:
+            return
+
+        with self._changed:
+            current = self._sensor_to_reading.get(sensor_id)
+            if current is None or document["timestamp"] > current["timestamp"]:
+                self._sensor_to_reading[sensor_id] = {
+                    "sensorId": sensor_id,
+                    "timestamp": document["timestamp"],
+                    "temp_f": document["temp_f"],
+                }
+                self._notify()
+
+    def get(self, sensor_id: str) -> Optional[dict]:
+        with self._changed:
+            return self._sensor_to_reading.get(sensor_id)
+
+    def get_all(self) -> Dict[str, dict]:
+        with self._changed:
+            return dict(self._sensor_to_reading)
+
+    def wait_for_change(self, version: int, timeout: float) -> int:
+        # Returns the version after the wait, which is still the given one if nothing changed in time
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout=timeout)
+            return self.version
+
+    def _notify(self):
+        self.version += 1
+        self._changed.notify_all()
+
+
+class LatestReadingsWatcher(threading.Thread):
+    """
+    Keeps the latest readings up to date. Inserts are followed with a change stream when the database supports it,
+    which needs a replica set. Otherwise the latest readings are polled.
+    """
+
+    def __init__(self, latest_readings: LatestReadings, poll_interval_seconds: int):
+        super().__init__(name="latest-readings-watcher", daemon=True)
+        self.latest_readings = latest_readings
+        self.poll_interval_seconds = poll_interval_seconds
+        self._stopped = threading.Event()
+
+    def run(self):
+        try:
+            self.latest_readings.refresh()
+        except Exception:
+            LOG.exception("Failed to load the latest readings")
+
+        try:
+            self._watch()
+        except PyMongoError as e:
+            LOG.info(f"Change streams are not available ({e}). Polling for the latest readings instead.")
+
+        while not self._stopped.wait(self.poll_interval_seconds):
+            try:
+                self.latest_readings.refresh()
+            except Exception:
+                LOG.exception("Failed to poll the latest readings")
+
+    def stop(self):
+        self._stopped.set()
+
+    def _watch(self):
+        pipeline = [{"$match": {"operationType": "insert"}}]
+        with self.latest_readings.pitemp_collection.watch(pipeline, max_await_time_ms=1000) as stream:
+            LOG.info("Following new readings with a change stream")
+            while not self._stopped.is_set():
+                change = stream.try_next()
+                if change:
+                    self.latest_readings.add(change["fullDocument"])
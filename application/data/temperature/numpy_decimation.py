@@ -0,0 +1,166 @@
+import datetime
+import logging
+from typing import Iterable, List, Optional, Tuple
+
+import bson
+import numpy as np
+
+from application.data.temperature.decimation import EPOCH, ONE_MILLISECOND, get_period_in_seconds, to_epoch_ms
+from application.data.temperature.temperatures import Temperatures
+
+LOG = logging.getLogger(__name__)
+
+BSON_DATETIME = 0x09
+BSON_DOUBLE = 0x01
+
+
+def _get_reading_layout(field_names: Tuple[str, str]) -> np.dtype:
+    # The BSON of a projected reading: its size, then each element as a type byte, a null terminated name and a value
+    fields = [("size", "<i4")]
+    for name in field_names:
+        value_type = "<i8" if name == "timestamp" else "<f8"
+        fields.extend([(f"{name}_type", "u1"), (f"{name}_name", f"S{len(name) + 1}"), (name, value_type)])
+    fields.append(("end", "u1"))
+    return np.dtype(fields)
+
+
+# Fields keep the order they were inserted in, so both orders are recognized
+READING_LAYOUTS = [_get_reading_layout(("timestamp", "temp_f")), _get_reading_layout(("temp_f", "timestamp"))]
+
+
+def load_readings(documents: Iterable[dict]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Loads readings into columns: epoch milliseconds as int64 and temperatures as float64.
+    Timestamps in the database are naive UTC datetimes.
+    """
+    timestamps = []
+    temperatures = []
+    for document in documents:
+        timestamp = document.get("timestamp")
+        temperature = document.get("temp_f")
+
+        if timestamp is None or temperature is None:
+            LOG.warning(f"Invalid document {document}. Skipping.")
+            continue
+
+        # Integer timedelta division is much faster than letting NumPy convert datetime objects
+        timestamps.append((timestamp - EPOCH) // ONE_MILLISECOND)
+        temperatures.append(temperature)
+
+    return np.array(timestamps, dtype=np.int64), np.array(temperatures, dtype=np.float64)
+
+
+def _read_fixed_layout(batch: bytes) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Reads a batch of readings projected to their timestamp and temperature without decoding any document.
+    Every such document has exactly the same size and layout, so the whole batch is one NumPy structured array.
+    Returns None when any document differs, for example a missing field or a temperature stored as an integer.
+    """
+    for layout in READING_LAYOUTS:
+        if len(batch) % layout.itemsize:
+            continue
+
+        documents = np.frombuffer(batch, dtype=layout)
+        if (
+            (documents["size"] == layout.itemsize).all()
+            and (documents["timestamp_type"] == BSON_DATETIME).all()
+            and (documents["timestamp_name"] == b"timestamp").all()
+            and (documents["temp_f_type"] == BSON_DOUBLE).all()
+            and (documents["temp_f_name"] == b"temp_f").all()
+            and (documents["end"] == 0).all()
+        ):
+            return documents["timestamp"], documents["temp_f"]
+
+    return None
+
+
+def load_raw_readings(batches: Iterable[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Loads readings from batches of raw BSON, like those of find_raw_batches, into the same columns as load_readings.
+    Batches that do not have the fixed layout are decoded document by document instead.
+    """
+    timestamp_columns = []
+    temperature_columns = []
+    for batch in batches:
+        columns = _read_fixed_layout(batch)
+        if columns is None:
+            columns = load_readings(bson.decode_all(batch))
+
+        timestamp_columns.append(columns[0])
+        temperature_columns.append(columns[1])
+
+    if not timestamp_columns:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+    return (
+        np.concatenate(timestamp_columns).astype(np.int64, copy=False),
+        np.concatenate(temperature_columns).astype(np.float64, copy=False),
+    )
+
+
+def decimate_readings(
+    timestamps: np.ndarray,
+    temperatures: np.ndarray,
+    day_bounds: List[Tuple[datetime.datetime, datetime.datetime]],
+    periods_per_day: int,
+) -> List[Temperatures]:
+    """
+    Vectorized version of DayDecimator over many days. The readings must be ordered from oldest to newest and fall
+    within the given day bounds. Produces exactly the same points as the Python engine.
+    """
+    if len(timestamps) == 0:
+        return [Temperatures(dates=[], temperatures=[]) for _ in day_bounds]
+
+    period_in_ms = get_period_in_seconds(periods_per_day) * 1000
+    day_starts = np.array([to_epoch_ms(min_date) for min_date, _ in day_bounds], dtype=np.int64)
+
+    # Right-closed periods: ceiling division minus one, with the first instant of the day in the first period
+    day_indexes = np.searchsorted(day_starts, timestamps, side="right") - 1
+    offsets = timestamps - day_starts[day_indexes]
+    period_indexes = np.maximum(0, -(-offsets // period_in_ms) - 1)
+    buckets = day_indexes * periods_per_day + period_indexes
+
+    # Readings are in time order, so every bucket is a contiguous run
+    positions = np.arange(len(timestamps))
+    bucket_starts = np.flatnonzero(np.diff(buckets, prepend=-1))
+
+    # Sorting by bucket, then temperature, then position puts the earliest lowest (or highest) reading first
+    min_indexes = np.lexsort((positions, temperatures, buckets))[bucket_starts]
+    max_indexes = np.lexsort((positions, -temperatures, buckets))[bucket_starts]
+
+    # Each period gives its min and max in time order, or a single point when they are equal
+    min_first = timestamps[min_indexes] <= timestamps[max_indexes]
+    first_indexes = np.where(min_first, min_indexes, max_indexes)
+    second_indexes = np.where(min_first, max_indexes, min_indexes)
+    single = temperatures[min_indexes] == temperatures[max_indexes]
+
+    point_indexes = np.column_stack((first_indexes, second_indexes)).ravel()
+    keep = np.column_stack((np.ones_like(single), ~single)).ravel()
+    point_indexes = point_indexes[keep]
+
+    dates = timestamps[point_indexes]
+    point_temperatures = temperatures[point_indexes]
+
+    # Split the points back into days
+    day_splits = np.searchsorted(day_indexes[point_indexes], np.arange(1, len(day_bounds)))
+    return [
+        Temperatures(dates=day_dates.tolist(), temperatures=day_temperatures.tolist())
+        for day_dates, day_temperatures in zip(np.split(dates, day_splits), np.split(point_temperatures, day_splits))
+    ]
+
+
+def decimate_documents_numpy(
+    documents: Iterable[dict],
+    day_bounds: List[Tuple[datetime.datetime, datetime.datetime]],
+    periods_per_day: int,
+) -> List[Temperatures]:
+    timestamps, temperatures = load_readings(documents)
+    return decimate_readings(timestamps, temperatures, day_bounds, periods_per_day)
+
+
+def decimate_raw_batches(
+    batches: Iterable[bytes],
+    day_bounds: List[Tuple[datetime.datetime, datetime.datetime]],
+    periods_per_day: int,
+) -> List[Temperatures]:
+    timestamps, temperatures = load_raw_readings(batches)
+    return decimate_readings(timestamps, temperatures, day_bounds, periods_per_day)
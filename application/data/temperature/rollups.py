@@ -0,0 +1,141 @@
+import datetime
+import logging
+import threading
+from typing import List, Optional
+
+import pytz
+from pymongo import ASCENDING, DESCENDING, ReplaceOne
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+from application.data.temperature.decimation import (
+    READING_PROJECTION,
+    get_day_start,
+    get_period_index,
+    to_epoch_ms,
+)
+
+LOG = logging.getLogger(__name__)
+
+
+# Days are only decimated from the database at the base level of 96 periods, one per bucket, and every coarser view is
+# reduced from the cached days, so coarser buckets would never be read
+ROLLUP_PERIOD_IN_SECONDS = 15 * 60
+ROLLUP_COLLECTION_NAME = "pitemp_rollup_15m"
+
+
+class TemperatureRollups:
+    """
+    Materialized min, max, average and count of the raw readings per sensor, per 15 minute bucket.
+    Buckets are aligned to the same day start and closed on the right just like decimation periods, so the min and
+    max of a bucket can stand in for every reading inside it.
+
+    Each bucket stores the timestamp of the last reading folded into it. The newest bucket of a sensor is therefore
+    the watermark: an update only reads raw readings after it, and re-running an interrupted update is harmless.
+    Readings inserted with a timestamp older than the watermark are not picked up.
+    """
+
+    def __init__(self, pitemp_collection: Collection, database: Database):
+        self.pitemp_collection = pitemp_collection
+        self.collection = database[ROLLUP_COLLECTION_NAME]
+        self._update_lock = threading.Lock()
+
+    def update_all(self) -> int:
+        updated = 0
+        for sensor_id in self.pitemp_collection.distinct("sensorId"):
+            updated += self.update(sensor_id)
+        return updated
+
+    def update(self, sensor_id: str) -> int:
+        # Only one update at a time so concurrent callers do not scan the same readings twice
+        with self._update_lock:
+            newest_bucket = self._get_newest_bucket(sensor_id)
+            watermark = newest_bucket["last_timestamp"].replace(tzinfo=pytz.UTC) if newest_bucket else None
+
+            readings_filter = {"sensorId": sensor_id}
+            if watermark:
+                readings_filter["timestamp"] = {"$gt": watermark}
+            documents = self.pitemp_collection.find(filter=readings_filter, projection=READING_PROJECTION)
+            documents.sort({"timestamp": ASCENDING})
+
+            buckets: List[dict] = []
+            num_readings = 0
+            for document in documents:
+                timestamp = document.get("timestamp")
+                temperature = document.get("temp_f")
+                if timestamp is None or temperature is None:
+                    continue
+
+                # Timestamps in the database are in UTC
+                timestamp = timestamp.replace(tzinfo=pytz.UTC)
+                day_start = get_day_start(timestamp)
+                num_readings += 1
+
+                index = get_period_index(
+                    to_epoch_ms(timestamp), to_epoch_ms(day_start), ROLLUP_PERIOD_IN_SECONDS * 1000
+                )
+                start = day_start + datetime.timedelta(seconds=index * ROLLUP_PERIOD_IN_SECONDS)
+                if not buckets or buckets[-1]["start"] != start:
+                    # The newest stored bucket may still be open, so keep adding to it
+                    if not buckets and newest_bucket and newest_bucket["start"].replace(tzinfo=pytz.UTC) == start:
+                        buckets.append(self._to_open_bucket(newest_bucket))
+                    else:
+                        buckets.append(self._new_bucket(sensor_id, day_start, start))
+
+                self._add_reading(buckets[-1], timestamp, temperature)
+
+            if buckets:
+                self.collection.bulk_write(
+                    [ReplaceOne({"sensorId": sensor_id, "start": b["start"]}, b, upsert=True) for b in buckets],
+                    ordered=False,
+                )
+
+            if num_readings:
+                LOG.info(f"Folded {num_readings} readings from sensor {sensor_id} into the rollup")
+            return num_readings
+
+    def get_watermark(self, sensor_id: str) -> Optional[int]:
+        """The epoch milliseconds of the last reading folded into the rollup, or None before it has any buckets"""
+        newest_bucket = self._get_newest_bucket(sensor_id)
+        return to_epoch_ms(newest_bucket["last_timestamp"]) if newest_bucket else None
+
+    def _get_newest_bucket(self, sensor_id: str) -> Optional[dict]:
+        return self.collection.find_one(filter={"sensorId": sensor_id}, sort=[("start", DESCENDING)])
+
+    @staticmethod
+    def _new_bucket(sensor_id: str, day_start: datetime.datetime, start: datetime.datetime) -> dict:
+        return {
+            "sensorId": sensor_id,
+            "day": day_start,
+            "start": start,
+            "min_temp": None,
+            "min_timestamp": None,
+            "max_temp": None,
+            "max_timestamp": None,
+            "sum_temp": 0.0,
+            "count": 0,
+            "avg_temp": None,
+            "last_timestamp": None,
+        }
+
+    @staticmethod
+    def _to_open_bucket(document: dict) -> dict:
+        bucket = {key: value for key, value in document.items() if key != "_id"}
+        for key in ("day", "start", "min_timestamp", "max_timestamp", "last_timestamp"):
+            bucket[key] = bucket[key].replace(tzinfo=pytz.UTC)
+        return bucket
+
+    @staticmethod
+    def _add_reading(bucket: dict, timestamp: datetime.datetime, temperature: float):
+        # Readings arrive from oldest to newest, so ties keep the earliest reading like the decimation engines do
+        if bucket["min_temp"] is None or temperature < bucket["min_temp"]:
+            bucket["min_temp"] = temperature
+            bucket["min_timestamp"] = timestamp
+        if bucket["max_temp"] is None or temperature > bucket["max_temp"]:
+            bucket["max_temp"] = temperature
+            bucket["max_timestamp"] = timestamp
+
+        bucket["sum_temp"] += temperature
+        bucket["count"] += 1
+        bucket["avg_temp"] = bucket["sum_temp"] / bucket["count"]
+        bucket["last_timestamp"] = timestamp
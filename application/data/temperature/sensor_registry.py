@@ -0,0 +1,110 @@
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import valkey
+from pymongo import ASCENDING
+from pymongo.collection import Collection
+
+from application.constants.app_constants import ONE_HOUR_IN_SECONDS
+from application.data.circuit_breaker import CircuitBreaker
+from application.data.local_cache import get_local_cache
+from application.data.metrics import time_stage
+from application.data.temperature.decimation import to_epoch_ms
+from application.data.value_cache import ValueCache
+
+LOG = logging.getLogger(__name__)
+
+SENSORS_COLLECTION_NAME = "sensors"
+SENSOR_REGISTRY_CACHE_KEY = "sensors_list"
+# A new sensor shows up on the pages within this long
+SENSOR_REGISTRY_CACHE_TTL = ONE_HOUR_IN_SECONDS
+# How the sensors looked before they had metadata, so their pages do not change
+DEFAULT_SENSOR_METADATA = {
+    "pi": {"color": "white", "order": 0},
+    "pidown": {"color": "#45DD3E", "order": 1},
+    "KATT": {"color": "#EC95E7", "order": 2},
+}
+# Colors for sensors without one, in the order they are handed out
+SENSOR_COLORS = ["#F5A623", "#4A90E2", "#E94B3C", "#50E3C2", "#B8E986", "#9013FE", "#F8E71C", "#FF6F91"]
+
+
+@dataclass
+class Sensor:
+    sensor_id: str
+    name: str
+    color: str
+    order: Optional[int] = None
+    # Epoch milliseconds of the oldest reading, or None if it is not known
+    first_timestamp: Optional[int] = None
+
+
+class SensorRegistry:
+    """
+    Every sensor that has readings, with the name, color and order to show it with.
+    Metadata is optional and comes from documents in the sensors collection such as
+    {"sensorId": "pi", "name": "Living room", "color": "white", "order": 0, "hidden": false}.
+    """
+
+    def __init__(
+        self,
+        pitemp_collection: Collection,
+        sensors_collection: Collection,
+        cache: valkey.Valkey,
+        breaker: CircuitBreaker = None,
+    ):
+        self.pitemp_collection = pitemp_collection
+        self.sensors_collection = sensors_collection
+        self.cache = cache
+        # Every history request checks its sensors, so the list is also kept in the process
+        self.values = ValueCache(cache, SENSOR_REGISTRY_CACHE_TTL, breaker=breaker, local_cache=get_local_cache())
+
+    def get_sensors(self, refresh: bool = False) -> List[Sensor]:
+        return self.values.get_or_build(SENSOR_REGISTRY_CACHE_KEY, self._load_sensors, refresh)
+
+    def get_sensor_ids(self, refresh: bool = False) -> List[str]:
+        return [sensor.sensor_id for sensor in self.get_sensors(refresh)]
+
+    def get_sensor(self, sensor_id: str) -> Optional[Sensor]:
+        return next((sensor for sensor in self.get_sensors() if sensor.sensor_id == sensor_id), None)
+
+    def _load_sensors(self) -> List[Sensor]:
+        with time_stage("mongo_query", "pitemp"):
+            sensor_ids = self.pitemp_collection.distinct("sensorId")
+        sensor_to_metadata: Dict[str, dict] = {
+            document["sensorId"]: document for document in self.sensors_collection.find({}, {"_id": 0})
+        }
+
+        sensors = []
+        for sensor_id in sensor_ids:
+            metadata = {**DEFAULT_SENSOR_METADATA.get(sensor_id, {}), **sensor_to_metadata.get(sensor_id, {})}
+            if metadata.get("hidden"):
+                continue
+            with time_stage("mongo_query", "pitemp"):
+                first_document = self.pitemp_collection.find_one(
+                    filter={"sensorId": sensor_id},
+                    projection={"_id": 0, "timestamp": 1},
+                    sort=[("timestamp", ASCENDING)],
+                )
+            sensors.append(
+                Sensor(
+                    sensor_id=sensor_id,
+                    name=metadata.get("name", sensor_id),
+                    color=metadata.get("color"),
+                    order=metadata.get("order"),
+                    first_timestamp=to_epoch_ms(first_document["timestamp"]) if first_document else None,
+                )
+            )
+
+        # Sensors with an order come first, the rest follow by id
+        sensors.sort(key=lambda sensor: (sensor.order is None, sensor.order or 0, sensor.sensor_id))
+
+        # Sensors without a color get one that no other sensor uses
+        used_colors = {sensor.color for sensor in sensors if sensor.color}
+        free_colors = iter(color for color in SENSOR_COLORS if color not in used_colors)
+        for sensor in sensors:
+            if not sensor.color:
+                sensor.color = next(free_colors, "gray")
+
+        LOG.info(f"Found sensors {[sensor.sensor_id for sensor in sensors]}")
+        return sensors
@@ -9,3 +9,16 @@ class TemperatureDataSet:
     current_temp: float
     minimum_temp: float
     maximum_temp: float
+
+
+def to_chart_json(sensor_id: str, data_set: TemperatureDataSet) -> dict:
+    # Pairs are much smaller than objects and Chart.js reads them as they are
+    has_data = bool(data_set.data)
+    return {
+        "sensorId": sensor_id,
+        "label": data_set.label,
+        "current_temp": data_set.current_temp if has_data else None,
+        "minimum_temp": data_set.minimum_temp if has_data else None,
+        "maximum_temp": data_set.maximum_temp if has_data else None,
+        "data": [[point["x"], point["y"]] for point in data_set.data],
+    }
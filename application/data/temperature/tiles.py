@@ -0,0 +1,171 @@
+import datetime
+import logging
+import struct
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+import pytz
+import valkey
+from pymongo import ASCENDING
+from pymongo.collection import Collection
+
+from application.constants.app_constants import ONE_DAY_IN_SECONDS
+from application.data.circuit_breaker import CircuitBreaker, get_mongo_circuit_breaker
+from application.data.metrics import record_cache_lookup, time_stage, timed_iter
+from application.data.mongo import report_server_selection_failures
+from application.data.temperature.decimation import READING_PROJECTION, Decimator, from_epoch_ms, to_epoch_ms
+from application.data.temperature.temperatures import Temperatures
+
+LOG = logging.getLogger(__name__)
+
+# Every tile is split into the same number of periods, each keeping its min and max reading
+TILE_PERIODS = 256
+# Readings are minutes apart, so periods this short hold a single reading and the finest tiles are the raw data
+FINEST_PERIOD_IN_MS = 15 * 1000
+# Each zoom level halves the span of the one before. Zoom 0 tiles span about eight years.
+MAX_ZOOM = 16
+# Readings can arrive a little late, so a tile is only immutable once its span has been over for a while
+TILE_COMPLETE_DELAY_MS = 5 * 60 * 1000
+# Complete tiles never change, but only the ones still being viewed are worth keeping
+TILE_CACHE_TTL = 30 * ONE_DAY_IN_SECONDS
+
+# Magic byte, version and number of points, followed by int64 epoch milliseconds and float32 temperatures
+TILE_HEADER = struct.Struct("<cBI")
+TILE_MAGIC = b"P"
+TILE_VERSION = 1
+TEMPERATURE_DECIMALS = 4
+
+
+def get_period_in_ms(zoom: int) -> int:
+    return FINEST_PERIOD_IN_MS * 2 ** (MAX_ZOOM - zoom)
+
+
+def get_tile_span_in_ms(zoom: int) -> int:
+    return TILE_PERIODS * get_period_in_ms(zoom)
+
+
+def get_tile_bounds(zoom: int, index: int) -> Tuple[int, int]:
+    # Tiles are counted from the epoch and closed on the right like decimation periods, so the periods of a tile
+    # never straddle a tile boundary. Two tiles of a zoom level make up one tile of the level above.
+    span = get_tile_span_in_ms(zoom)
+    return index * span, (index + 1) * span
+
+
+def get_tile_filter(sensor_id: str, start: int, end: int) -> dict:
+    return {"sensorId": sensor_id, "timestamp": {"$gt": from_epoch_ms(start), "$lte": from_epoch_ms(end)}}
+
+
+def encode_tile(temperatures: Temperatures) -> bytes:
+    return b"".join(
+        (
+            TILE_HEADER.pack(TILE_MAGIC, TILE_VERSION, len(temperatures.dates)),
+            np.asarray(temperatures.dates, dtype="<i8").tobytes(),
+            np.asarray(temperatures.temperatures, dtype="<f4").tobytes(),
+        )
+    )
+
+
+def decode_tile(value: bytes) -> Optional[Temperatures]:
+    magic, version, count = TILE_HEADER.unpack_from(value)
+    if magic != TILE_MAGIC or version != TILE_VERSION:
+        LOG.warning(f"Unknown tile cache version {version}. Ignoring the entry.")
+        return None
+
+    dates = np.frombuffer(value, dtype="<i8", count=count, offset=TILE_HEADER.size)
+    values = np.frombuffer(value, dtype="<f4", count=count, offset=TILE_HEADER.size + 8 * count)
+    return Temperatures(
+        dates=dates.tolist(), temperatures=np.round(values.astype(np.float64), TEMPERATURE_DECIMALS).tolist()
+    )
+
+
+@dataclass
+class Tile:
+    zoom: int
+    index: int
+    start: int
+    end: int
+    complete: bool
+    temperatures: Temperatures
+
+
+class TemperatureTiles:
+    """
+    A pyramid of fixed size time tiles per sensor, from years down to individual readings.
+    Once its span is over a tile never changes, so it is cached until it goes unused for a while. Tiles outside of the
+    readings of the sensor are empty and are not cached. The tile that contains now is
+    rebuilt on every request from its two halves: the older half is complete and cached, and only the newer half
+    recurses down to a finest tile that is read from the raw readings.
+    """
+
+    def __init__(self, pitemp_collection: Collection, cache: valkey.Valkey, breaker: CircuitBreaker = None):
+        self.pitemp_collection = pitemp_collection
+        self.cache = cache
+        self.breaker = get_mongo_circuit_breaker() if breaker is None else breaker
+
+    def get_tile(self, sensor_id: str, zoom: int, index: int, first_timestamp: Optional[int] = None) -> Tile:
+        """first_timestamp is that of the oldest reading of the sensor, if it is known"""
+        start, end = get_tile_bounds(zoom, index)
+        now = to_epoch_ms(datetime.datetime.now(pytz.UTC))
+        complete = end + TILE_COMPLETE_DELAY_MS <= now
+
+        if start >= now or (first_timestamp is not None and end < first_timestamp):
+            temperatures = Temperatures(dates=[], temperatures=[])
+        elif complete:
+            temperatures = self._get_complete_tile(sensor_id, zoom, index, start, end)
+        elif zoom == MAX_ZOOM:
+            temperatures = self._decimate_readings(sensor_id, zoom, start, end)
+        else:
+            # Both halves use periods that nest inside the periods of this tile, so reducing their points gives
+            # the same result as decimating the raw readings
+            decimator = Decimator(start, get_period_in_ms(zoom))
+            for child_index in (2 * index, 2 * index + 1):
+                child = self.get_tile(sensor_id, zoom + 1, child_index, first_timestamp).temperatures
+                for timestamp, temperature in zip(child.dates, child.temperatures):
+                    decimator.add(timestamp, temperature)
+            temperatures = decimator.get_temperatures()
+
+        return Tile(zoom=zoom, index=index, start=start, end=end, complete=complete, temperatures=temperatures)
+
+    def _get_complete_tile(self, sensor_id: str, zoom: int, index: int, start: int, end: int) -> Temperatures:
+        tile_cache_key = self._get_tile_cache_key(sensor_id, zoom, index)
+        with time_stage("cache_get", "tile"):
+            cached_value = self.cache.get(tile_cache_key)
+        record_cache_lookup("tile", cached_value is not None)
+        with time_stage("deserialize", "tile"):
+            temperatures = decode_tile(cached_value) if cached_value else None
+        if temperatures is not None:
+            return temperatures
+
+        with time_stage("decimation", "tile"):
+            temperatures = self._decimate_readings(sensor_id, zoom, start, end)
+        with time_stage("serialize", "tile"):
+            encoded = encode_tile(temperatures)
+        with time_stage("cache_set", "tile"):
+            self.cache.set(tile_cache_key, encoded, ex=TILE_CACHE_TTL)
+        return temperatures
+
+    def _decimate_readings(self, sensor_id: str, zoom: int, start: int, end: int) -> Temperatures:
+        self.breaker.check()
+        LOG.info(
+            f"Building zoom {zoom} tile from {from_epoch_ms(start)} to {from_epoch_ms(end)} for sensor {sensor_id}"
+        )
+        documents = self.pitemp_collection.find(
+            filter=get_tile_filter(sensor_id, start, end), projection=READING_PROJECTION
+        )
+        documents.sort({"timestamp": ASCENDING})
+
+        decimator = Decimator(start, get_period_in_ms(zoom))
+        with report_server_selection_failures(self.breaker):
+            for document in timed_iter(documents, "mongo_query", "pitemp"):
+                timestamp = document.get("timestamp")
+                temperature = document.get("temp_f")
+                if timestamp is None or temperature is None:
+                    continue
+                decimator.add(to_epoch_ms(timestamp), temperature)
+
+        return decimator.get_temperatures()
+
+    @staticmethod
+    def _get_tile_cache_key(sensor_id: str, zoom: int, index: int) -> str:
+        return f"tile_{sensor_id}_{zoom}_{index}"
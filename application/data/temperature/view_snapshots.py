@@ -0,0 +1,237 @@
+import contextvars
+import dataclasses
+import datetime
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import pytz
+import valkey
+
+from application.constants.app_constants import DEFAULT_TIMEZONE, ONE_DAY_IN_SECONDS
+from application.data.circuit_breaker import CircuitBreaker, get_mongo_circuit_breaker
+from application.data.custom_json_encoder import CustomJsonEncoder
+from application.data.metrics import CACHE_LOOKUPS, record_cache_lookup, time_stage
+from application.data.profiler import working_for_request
+from application.data.temperature.decimation import get_day_start, get_period_in_seconds, to_epoch_ms
+from application.data.temperature.temperature_data_set import TemperatureDataSet
+
+LOG = logging.getLogger(__name__)
+
+# Snapshots are refreshed whenever a period at this level closes
+SNAPSHOT_PERIODS_PER_DAY = 96
+# Give the reading that closes a period a moment to arrive before refreshing
+REFRESH_DELAY_SECONDS = 30
+# Views nobody asked for in this long are no longer refreshed
+VIEW_IDLE_SECONDS = ONE_DAY_IN_SECONDS
+# Views of single sensors started for pages. They only wait on the DAO executor, never the other way around.
+VIEW_WORKERS = 8
+# How long an expired snapshot is kept, to be served while it is rebuilt or while the database is down
+SNAPSHOT_STALE_SECONDS = ONE_DAY_IN_SECONDS
+# The ranges linked from the temperature pages, plus the year. Only these views of known sensors keep snapshots.
+SNAPSHOT_DAYS_BACK = (1, 3, 7, 365)
+# The most views refreshed, least recently requested out first
+MAX_VIEWS = 256
+
+View = Tuple[Tuple[str, ...], int, Optional[int]]
+GetHistories = Callable[[List[str], int, Optional[int]], Dict[str, TemperatureDataSet]]
+
+
+def get_snapshot_expiry(now: datetime.datetime) -> int:
+    # The end of the period that is open right now, in epoch milliseconds
+    period_in_ms = get_period_in_seconds(SNAPSHOT_PERIODS_PER_DAY) * 1000
+    day_start = to_epoch_ms(get_day_start(now))
+    elapsed = to_epoch_ms(now) - day_start
+    return day_start + (elapsed // period_in_ms + 1) * period_in_ms + REFRESH_DELAY_SECONDS * 1000
+
+
+class ViewSnapshots:
+    """
+    Finished temperature histories for each set of sensors, days back and points that has been viewed.
+    Serving a view that has a snapshot costs a single cache read. A snapshot expires when the period that was open
+    when it was made closes, and the refresher rebuilds every recently viewed one at that moment. An expired snapshot
+    is still served while it is rebuilt in the background.
+    Any other view, such as one with a fixed number of points, is built from the cached days on every request.
+    """
+
+    def __init__(
+        self,
+        cache: valkey.Valkey,
+        get_histories: GetHistories,
+        get_sensor_ids: Callable[[], List[str]],
+        breaker: CircuitBreaker = None,
+    ):
+        self.cache = cache
+        self.get_histories = get_histories
+        self.get_sensor_ids = get_sensor_ids
+        self.breaker = get_mongo_circuit_breaker() if breaker is None else breaker
+        self._view_to_last_request: Dict[View, float] = {}
+        self._refreshing: Set[View] = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=VIEW_WORKERS, thread_name_prefix="view-snapshot")
+
+    def get_temperature_histories(
+        self, sensor_ids: List[str], days_back: int, points: Optional[int] = None
+    ) -> Dict[str, TemperatureDataSet]:
+        view = (tuple(sensor_ids), days_back, points)
+        if not self._is_snapshot_view(view):
+            return self.get_histories(sensor_ids, days_back, points)
+
+        with self._lock:
+            # Kept in the order of the last request, so the least recently requested view is the first one out
+            self._view_to_last_request.pop(view, None)
+            self._view_to_last_request[view] = time.monotonic()
+            while len(self._view_to_last_request) > MAX_VIEWS:
+                del self._view_to_last_request[next(iter(self._view_to_last_request))]
+
+        with time_stage("cache_get", "view_snapshot"):
+            cached_value = self.cache.get(self._get_snapshot_cache_key(view))
+        if cached_value:
+            with time_stage("deserialize", "view_snapshot"):
+                snapshot = json.loads(cached_value.decode())
+            histories = {
+                sensor_id: TemperatureDataSet(**data_set) for sensor_id, data_set in snapshot["histories"].items()
+            }
+            if snapshot["expires"] > to_epoch_ms(datetime.datetime.now(pytz.UTC)):
+                record_cache_lookup("view_snapshot", True)
+            else:
+                CACHE_LOOKUPS.inc("view_snapshot", "stale")
+                self._refresh_in_background(view)
+            return histories
+
+        record_cache_lookup("view_snapshot", False)
+
+        LOG.info(f"No fresh snapshot for view {view}")
+        return self.refresh(view)
+
+    def get_ready_temperature_histories(
+        self, sensor_ids: List[str], days_back: int, points: Optional[int], timeout_seconds: float
+    ) -> Dict[str, TemperatureDataSet]:
+        """
+        Starts the view of every sensor at once and returns the ones that are ready within the timeout.
+        Views with snapshots keep going, so the snapshot is waiting by the time the browser asks the API for it. Any
+        other view would be built again by the API, so the ones that have not started yet are cancelled.
+        """
+        futures = {
+            sensor_id: self._executor.submit(
+                contextvars.copy_context().run, self._get_histories_for_request, [sensor_id], days_back, points
+            )
+            for sensor_id in sensor_ids
+        }
+        done, _ = wait(futures.values(), timeout=timeout_seconds)
+
+        histories = {}
+        for sensor_id, future in futures.items():
+            if future not in done:
+                LOG.info(f"View of {sensor_id} {days_back} days back is not ready in {timeout_seconds} s")
+                if not self._is_snapshot_view(((sensor_id,), days_back, points)):
+                    future.cancel()
+            elif future.exception():
+                LOG.error(f"Failed to get view of {sensor_id} {days_back} days back", exc_info=future.exception())
+            else:
+                histories[sensor_id] = future.result()[sensor_id]
+        return histories
+
+    def _get_histories_for_request(
+        self, sensor_ids: List[str], days_back: int, points: Optional[int]
+    ) -> Dict[str, TemperatureDataSet]:
+        with working_for_request():
+            return self.get_temperature_histories(sensor_ids, days_back, points)
+
+    def refresh(self, view: View) -> Dict[str, TemperatureDataSet]:
+        sensor_ids, days_back, points = view
+        now = datetime.datetime.now(pytz.timezone(DEFAULT_TIMEZONE))
+        expires = get_snapshot_expiry(now)
+
+        histories = self.get_histories(list(sensor_ids), days_back, points)
+        # Without the database the histories only have the days that were cached, which should not be kept
+        if not self.breaker.is_closed:
+            LOG.info(f"Not keeping a snapshot of view {view} while the database circuit is open")
+            return histories
+
+        snapshot = {
+            "expires": expires,
+            "histories": {sensor_id: dataclasses.asdict(data_set) for sensor_id, data_set in histories.items()},
+        }
+
+        ttl_ms = expires - to_epoch_ms(now) + SNAPSHOT_STALE_SECONDS * 1000
+        with time_stage("serialize", "view_snapshot"):
+            encoded = json.dumps(snapshot, cls=CustomJsonEncoder)
+        with time_stage("cache_set", "view_snapshot"):
+            self.cache.set(self._get_snapshot_cache_key(view), encoded, px=ttl_ms)
+        return histories
+
+    def _refresh_in_background(self, view: View):
+        # The rebuilt snapshot would not be kept while the database circuit is open
+        if not self.breaker.is_closed:
+            return
+
+        with self._lock:
+            if view in self._refreshing:
+                return
+            self._refreshing.add(view)
+
+        def refresh():
+            try:
+                self.refresh(view)
+            except Exception:
+                LOG.exception(f"Failed to refresh stale snapshot for view {view}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(view)
+
+        self._executor.submit(refresh)
+
+    def refresh_all(self) -> int:
+        with self._lock:
+            idle_before = time.monotonic() - VIEW_IDLE_SECONDS
+            self._view_to_last_request = {
+                view: last_request
+                for view, last_request in self._view_to_last_request.items()
+                if last_request >= idle_before
+            }
+            views = list(self._view_to_last_request)
+
+        for view in views:
+            try:
+                self.refresh(view)
+            except Exception:
+                LOG.exception(f"Failed to refresh snapshot for view {view}")
+        return len(views)
+
+    def _is_snapshot_view(self, view: View) -> bool:
+        sensor_ids, days_back, points = view
+        return points is None and days_back in SNAPSHOT_DAYS_BACK and set(sensor_ids) <= set(self.get_sensor_ids())
+
+    @staticmethod
+    def _get_snapshot_cache_key(view: View) -> str:
+        sensor_ids, days_back, points = view
+        return f"view_{','.join(sensor_ids)}_{days_back}_{points or 'auto'}"
+
+
+class ViewSnapshotRefresher(threading.Thread):
+    """Rebuilds the snapshots of recently viewed pages each time a period closes"""
+
+    def __init__(self, view_snapshots: ViewSnapshots):
+        super().__init__(name="view-snapshot-refresher", daemon=True)
+        self.view_snapshots = view_snapshots
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            now = datetime.datetime.now(pytz.UTC)
+            self._stopped.wait((get_snapshot_expiry(now) - to_epoch_ms(now)) / 1000)
+            if self._stopped.is_set():
+                break
+
+            start = time.perf_counter_ns()
+            num_views = self.view_snapshots.refresh_all()
+            duration_ms = (time.perf_counter_ns() - start) // 1000000
+            if num_views:
+                LOG.info(f"Refreshed {num_views} view snapshots in {duration_ms} ms")
+
+    def stop(self):
+        self._stopped.set()
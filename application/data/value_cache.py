@@ -0,0 +1,191 @@
+import logging
+import pickle
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Callable, Optional, Set, TypeVar, Union
+
+import valkey
+
+from application.data.circuit_breaker import CircuitBreaker, CircuitOpenError, get_mongo_circuit_breaker
+from application.data.dao_executor import DaoExecutor, get_dao_executor
+from application.data.local_cache import LocalCache
+from application.data.metrics import CACHE_LOOKUPS, LOCAL_CACHE_LOOKUPS, record_cache_lookup, time_stage
+from application.data.mongo import report_server_selection_failures
+from application.data.single_flight import SingleFlight
+
+LOG = logging.getLogger(__name__)
+
+# How long a value is kept after it goes stale, to be served while it is rebuilt or while the database is down
+DEFAULT_STALE_TTL = timedelta(days=7)
+
+T = TypeVar("T")
+
+
+@dataclass
+class CacheEntry:
+    value: object
+    # Epoch seconds after which the value is stale
+    fresh_until: float
+    # Changes with every write, so a copy held in a process can tell it is out of date
+    version: str = ""
+
+
+def _to_seconds(ttl: Union[int, timedelta]) -> int:
+    return int(ttl.total_seconds()) if isinstance(ttl, timedelta) else int(ttl)
+
+
+class ValueCache:
+    """
+    Pickled values in the cache, each rebuilt by a single worker when it is missing.
+    A value is fresh for ttl and then kept for stale_ttl more. A stale value is served right away while it is rebuilt
+    in the background, and is all that is served while the circuit breaker keeps the database from being called.
+    With a local cache, values are also kept unpickled in the process. Each write changes a small version entry next
+    to the value, so a local copy is used as long as the version in the cache still matches it, which skips fetching
+    and unpickling the value.
+    The cache key doubles as the family of the metrics.
+    """
+
+    def __init__(
+        self,
+        cache: valkey.Valkey,
+        ttl: Union[int, timedelta],
+        stale_ttl: Union[int, timedelta] = DEFAULT_STALE_TTL,
+        single_flight: SingleFlight = None,
+        breaker: CircuitBreaker = None,
+        executor: DaoExecutor = None,
+        local_cache: Optional[LocalCache] = None,
+    ):
+        self.cache = cache
+        self.ttl_seconds = _to_seconds(ttl)
+        self.stale_ttl_seconds = _to_seconds(stale_ttl)
+        self.single_flight = SingleFlight(cache) if single_flight is None else single_flight
+        self.breaker = get_mongo_circuit_breaker() if breaker is None else breaker
+        self.executor = get_dao_executor() if executor is None else executor
+        self.local_cache = local_cache
+        self._refreshing: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def get(self, cache_key: str) -> Optional[object]:
+        entry = self.get_entry(cache_key)
+        return None if entry is None else entry.value
+
+    def get_entry(self, cache_key: str) -> Optional[CacheEntry]:
+        if self.local_cache is not None:
+            local_entry = self.local_cache.get(cache_key)
+            if local_entry is not None:
+                with time_stage("cache_get", cache_key):
+                    version = self.cache.get(self._get_version_key(cache_key))
+                if version is not None and version.decode() == local_entry.version:
+                    LOCAL_CACHE_LOOKUPS.inc(cache_key, "hit")
+                    return local_entry.value
+                LOCAL_CACHE_LOOKUPS.inc(cache_key, "outdated")
+                self.local_cache.invalidate(cache_key)
+            else:
+                LOCAL_CACHE_LOOKUPS.inc(cache_key, "miss")
+
+        with time_stage("cache_get", cache_key):
+            serialized_data = self.cache.get(cache_key)
+        if serialized_data is None:
+            return None
+
+        with time_stage("deserialize", cache_key):
+            entry = pickle.loads(serialized_data)
+        # Values cached before entries had a freshness are treated as stale
+        if not isinstance(entry, CacheEntry):
+            entry = CacheEntry(value=entry, fresh_until=0)
+        if self.local_cache is not None and entry.version:
+            self.local_cache.put(cache_key, entry, entry.version, len(serialized_data))
+        return entry
+
+    def set(self, cache_key: str, value: object):
+        entry = CacheEntry(value=value, fresh_until=time.time() + self.ttl_seconds, version=uuid.uuid4().hex)
+        with time_stage("serialize", cache_key):
+            serialized_data = pickle.dumps(entry)
+
+        # The value and its version are written together, so a version never vouches for a value it did not come with
+        ttl_seconds = self.ttl_seconds + self.stale_ttl_seconds
+        pipeline = self.cache.pipeline(transaction=True)
+        pipeline.set(cache_key, serialized_data, ex=ttl_seconds)
+        pipeline.set(self._get_version_key(cache_key), entry.version, ex=ttl_seconds)
+        with time_stage("cache_set", cache_key):
+            pipeline.execute()
+
+        if self.local_cache is not None:
+            self.local_cache.put(cache_key, entry, entry.version, len(serialized_data))
+
+    def get_or_build(self, cache_key: str, build: Callable[[], T], refresh: bool = False) -> T:
+        """
+        Returns the cached value, or builds and caches it. Concurrent misses wait for one build instead of each
+        running their own. A refresh rebuilds the value even when it is cached, so it can be replaced before it
+        goes stale, while readers keep getting the old value.
+        Raises CircuitOpenError if the value has to be built while the database is not being called.
+        """
+        if refresh:
+            if self.breaker.allow_request():
+                return self._build_and_set(cache_key, build)
+            entry = self.get_entry(cache_key)
+            if entry is None:
+                raise CircuitOpenError(self.breaker.get_retry_after_seconds())
+            return entry.value
+
+        entry = self.get_entry(cache_key)
+        if entry is not None:
+            if entry.fresh_until > time.time():
+                record_cache_lookup(cache_key, True)
+            else:
+                CACHE_LOOKUPS.inc(cache_key, "stale")
+                self._refresh_in_background(cache_key, build)
+            return entry.value
+
+        record_cache_lookup(cache_key, False)
+        self.breaker.check()
+        return self.single_flight.run(
+            cache_key, lambda: self._build_and_set(cache_key, build), lambda: self.get(cache_key), cache_key
+        )
+
+    def _refresh_in_background(self, cache_key: str, build: Callable[[], T]):
+        with self._lock:
+            if cache_key in self._refreshing:
+                return
+            self._refreshing.add(cache_key)
+
+        if not self.breaker.allow_request():
+            with self._lock:
+                self._refreshing.discard(cache_key)
+            return
+
+        self.executor.submit(self._refresh, cache_key, build)
+
+    def _refresh(self, cache_key: str, build: Callable[[], T]):
+        try:
+            # Another process may already be rebuilding it, in which case its fresh value is waited for
+            self.single_flight.run(
+                cache_key,
+                lambda: self._build_and_set(cache_key, build),
+                lambda: self._get_fresh(cache_key),
+                cache_key,
+            )
+        except Exception:
+            LOG.exception(f"Failed to refresh stale {cache_key}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(cache_key)
+
+    def _get_fresh(self, cache_key: str) -> Optional[object]:
+        entry = self.get_entry(cache_key)
+        if entry is None or entry.fresh_until <= time.time():
+            return None
+        return entry.value
+
+    @staticmethod
+    def _get_version_key(cache_key: str) -> str:
+        return f"version_{cache_key}"
+
+    def _build_and_set(self, cache_key: str, build: Callable[[], T]) -> T:
+        with report_server_selection_failures(self.breaker):
+            value = build()
+        self.set(cache_key, value)
+        return value
@@ -0,0 +1,273 @@
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+import pytz
+from flask import Blueprint, Response, current_app, jsonify, request
+from werkzeug.utils import secure_filename
+
+from application.constants.app_constants import DATABASE_CONFIG_KEY, DEFAULT_TIMEZONE, MAX_RANGE_DAYS
+from application.data.circuit_breaker import CircuitOpenError
+from application.data.temperature.dao import ApplicationDao
+from application.data.temperature.decimation import to_epoch_ms
+from application.data.temperature.latest_readings import LatestReadings
+from application.data.temperature.downsampling import clamp_points
+from application.data.temperature.export import (
+    EXPORT_FORMAT_CSV,
+    EXPORT_FORMAT_TO_MIMETYPE,
+    encode_readings,
+    gzip_chunks,
+)
+from application.data.temperature.temperature_data_set import to_chart_json
+from application.data.temperature.tiles import MAX_ZOOM, TILE_PERIODS, get_period_in_ms, get_tile_span_in_ms
+
+LOG = logging.getLogger(__name__)
+API_BLUEPRINT = Blueprint("routes_api", __name__, url_prefix="/api")
+DEFAULT_RANGE_DAYS = 7
+# Complete tiles never change, so browsers and proxies can keep them for good
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+EDGE_CACHE_CONTROL = "no-cache"
+LEVELS_CACHE_CONTROL = "public, max-age=86400"
+
+# Each open event stream holds a server thread, so only so many are allowed at once. Streams are closed after a while
+# and the browser reconnects on its own, which shares the threads out between viewers.
+MAX_EVENT_STREAMS = int(os.environ.get("MAX_EVENT_STREAMS", 16))
+EVENT_STREAM_SLOTS = threading.BoundedSemaphore(MAX_EVENT_STREAMS)
+EVENT_STREAM_MAX_SECONDS = 5 * 60
+EVENT_STREAM_HEARTBEAT_SECONDS = 15
+EVENT_STREAM_RETRY_MS = 5000
+# An export holds a server thread and a cursor until it is downloaded, so only a few run at once
+MAX_EXPORTS = int(os.environ.get("MAX_EXPORTS", 2))
+EXPORT_SLOTS = threading.BoundedSemaphore(MAX_EXPORTS)
+EXPORT_RETRY_AFTER_SECONDS = 60
+
+
+@API_BLUEPRINT.route("/temp/<sensor_id>")
+def temperature_history(sensor_id: str):
+    """
+    The decimated history of a sensor as [epoch milliseconds, temperature] pairs.
+    Either days gives the same whole days as the temperature pages, or from and to give any range as epoch
+    milliseconds or ISO 8601. Both default to the last week. Points optionally downsamples to a fixed size.
+    """
+    dao = _get_dao()
+    if dao.sensors.get_sensor(sensor_id) is None:
+        return _unknown_sensor(sensor_id)
+    points = clamp_points(request.args.get("points", type=int))
+
+    days_back = request.args.get("days", type=int)
+    if days_back is not None:
+        if not 0 <= days_back <= MAX_RANGE_DAYS:
+            return _error(f"days must be between 0 and {MAX_RANGE_DAYS}")
+        data_set = dao.view_snapshots.get_temperature_histories([sensor_id], days_back, points)[sensor_id]
+        return jsonify(to_chart_json(sensor_id, data_set))
+
+    try:
+        to_datetime = _parse_instant(request.args.get("to")) or datetime.datetime.now(pytz.UTC)
+        from_datetime = _parse_instant(request.args.get("from")) or to_datetime - datetime.timedelta(
+            days=DEFAULT_RANGE_DAYS
+        )
+    except (ValueError, OverflowError, OSError) as e:
+        return _error(str(e))
+
+    if from_datetime > to_datetime:
+        return _error("from must not be after to")
+    if to_datetime - from_datetime > datetime.timedelta(days=MAX_RANGE_DAYS):
+        return _error(f"The range cannot be longer than {MAX_RANGE_DAYS} days")
+
+    data_set = dao.get_temperature_range(sensor_id, from_datetime, to_datetime, points)
+    return jsonify(to_chart_json(sensor_id, data_set))
+
+
+@API_BLUEPRINT.route("/temp/<sensor_id>/export")
+def temperature_export(sensor_id: str):
+    """
+    Every raw reading of a sensor between from and to, streamed as CSV or newline delimited JSON.
+    The range takes the same values as the history, without a limit on its length.
+    """
+    if _get_dao().sensors.get_sensor(sensor_id) is None:
+        return _unknown_sensor(sensor_id)
+
+    export_format = request.args.get("format", EXPORT_FORMAT_CSV)
+    if export_format not in EXPORT_FORMAT_TO_MIMETYPE:
+        return _error(f"format must be one of {', '.join(EXPORT_FORMAT_TO_MIMETYPE)}")
+
+    try:
+        to_datetime = _parse_instant(request.args.get("to")) or datetime.datetime.now(pytz.UTC)
+        from_datetime = _parse_instant(request.args.get("from")) or to_datetime - datetime.timedelta(
+            days=DEFAULT_RANGE_DAYS
+        )
+    except (ValueError, OverflowError, OSError) as e:
+        return _error(str(e))
+
+    if from_datetime > to_datetime:
+        return _error("from must not be after to")
+
+    if not EXPORT_SLOTS.acquire(blocking=False):
+        response = jsonify({"error": "Too many exports are running. Try again later."})
+        response.status_code = 503
+        response.headers["Retry-After"] = str(EXPORT_RETRY_AFTER_SECONDS)
+        return response
+
+    try:
+        readings = _get_dao().find_readings(sensor_id, from_datetime, to_datetime)
+    except Exception:
+        EXPORT_SLOTS.release()
+        raise
+
+    chunks = encode_readings(readings, export_format)
+    headers = {
+        "Content-Disposition": "attachment; filename="
+        + secure_filename(f"{sensor_id}_{to_epoch_ms(from_datetime)}_{to_epoch_ms(to_datetime)}.{export_format}"),
+        "Cache-Control": "no-store",
+        "Vary": "Accept-Encoding",
+    }
+    # Compressed here, a chunk at a time, so the whole export is never held in memory to be compressed.
+    # Setting the encoding also keeps Flask-Compress from compressing it again.
+    if request.accept_encodings["gzip"]:
+        chunks = gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+
+    response = Response(chunks, mimetype=EXPORT_FORMAT_TO_MIMETYPE[export_format], headers=headers)
+    # The server closes the response once it is sent or the client goes away, even if nothing was streamed yet
+    response.call_on_close(readings.close)
+    response.call_on_close(EXPORT_SLOTS.release)
+    return response
+
+
+@API_BLUEPRINT.route("/temp/latest")
+def latest_temperatures():
+    return jsonify(_get_latest_json(_get_dao().latest_readings))
+
+
+@API_BLUEPRINT.route("/temp/stream")
+def temperature_stream():
+    """Server-Sent Events with the latest reading of every sensor, sent whenever one of them changes"""
+    if not EVENT_STREAM_SLOTS.acquire(blocking=False):
+        response = jsonify({"error": "Too many open streams. Poll /api/temp/latest instead."})
+        response.status_code = 503
+        response.headers["Retry-After"] = str(EVENT_STREAM_RETRY_MS // 1000)
+        return response
+
+    latest_readings = _get_dao().latest_readings
+
+    def generate():
+        try:
+            yield f"retry: {EVENT_STREAM_RETRY_MS}\n\n"
+            yield f"data: {json.dumps(_get_latest_json(latest_readings))}\n\n"
+
+            version = latest_readings.version
+            closes_at = time.monotonic() + EVENT_STREAM_MAX_SECONDS
+            while time.monotonic() < closes_at:
+                new_version = latest_readings.wait_for_change(version, timeout=EVENT_STREAM_HEARTBEAT_SECONDS)
+                if new_version == version:
+                    # Comments keep proxies from closing an idle connection
+                    yield ": heartbeat\n\n"
+                    continue
+
+                version = new_version
+                yield f"data: {json.dumps(_get_latest_json(latest_readings))}\n\n"
+        finally:
+            EVENT_STREAM_SLOTS.release()
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@API_BLUEPRINT.route("/temp/tiles")
+def temperature_tile_levels():
+    levels = [
+        {"zoom": zoom, "period_ms": get_period_in_ms(zoom), "span_ms": get_tile_span_in_ms(zoom)}
+        for zoom in range(MAX_ZOOM + 1)
+    ]
+    response = jsonify({"tile_periods": TILE_PERIODS, "levels": levels})
+    response.headers["Cache-Control"] = LEVELS_CACHE_CONTROL
+    return response
+
+
+@API_BLUEPRINT.route("/temp/<sensor_id>/tiles/<int:zoom>/<int:index>")
+def temperature_tile(sensor_id: str, zoom: int, index: int):
+    """
+    One tile of the zoomable pyramid. Tile index covers the epoch milliseconds after index * span_ms up to and
+    including (index + 1) * span_ms, split into tile_periods periods that each keep their min and max reading.
+    """
+    if zoom > MAX_ZOOM:
+        return _error(f"zoom must be between 0 and {MAX_ZOOM}")
+    sensor = _get_dao().sensors.get_sensor(sensor_id)
+    if sensor is None:
+        return _unknown_sensor(sensor_id)
+
+    tile = _get_dao().tiles.get_tile(sensor_id, zoom, index, sensor.first_timestamp)
+    response = jsonify(
+        {
+            "sensorId": sensor_id,
+            "zoom": tile.zoom,
+            "index": tile.index,
+            "start": tile.start,
+            "end": tile.end,
+            "complete": tile.complete,
+            "data": [list(point) for point in zip(tile.temperatures.dates, tile.temperatures.temperatures)],
+        }
+    )
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL if tile.complete else EDGE_CACHE_CONTROL
+    return response
+
+
+@API_BLUEPRINT.errorhandler(CircuitOpenError)
+def database_unavailable(e: CircuitOpenError):
+    response = jsonify({"error": str(e)})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(round(e.retry_after_seconds))
+    return response
+
+
+def _get_latest_json(latest_readings: LatestReadings) -> dict:
+    # The stream runs outside of the request context, so the readings are passed in
+    return {
+        sensor_id: [to_epoch_ms(reading["timestamp"]), reading["temp_f"]]
+        for sensor_id, reading in latest_readings.get_all().items()
+    }
+
+
+def _parse_instant(value: Optional[str]) -> Optional[datetime.datetime]:
+    if not value:
+        return None
+
+    if value.isdigit():
+        try:
+            instant = datetime.datetime.fromtimestamp(int(value) / 1000, pytz.UTC)
+        except (ValueError, OverflowError, OSError):
+            raise ValueError(f"Instant {value} is out of range")
+    else:
+        try:
+            instant = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            raise ValueError(f"Invalid instant {value}. Use epoch milliseconds or ISO 8601.")
+
+    # Times without an offset are in the time zone of the sensors, and the others are converted to it here, so an
+    # instant too close to the ends of the calendar to be converted is rejected along with the other invalid ones
+    sensor_timezone = pytz.timezone(DEFAULT_TIMEZONE)
+    try:
+        if instant.tzinfo is None:
+            return sensor_timezone.localize(instant)
+        return instant.astimezone(sensor_timezone)
+    except (ValueError, OverflowError):
+        raise ValueError(f"Instant {value} is out of range")
+
+
+def _error(message: str):
+    return jsonify({"error": message}), 400
+
+
+def _unknown_sensor(sensor_id: str):
+    return jsonify({"error": f"Unknown sensor {sensor_id}"}), 404
+
+
+def _get_dao() -> ApplicationDao:
+    return current_app.config[DATABASE_CONFIG_KEY]
@@ -1,20 +1,29 @@
 import logging
+import os
+from typing import Optional
 
-from flask import Blueprint, current_app, render_template
+from flask import Blueprint, current_app, render_template, request
 
 from application import DisksDao, DISKS_DATABASE_CONFIG_KEY
 from application.constants.app_constants import (
     DATABASE_CONFIG_KEY,
     BEERS_DATABASE_CONFIG_KEY,
     DATETIME_FORMAT_STRING,
+    DEFAULT_TIMEZONE,
+    MAX_RANGE_DAYS,
 )
 from application.constants.beer_constants import ROWDY_USERNAME
+from application.data.circuit_breaker import CircuitOpenError
 from application.data.beer.dao import BeerDao
 from application.data.temperature.dao import ApplicationDao
+from application.data.temperature.downsampling import clamp_points
+from application.data.temperature.temperature_data_set import to_chart_json
 
 LOG = logging.getLogger(__name__)
 HTML_BLUEPRINT = Blueprint("routes_html", __name__)
 DEFAULT_DAYS_BACK = 7
+# How long a temperature page waits for the sensor histories. Any that are late are fetched by the browser instead.
+PAGE_TIME_BUDGET_SECONDS = float(os.environ.get("PAGE_TIME_BUDGET_MS", 300)) / 1000
 
 
 @HTML_BLUEPRINT.route("/")
@@ -29,7 +38,19 @@ def temp_index():
 
 @HTML_BLUEPRINT.route("/temp/<int:days_back>")
 def days_page(days_back: int):
-    return _get_page(days_back)
+    if days_back > MAX_RANGE_DAYS:
+        return f"days must be between 0 and {MAX_RANGE_DAYS}", 400
+
+    # Optionally show a fixed number of points per sensor, whatever the number of days
+    points = clamp_points(request.args.get("points", type=int))
+
+    return _get_page(days_back, points)
+
+
+@HTML_BLUEPRINT.route("/temp/zoom")
+def zoom_page():
+    sensors = _get_dao().sensors.get_sensors()
+    return render_template("temperature/zoom.html", sensors=sensors, timezone=DEFAULT_TIMEZONE)
 
 
 @HTML_BLUEPRINT.route("/beers")
@@ -178,27 +199,25 @@ def books_runs():
     return render_template("games/books_runs.html")
 
 
-def _get_page(days_back: int):
-    dao = _get_dao()
-
-    pi_data_set = dao.get_temperature_history(sensor_id="pi", days_back=days_back)
-    pidown_data_set = dao.get_temperature_history(sensor_id="pidown", days_back=days_back)
-    nsw_data_set = dao.get_temperature_history(sensor_id="KATT", days_back=days_back)
+@HTML_BLUEPRINT.errorhandler(CircuitOpenError)
+def database_unavailable(e: CircuitOpenError):
+    return str(e), 503, {"Retry-After": str(round(e.retry_after_seconds))}
 
-    # Calculate min/max temperatures safely, handling empty data sets
-    all_min_temps = [ds.minimum_temp for ds in [pi_data_set, pidown_data_set, nsw_data_set] if ds.minimum_temp != -1]
-    all_max_temps = [ds.maximum_temp for ds in [pi_data_set, pidown_data_set, nsw_data_set] if ds.maximum_temp != -1]
-    
-    minimum_temp = min(all_min_temps) if all_min_temps else 0
-    maximum_temp = max(all_max_temps) if all_max_temps else 100
 
+def _get_page(days_back: int, points: Optional[int] = None):
+    # The histories that are ready within the budget are sent with the page. The browser fetches the rest from the API.
+    dao = _get_dao()
+    sensors = dao.sensors.get_sensors()
+    histories = dao.view_snapshots.get_ready_temperature_histories(
+        [sensor.sensor_id for sensor in sensors], days_back, points, PAGE_TIME_BUDGET_SECONDS
+    )
     return render_template(
         "temperature/temps.html",
-        piDataSet=pi_data_set,
-        pidownDataSet=pidown_data_set,
-        nswDataSet=nsw_data_set,
-        minimum_temp=minimum_temp,
-        maximum_temp=maximum_temp,
+        sensors=sensors,
+        histories={sensor_id: to_chart_json(sensor_id, data_set) for sensor_id, data_set in histories.items()},
+        days_back=days_back,
+        points=points,
+        timezone=DEFAULT_TIMEZONE,
     )
 
 
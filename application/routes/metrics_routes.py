@@ -0,0 +1,129 @@
+import hmac
+import logging
+import os
+import threading
+import time
+
+from flask import Blueprint, Response, current_app, g, request, before_render_template, template_rendered
+
+from application.constants.app_constants import DATABASE_CONFIG_KEY, SCHEDULER_CONFIG_KEY
+from application.data.local_cache import get_local_cache
+from application.data.metrics import (
+    METRICS,
+    REQUEST_DURATION,
+    RequestTimings,
+    get_breaker_families,
+    get_executor_families,
+    get_job_families,
+    get_local_cache_families,
+    observe_stage,
+    render_families,
+    start_request_timings,
+)
+from application.data.profiler import SamplingProfiler, start_profiled_request
+
+LOG = logging.getLogger(__name__)
+
+METRICS_BLUEPRINT = Blueprint("routes_metrics", __name__)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Requests slower than this are logged with the time spent in each stage
+SLOW_REQUEST_MS = int(os.environ.get("SLOW_REQUEST_MS", 1000))
+# ?__profile=1 returns a report of where the request spent its time, ?__profile=collapsed a flame graph input
+PROFILE_PARAMETER = "__profile"
+PROFILE_FORMAT_COLLAPSED = "collapsed"
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+
+
+@METRICS_BLUEPRINT.route("/metrics")
+def metrics():
+    families = METRICS.collect()
+
+    # Stats that already live elsewhere are read as they are now
+    scheduler = current_app.config.get(SCHEDULER_CONFIG_KEY)
+    if scheduler:
+        families += get_job_families(scheduler.stats())
+    dao = current_app.config.get(DATABASE_CONFIG_KEY)
+    if dao:
+        families += get_executor_families(dao.executor.stats())
+        families += get_breaker_families(dao.breaker.stats())
+    families += get_local_cache_families(get_local_cache().stats())
+
+    return Response(render_families(families), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@METRICS_BLUEPRINT.before_app_request
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+    g.request_timings = start_request_timings()
+
+    profile_format = request.args.get(PROFILE_PARAMETER)
+    if profile_format and _is_admin():
+        g.profiler = SamplingProfiler(threading.get_ident(), start_profiled_request())
+        g.profile_format = profile_format
+        g.profiler.start()
+
+
+@METRICS_BLUEPRINT.after_app_request
+def _record_request_duration(response):
+    # Streamed responses are timed up to their first byte
+    start = g.pop("request_start", None)
+    if start is None:
+        return response
+    duration = time.perf_counter() - start
+    REQUEST_DURATION.observe(duration, request.endpoint or "unmatched")
+
+    request_timings: RequestTimings = g.pop("request_timings")
+    stage_to_seconds = request_timings.get_stage_seconds()
+    # Stages run on several threads at once, so they are labelled as thread time and can add up to more than the total
+    response.headers["Server-Timing"] = ", ".join(
+        [
+            f'{stage};dur={seconds * 1000:.1f};desc="{stage} (thread time)"'
+            for stage, seconds in stage_to_seconds.items()
+        ]
+        + [f'total;dur={duration * 1000:.1f};desc="total (wall clock)"']
+    )
+
+    if duration * 1000 >= SLOW_REQUEST_MS:
+        breakdown = "".join(
+            f"\n  {stage:<16} {family:<32} {seconds * 1000:9.1f} ms  x{count}"
+            for stage, family, seconds, count in request_timings.get_breakdown()
+        )
+        LOG.warning(f"Slow request {request.method} {request.full_path} took {duration * 1000:.0f} ms{breakdown}")
+
+    profiler: SamplingProfiler = g.pop("profiler", None)
+    if profiler is None:
+        return response
+
+    # The page is thrown away and the profile sent in its place
+    profiler.stop()
+    if g.profile_format == PROFILE_FORMAT_COLLAPSED:
+        body = profiler.get_collapsed()
+    else:
+        body = f"{request.method} {request.full_path} took {duration * 1000:.0f} ms\n\n{profiler.get_report()}"
+    profile_response = Response(body, content_type="text/plain; charset=utf-8")
+    profile_response.headers["Server-Timing"] = response.headers["Server-Timing"]
+    profile_response.headers["Cache-Control"] = "no-store"
+    return profile_response
+
+
+def _is_admin() -> bool:
+    # Profiling is off unless a token is configured, and then needs it in a header so it never ends up in a URL
+    admin_token = os.environ.get("ADMIN_TOKEN")
+    given_token = request.headers.get(ADMIN_TOKEN_HEADER)
+    return bool(admin_token and given_token) and hmac.compare_digest(admin_token.encode(), given_token.encode())
+
+
+def _start_template_timer(sender, template, context, **extra):
+    g.setdefault("template_starts", []).append(time.perf_counter())
+
+
+def _record_template_duration(sender, template, context, **extra):
+    template_starts = g.get("template_starts")
+    if template_starts:
+        observe_stage("template_render", template.name, time.perf_counter() - template_starts.pop())
+
+
+@METRICS_BLUEPRINT.record_once
+def _connect_template_signals(state):
+    before_render_template.connect(_start_template_timer, state.app)
+    template_rendered.connect(_record_template_duration, state.app)
@@ -0,0 +1,89 @@
+"""
+Compares the BSON transferred and the time spent decoding a day range of readings with and without a projection,
+and with the raw batch reader. The batches are built in memory the way the server would send them.
+Run from the root of the repo with:
+
+    python -m benchmarks.cursor_benchmark
+"""
+
+import datetime
+import random
+import time
+from typing import Callable, List
+
+import bson
+import numpy as np
+
+from application.data.mongo import BATCH_SIZE
+from application.data.temperature.numpy_decimation import load_raw_readings, load_readings
+
+SECONDS_BETWEEN_READINGS = 30
+NUM_READINGS = 1_000_000
+RUNS = 3
+
+
+def _make_documents() -> List[dict]:
+    random.seed(0)
+    documents = []
+    timestamp = datetime.datetime(2024, 1, 1)
+    for _ in range(NUM_READINGS):
+        documents.append(
+            {
+                "_id": bson.ObjectId(),
+                "sensorId": "pi",
+                "timestamp": timestamp,
+                "temp_f": round(random.uniform(60, 80), 1),
+            }
+        )
+        timestamp += datetime.timedelta(seconds=SECONDS_BETWEEN_READINGS, milliseconds=random.randint(0, 999))
+    return documents
+
+
+def _make_batches(documents: List[dict]) -> List[bytes]:
+    return [
+        b"".join(bson.encode(document) for document in documents[i : i + BATCH_SIZE])  # noqa: E203
+        for i in range(0, len(documents), BATCH_SIZE)
+    ]
+
+
+def _time_loader(loader: Callable, batches: List[bytes]) -> (float, tuple):
+    best = None
+    result = None
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        result = loader(batches)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best, result
+
+
+def _decode_documents(batches: List[bytes]) -> tuple:
+    return load_readings(document for batch in batches for document in bson.decode_all(batch))
+
+
+def main():
+    documents = _make_documents()
+    full_batches = _make_batches(documents)
+    projected_batches = _make_batches(
+        [{"timestamp": document["timestamp"], "temp_f": document["temp_f"]} for document in documents]
+    )
+
+    full_seconds, full_result = _time_loader(_decode_documents, full_batches)
+    projected_seconds, projected_result = _time_loader(_decode_documents, projected_batches)
+    raw_seconds, raw_result = _time_loader(load_raw_readings, projected_batches)
+
+    identical = all(
+        np.array_equal(full_result[i], result[i]) for result in (projected_result, raw_result) for i in range(2)
+    )
+    print(f"{NUM_READINGS} readings in batches of {BATCH_SIZE}, identical output: {identical}")
+    for name, batches, seconds in (
+        ("Full documents", full_batches, full_seconds),
+        ("Projected documents", projected_batches, projected_seconds),
+        ("Projected raw batches", projected_batches, raw_seconds),
+    ):
+        size_mb = sum(len(batch) for batch in batches) / 1024**2
+        print(f"  {name:<22} {size_mb:6.1f} MB  {seconds * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Compares the Python and NumPy decimation engines on synthetic readings.
+Run from the root of the repo with:
+
+    python -m benchmarks.decimation_benchmark
+"""
+
+import datetime
+import random
+import time
+from typing import Callable, List
+
+import pytz
+
+from application.constants.app_constants import DEFAULT_TIMEZONE
+from application.data.temperature.decimation import decimate_documents, get_day_bounds
+from application.data.temperature.numpy_decimation import decimate_documents_numpy
+
+SECONDS_BETWEEN_READINGS = 30
+RUNS = 3
+
+
+def _make_documents(day_bounds) -> List[dict]:
+    random.seed(0)
+    documents = []
+    timestamp = day_bounds[0][0].astimezone(pytz.UTC).replace(tzinfo=None)
+    end = day_bounds[-1][1].astimezone(pytz.UTC).replace(tzinfo=None)
+    temperature = 70.0
+    while timestamp <= end:
+        temperature += random.uniform(-0.5, 0.5)
+        documents.append({"sensorId": "pi", "timestamp": timestamp, "temp_f": round(temperature, 1)})
+        timestamp += datetime.timedelta(seconds=SECONDS_BETWEEN_READINGS, milliseconds=random.randint(0, 999))
+    return documents
+
+
+def _time_engine(engine: Callable, documents, day_bounds, periods_per_day: int) -> (float, list):
+    best = None
+    result = None
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        result = engine(documents, day_bounds, periods_per_day)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best, result
+
+
+def main():
+    now = datetime.datetime.now(pytz.timezone(DEFAULT_TIMEZONE))
+    for days_back, periods_per_day in ((0, 96), (364, 96), (364, 1)):
+        days = [now - datetime.timedelta(days=days_back - i) for i in range(days_back + 1)]
+        day_bounds = [get_day_bounds(day) for day in days]
+        documents = _make_documents(day_bounds)
+
+        python_seconds, python_result = _time_engine(decimate_documents, documents, day_bounds, periods_per_day)
+        numpy_seconds, numpy_result = _time_engine(decimate_documents_numpy, documents, day_bounds, periods_per_day)
+
+        print(
+            f"{len(days)} days, {len(documents)} readings, {periods_per_day} periods per day: "
+            f"python {python_seconds * 1000:.1f} ms, numpy {numpy_seconds * 1000:.1f} ms "
+            f"({python_seconds / numpy_seconds:.1f}x), identical output: {python_result == numpy_result}"
+        )
+
+
+if __name__ == "__main__":
+    main()